@@ -0,0 +1,151 @@
+#!/usr/bin/python
+"""
+n1mm_view archive_events
+This program moves the QSOs of closed events out of the live n1mm_view database, into a
+compact database file for each event, so the live database only holds the current event
+and old QSOs do not slow down the collector or the dashboard.
+
+An event is closed once its end time has passed.  The configured event, EVENT_NAME starting
+at EVENT_START_TIME, is never archived.  Each archive is a complete n1mm_view database
+holding one event, to view it with the dashboard set DATABASE_FILENAME to the archive and
+EVENT_NAME, EVENT_START_TIME and EVENT_END_TIME to the event's.  The QSOs are only deleted
+from the live database after the archive has been written and its QSO count checked.
+
+USAGE:
+
+    python archive_events.py [--list] [--event ID] [--directory archive] [--vacuum]
+
+With no --event, every closed event that has QSOs is archived.
+"""
+
+import argparse
+import logging
+import os
+import re
+import sqlite3
+import time
+
+import n1mm_view_db
+from n1mm_view_constants import *
+from n1mm_view_config import *
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+logging.basicConfig(format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s', datefmt='%Y-%m-%d %H:%M:%S',
+                    level=LOG_LEVEL)
+logging.Formatter.converter = time.gmtime
+
+
+def format_time(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(timestamp))
+
+
+def archive_filename(directory, name, start_time):
+    """
+    the archive file of an event, named for the event and its start date
+    """
+    return os.path.join(directory, '%s_%s.db' % (re.sub(r'[^A-Za-z0-9]+', '_', name).strip('_'),
+                                                 time.strftime('%Y%m%d', time.gmtime(start_time))))
+
+
+def list_events(events, active_event_id):
+    for event_id, name, start_time, end_time, archive, qso_count in events:
+        if event_id == active_event_id:
+            status = 'active'
+        elif archive is not None:
+            status = 'archived to %s' % archive
+        elif end_time < time.time():
+            status = 'closed'
+        else:
+            status = ''
+        logging.info('%4d %-24s %s to %s %7d QSOs %s', event_id, name, format_time(start_time), format_time(end_time),
+                     qso_count, status)
+
+
+def archive_event(db, cursor, event, directory):
+    """
+    copy an event into its archive file, then delete its QSOs from the live database.
+    returns True if the event was archived.
+    """
+    event_id, name, start_time, end_time, archive, qso_count = event
+    filename = archive_filename(directory, name, start_time)
+    if os.path.exists(filename):
+        logging.error('not archiving event %d %s, %s already exists.', event_id, name, filename)
+        return False
+    logging.info('archiving event %d %s, %d QSOs, to %s...', event_id, name, qso_count, filename)
+
+    archive_db = n1mm_view_db.connect(filename, n1mm_view_db.BULK_REBUILD)
+    try:
+        archive_cursor = archive_db.cursor()
+        n1mm_view_db.create_tables(archive_db, archive_cursor, indexes=False)
+        copied = n1mm_view_db.copy_event(archive_db, archive_cursor, DATABASE_FILENAME, event_id)
+        n1mm_view_db.create_qso_log_indexes(archive_cursor)
+        archive_db.commit()
+        archived = n1mm_view_db.event_qso_count(archive_cursor, event_id)
+        # compact it, the archive is never written again
+        archive_db.execute('VACUUM;')
+    finally:
+        archive_db.close()
+
+    if copied != qso_count or archived != qso_count:
+        logging.error('archive of event %d %s has %d QSOs, not %d, the QSOs are not deleted.', event_id, name,
+                      archived, qso_count)
+        return False
+    n1mm_view_db.delete_event_qsos(cursor, event_id, filename)
+    db.commit()
+    logging.info('archived event %d %s.', event_id, name)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='move closed events out of the n1mm_view database.')
+    parser.add_argument('--list', action='store_true', help='list the events and exit')
+    parser.add_argument('--event', type=int, help='archive only this event id')
+    parser.add_argument('--directory', default=ARCHIVE_DIRECTORY,
+                        help='directory to write the archives to, default %s' % ARCHIVE_DIRECTORY)
+    parser.add_argument('--vacuum', action='store_true',
+                        help='shrink the live database file after archiving, best done when the collector is stopped')
+    args = parser.parse_args()
+
+    db = n1mm_view_db.connect(DATABASE_FILENAME, n1mm_view_db.INGEST)
+    cursor = db.cursor()
+    n1mm_view_db.create_tables(db, cursor)
+    active_event_id = n1mm_view_db.active_event_id(db, cursor)
+    events = n1mm_view_db.event_list(cursor)
+    if args.list:
+        list_events(events, active_event_id)
+        db.close()
+        return
+
+    now = time.time()
+    if args.event is not None:
+        events = [event for event in events if event[0] == args.event]
+        if not events:
+            logging.error('no event %d.', args.event)
+    closed = [event for event in events
+              if event[0] != active_event_id and event[3] < now and event[5] > 0]
+    if args.event is not None and events and not closed:
+        logging.error('event %d is not closed, or has no QSOs, not archiving it.', args.event)
+
+    if closed and not os.path.exists(args.directory):
+        os.makedirs(args.directory)
+    archived = 0
+    for event in closed:
+        if archive_event(db, cursor, event, args.directory):
+            archived += 1
+
+    if archived > 0 and args.vacuum:
+        logging.info('vacuuming %s...', DATABASE_FILENAME)
+        try:
+            db.execute('VACUUM;')
+        except sqlite3.OperationalError as e:
+            logging.warn('could not vacuum %s: %s', DATABASE_FILENAME, e)
+    db.close()
+    n1mm_view_db.log_timings()
+    logging.info('%d events archived.', archived)
+
+
+if __name__ == '__main__':
+    main()
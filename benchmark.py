@@ -0,0 +1,314 @@
+#!/usr/bin/python
+"""
+n1mm_view benchmark
+This program times parts of n1mm_view against reproducible synthetic QSO logs, so that
+the effect of changes can be measured without a real contest database.
+
+It runs headless, no display is needed.  For each log size it times:
+  * collector message decode, and decode + insert throughput
+  * rebuild_db throughput, bulk and per-row
+  * each query run by the dashboard's load_data
+  * each chart function: draw_table, make_pie, qso_rates_chart, draw_map
+
+It also compares the QSOs per Hour by Band computation against the original pure python
+implementation, using a 48 hour, 10,000 QSO log.
+
+USAGE:
+
+    python benchmark.py [--sizes 1000,10000,100000,1000000] [--output results.json] [--compare old.json]
+
+Results are written as JSON so that runs from different versions can be compared.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import Queue
+import sqlite3
+import shutil
+import tempfile
+import time
+from collections import Counter
+from xml.dom.minidom import parseString
+
+# run headless
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import collector
+import dashboard
+import matplotlib.dates
+import n1mm_view_db
+import rebuild_db
+import synthetic_log
+from n1mm_view_constants import *
+from n1mm_view_config import *
+from n1mm_view_profile import StageTimer
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+DEFAULT_SIZES = '1000,10000,100000'
+DEFAULT_OUTPUT = 'benchmark_results.json'
+""" the collector commits every QSO, so only this many messages are inserted at each size """
+MAX_COLLECTOR_MESSAGES = 2000
+""" the per-row rebuild commits every QSO, so only this many QSOs are rebuilt that way at each size """
+MAX_PER_ROW_REBUILD_QSOS = 2000
+RATES_QSO_COUNT = 10000
+RATES_LOG_HOURS = 48
+ITERATIONS = 5
+CHART_SIZE = (1824, 984)
+
+
+def time_function(function, *args):
+    """
+    run function ITERATIONS times, return the best time in seconds.
+    """
+    best = None
+    for i in range(0, ITERATIONS):
+        t0 = time.time()
+        function(*args)
+        elapsed = time.time() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def create_database(filename, qsos):
+    db = sqlite3.connect(filename)
+    cursor = db.cursor()
+    collector.create_tables(db, cursor)
+    synthetic_log.load_qso_log(db, cursor, qsos)
+    return db, cursor
+
+
+def benchmark_collector(work_dir, qsos):
+    """
+    time decoding and recording contactinfo messages.
+    """
+    payloads = [synthetic_log.contact_payload(qso) for qso in qsos[:MAX_COLLECTOR_MESSAGES]]
+
+    t0 = time.time()
+    for payload in payloads:
+        dom = parseString(payload)
+        for name in ('timestamp', 'mycall', 'band', 'mode', 'operator', 'StationName', 'rxfreq', 'txfreq',
+                     'call', 'snt', 'rcv', 'exchange1', 'section', 'comment'):
+            collector.get_from_dom(dom, name)
+    decode_time = time.time() - t0
+
+    db = n1mm_view_db.connect(os.path.join(work_dir, 'collector.db'), n1mm_view_db.INGEST)
+    cursor = db.cursor()
+    collector.create_tables(db, cursor)
+    operators = collector.Operators(db, cursor)
+    stations = collector.Stations(db, cursor)
+    event_id = n1mm_view_db.active_event_id(db, cursor)
+    seen = set()
+    t0 = time.time()
+    for payload in payloads:
+        collector.process_message(db, cursor, operators, stations, event_id, payload, seen)
+    insert_time = time.time() - t0
+    db.close()
+
+    return {'collector_decode_per_second': len(payloads) / decode_time,
+            'collector_insert_per_second': len(payloads) / insert_time}
+
+
+def benchmark_rebuild(work_dir, qsos):
+    """
+    compare the bulk rebuild_db path with the original per-row path.
+    """
+    results = {}
+    for name, rebuild, qso_limit in (('rebuild_per_row_per_second', rebuild_db.rebuild, MAX_PER_ROW_REBUILD_QSOS),
+                                     ('rebuild_bulk_per_second', rebuild_db.bulk_rebuild, len(qsos))):
+        n1mm_filename = os.path.join(work_dir, 'n1mm_%s.s3db' % name)
+        view_filename = os.path.join(work_dir, 'view_%s.db' % name)
+        n1mm_db = sqlite3.connect(n1mm_filename)
+        synthetic_log.write_n1mm_log(n1mm_db, qsos[:qso_limit])
+        view_db = n1mm_view_db.connect(view_filename, n1mm_view_db.INGEST)
+        t0 = time.time()
+        count = rebuild(n1mm_db, view_db)
+        results[name] = count / (time.time() - t0)
+        n1mm_db.close()
+        view_db.close()
+        os.remove(n1mm_filename)
+        os.remove(view_filename)
+    return results
+
+
+def benchmark_load_data(database_filename, base_map):
+    """
+    time each query run by load_data, and load_data as a whole.
+    load_data also renders every chart, so its total includes the charts.
+    the query budget is lifted, so that every query runs to the end and is timed.
+    """
+    query_timer = StageTimer(True)
+    saved_query_timer = n1mm_view_db.query_timer
+    saved_database_filename = dashboard.DATABASE_FILENAME
+    saved_budget = dashboard.query_budget.seconds
+    n1mm_view_db.query_timer = query_timer
+    dashboard.DATABASE_FILENAME = database_filename
+    dashboard.query_budget.seconds = None
+    try:
+        t0 = time.time()
+        dashboard.load_data(CHART_SIZE, Queue.Queue(), base_map, 0)
+        total = time.time() - t0
+    finally:
+        n1mm_view_db.query_timer = saved_query_timer
+        dashboard.DATABASE_FILENAME = saved_database_filename
+        dashboard.query_budget.seconds = saved_budget
+        dashboard.close_read_connection()
+
+    results = {'load_data': total}
+    for stage, timings in query_timer.timings.items():
+        results['query: %s' % stage[len('query_'):]] = sum(timings)
+    return results
+
+
+def benchmark_charts(db, cursor, qsos, base_map):
+    """
+    time each chart function, with data computed from the synthetic log.
+    """
+    qso_operators = Counter(qso['operator'] for qso in qsos).most_common()
+    qso_stations = Counter(qso['station'] for qso in qsos).most_common()
+    qsos_by_section = dict(Counter(qso['section'] for qso in qsos))
+    qso_band_modes = [[0] * 4 for _ in Bands.BANDS_LIST]
+    for qso in qsos:
+        qso_band_modes[Bands.get_band_number(qso['band'])][Modes.get_simple_mode_number(qso['mode'])] += 1
+    qsos_per_hour = dashboard.load_qso_rates(cursor, n1mm_view_db.active_event_id(db, cursor),
+                                             RATE_BUCKET_MINUTES)
+
+    return {'chart: draw_table': time_function(dashboard.qso_summary_table, CHART_SIZE, qso_band_modes),
+            'chart: make_pie': time_function(dashboard.qso_operators_graph, CHART_SIZE, qso_operators),
+            'chart: make_pie stations': time_function(dashboard.qso_stations_graph, CHART_SIZE, qso_stations),
+            'chart: qso_rates_chart': time_function(dashboard.qso_rates_chart, CHART_SIZE, qsos_per_hour),
+            'chart: draw_map': time_function(dashboard.draw_map, CHART_SIZE, qsos_by_section, base_map),
+            }
+
+
+def legacy_qso_rates(cursor, bucket_minutes):
+    """
+    the original QSOs per Hour by Band computation from load_data and qso_rates_chart,
+    kept here to measure the NumPy implementation against.
+    """
+    qsos_per_hour = []
+    slices_per_hour = 60 / bucket_minutes
+    window_seconds = bucket_minutes * 60
+    cursor.execute('SELECT timestamp / %d * %d AS ts, band_id, COUNT(*) AS qso_count \n'
+                   'FROM qso_log GROUP BY ts, band_id;' % (window_seconds, window_seconds))
+    for row in cursor:
+        if len(qsos_per_hour) == 0:
+            qsos_per_hour.append([0] * Bands.count())
+            qsos_per_hour[-1][0] = row[0]
+        while qsos_per_hour[-1][0] != row[0]:
+            ts = qsos_per_hour[-1][0] + window_seconds
+            qsos_per_hour.append([0] * Bands.count())
+            qsos_per_hour[-1][0] = ts
+        qsos_per_hour[-1][row[1]] = row[2] * slices_per_hour
+
+    for rec in qsos_per_hour:
+        rec[0] = datetime.datetime.utcfromtimestamp(rec[0])
+
+    qso_counts = [[] for _ in range(0, Bands.count())]
+    for qpm in qsos_per_hour:
+        for i in range(0, Bands.count()):
+            qso_counts[i].append(qpm[i])
+    dates = matplotlib.dates.date2num(qso_counts[0])
+    return dates, qso_counts[1:]
+
+
+def benchmark_qso_rates():
+    """
+    compare the NumPy QSO rates computation with the original.
+    """
+    qsos = list(synthetic_log.SyntheticLog(RATES_QSO_COUNT, hours=RATES_LOG_HOURS).qsos())
+    db, cursor = create_database(':memory:', qsos)
+    legacy_time = time_function(legacy_qso_rates, cursor, RATE_BUCKET_MINUTES)
+    numpy_time = time_function(dashboard.load_qso_rates, cursor, n1mm_view_db.active_event_id(db, cursor),
+                               RATE_BUCKET_MINUTES)
+    db.close()
+    return {'qso_rates legacy': legacy_time, 'qso_rates numpy': numpy_time}
+
+
+def benchmark_size(work_dir, qso_count, base_map):
+    logging.info('benchmarking %d QSOs...', qso_count)
+    t0 = time.time()
+    qsos = list(synthetic_log.SyntheticLog(qso_count).qsos())
+    database_filename = os.path.join(work_dir, 'n1mm_view_%d.db' % qso_count)
+    db, cursor = create_database(database_filename, qsos)
+    results = {'generate_and_load': time.time() - t0}
+    results.update(benchmark_collector(work_dir, qsos))
+    results.update(benchmark_rebuild(work_dir, qsos))
+    results.update(benchmark_load_data(database_filename, base_map))
+    results.update(benchmark_charts(db, cursor, qsos, base_map))
+    db.close()
+    return results
+
+
+def report(results, previous):
+    """
+    log the results, with the ratio to the previous results if there are any.
+    throughput results are per second, bigger is better; everything else is seconds.
+    """
+    for size in sorted(results, key=lambda s: int(s) if s.isdigit() else 0):
+        logging.info('--- %s ---', size)
+        for name in sorted(results[size]):
+            value = results[size][name]
+            old = previous.get(size, {}).get(name)
+            if old:
+                logging.info('%-60s %12.4f  (%.2fx previous)', name[:60], value, value / old)
+            else:
+                logging.info('%-60s %12.4f', name[:60], value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark n1mm_view against synthetic logs.')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='comma separated list of log sizes')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='file to write JSON results to')
+    parser.add_argument('--compare', help='JSON results from an earlier run to compare with')
+    args = parser.parse_args()
+
+    logging.info('benchmark started...')
+    # the collector logs every QSO, that is not what is being measured here.
+    logging.getLogger().setLevel(logging.WARN)
+    # do not write PNG files or run the post processing command
+    dashboard.SAVE_PNG = False
+    dashboard.postProcessing = False
+    dashboard.import_charting()
+
+    work_dir = tempfile.mkdtemp(prefix='n1mm_view_benchmark')
+    results = {}
+    try:
+        t0 = time.time()
+        base_map = dashboard.create_map()
+        create_map_time = time.time() - t0
+        results['rates'] = benchmark_qso_rates()
+        results['rates']['create_map'] = create_map_time
+        for size in args.sizes.split(','):
+            results[size.strip()] = benchmark_size(work_dir, int(size), base_map)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    logging.getLogger().setLevel(logging.INFO)
+    previous = {}
+    if args.compare is not None:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+    report(results, previous)
+    logging.info('QSO rates, %d QSOs over %d hours: numpy is %.1fx faster than legacy',
+                 RATES_QSO_COUNT, RATES_LOG_HOURS,
+                 results['rates']['qso_rates legacy'] / results['rates']['qso_rates numpy'])
+
+    with open(args.output, 'w') as f:
+        json.dump({'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()),
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'matplotlib': matplotlib.__version__,
+                   'results': results}, f, indent=2, sort_keys=True)
+    logging.info('benchmark done, results written to %s', args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,108 +10,203 @@ import logging
 import sqlite3
 import time
 from hashlib import md5
-from socket import socket, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_BROADCAST, SO_REUSEADDR
+from socket import socket, timeout as socket_timeout, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_BROADCAST, SO_REUSEADDR
 from xml.dom.minidom import parseString
 
+import n1mm_view_db
+import n1mm_view_log
 from n1mm_view_constants import *
 from n1mm_view_config import *
+from n1mm_view_db import Operators, Stations, create_tables, checkpoint
+from n1mm_view_notify import ChangePublisher, CHANGE_NEW, CHANGE_REPLACE, CHANGE_DELETE, CHANGE_RADIO
+from n1mm_view_sse import start_event_server, EVENT_CONTACT, EVENT_REPLACE, EVENT_DELETE
 
 __author__ = 'Jeffrey B. Otterson, N1KDO'
 __copyright__ = 'Copyright 2016 Jeffrey B. Otterson'
 __license__ = 'Simplified BSD'
 
-BROADCAST_BUF_SIZE = 2048
+# dynamicresults score broadcasts with a full breakdown are larger than contact broadcasts
+BROADCAST_BUF_SIZE = 16384
+# seconds without broadcasts after which the listener is idle and may checkpoint the WAL
+CHECKPOINT_IDLE_TIME = 2
+# a checkpoint is run even when the listener is busy once it is this many checkpoint intervals overdue
+CHECKPOINT_OVERDUE_INTERVALS = 5
+# seconds to wait before the first retry of a locked database write, doubled for each retry
+WRITE_RETRY_DELAY = 0.05
+# the number of locked database writes retried by write_with_retry
+write_retry_count = 0
+# an unchanged radio's status is written again after this many seconds, so the dashboard knows it is still there
+RADIO_STATUS_REFRESH_INTERVAL = RADIO_STATUS_STALE_TIME / 4
 
 logging.basicConfig(format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s', datefmt='%Y-%m-%d %H:%M:%S',
                     level=LOG_LEVEL)
 logging.Formatter.converter = time.gmtime
+n1mm_view_log.start(LOG_QUEUE_SIZE)
 
 
-class Operators:
-    operators = {}
-    db = None
-    cursor = None
+def write_with_retry(db, function, *args):
+    """
+    call function(db, *args), a database write, retrying a bounded number of times
+    if the database is locked.  returns the function's result.
+    """
+    global write_retry_count
+    attempt = 0
+    while True:
+        try:
+            return function(db, *args)
+        except sqlite3.OperationalError as e:
+            if ('locked' not in str(e) and 'busy' not in str(e)) or attempt >= DATABASE_WRITE_RETRIES:
+                raise
+            db.rollback()
+            attempt += 1
+            write_retry_count += 1
+            logging.warn('database is locked, retry %d of %d: %s', attempt, DATABASE_WRITE_RETRIES, e)
+            time.sleep(WRITE_RETRY_DELAY * 2 ** (attempt - 1))
+
+
+class RadioStatus:
+    """
+    the latest RadioInfo of each radio, by (station name, radio number).
+    N1MM+ sends RadioInfo several times a second for every radio, so it is kept in memory,
+    and a radio's row in the radio_status table is written at most once every write_interval
+    seconds, when it has changed, or when the row is getting old.
+    if publisher is set, a change notification is published for each changed radio written.
+    """
+
+    def __init__(self, write_interval, refresh_interval, publisher=None):
+        self.write_interval = write_interval
+        self.refresh_interval = refresh_interval
+        self.publisher = publisher
+        self.radios = {}  # (station name, radio number) -> (freq, tx freq, band id, mode id, operator, running)
+        self.heard = {}  # (station name, radio number) -> time of the last RadioInfo
+        self.written = {}  # (station name, radio number) -> time of the last write
+        self.changed = set()
+        self.messages = 0
+        self.writes = 0
+
+    def update(self, station, radio_nr, freq, tx_freq, mode, operator, running, received_time):
+        key = (station, radio_nr)
+        status = (freq, tx_freq, Bands.get_band_number_for_frequency(freq), Modes.get_mode_number(mode) or 0,
+                  operator, 1 if running else 0)
+        if self.radios.get(key) != status:
+            self.radios[key] = status
+            self.changed.add(key)
+        self.heard[key] = received_time
+        self.messages += 1
+
+    def due(self, now):
+        """
+        the radios to write now
+        """
+        return [key for key, heard in self.heard.items()
+                if now - self.written.get(key, 0) >= self.write_interval and
+                (key in self.changed or heard - self.written.get(key, 0) >= self.refresh_interval)]
 
-    def __init__(self, db, cursor):
-        self.db = db
-        self.cursor = cursor
-        # load operators
-        self.cursor.execute('SELECT id, name FROM operator;')
-        for row in self.cursor:
-            self.operators[row[1]] = row[0]
+    def write(self, db, cursor, now=None):
+        """
+        write the radios that are due, returns the number written
+        """
+        if now is None:
+            now = time.time()
+        due = self.due(now)
+        if due:
+            n1mm_view_db.upsert_radio_status(cursor, [key + self.radios[key] + (int(self.heard[key]),)
+                                                      for key in due])
+            db.commit()
+            for key in due:
+                if key in self.changed and self.publisher is not None:
+                    freq, tx_freq, band_id, mode_id, operator, running = self.radios[key]
+                    self.publisher.publish(CHANGE_RADIO, None, Bands.BANDS_LIST[band_id], operator, None)
+                self.changed.discard(key)
+                self.written[key] = now
+            self.writes += len(due)
+        return len(due)
+
+
+class ScoreSnapshots:
+    """
+    the score of an event from N1MM+ dynamicresults broadcasts.
+    N1MM+ broadcasts the score every time it is recalculated, so the latest is kept in memory,
+    and at most once every write_interval seconds a snapshot is written with only the
+    breakdown fields that changed since the previous snapshot.  the current score row,
+    with the score and QSO trends per hour over trend_seconds, is written at the same time,
+    so the dashboard reads it with one lookup.
+    """
 
-    def lookup_operator_id(self, operator):
+    def __init__(self, event_id, write_interval, trend_seconds):
+        self.event_id = event_id
+        self.write_interval = write_interval
+        self.trend_seconds = trend_seconds
+        self.latest = None  # (received time, score, QSOs, fields) of the latest dynamicresults
+        self.fields = None  # the fields of the last snapshot written, read from the database when first needed
+        self.totals = None  # (score, QSOs) of the last snapshot written
+        self.written = 0
+        self.messages = 0
+        self.snapshots = 0
+        self.deltas = 0
+
+    def update(self, score, qsos, fields, received_time):
+        self.latest = (int(received_time), score, qsos, fields)
+        self.messages += 1
+
+    def due(self, now):
+        return self.latest is not None and now - self.written >= self.write_interval
+
+    def write(self, db, cursor, now=None):
         """
-        lookup the operator id for the supplied operator text.
-        if the operator is not found, create it.
+        write a snapshot of the latest score if it is due and changed, and the current score if it is due.
+        returns the number of changed fields written.
         """
-        oid = self.operators.get(operator)
-        if oid is None:
-            self.cursor.execute("insert into operator (name) values (?);", (operator,))
-            self.db.commit()
-            oid = self.cursor.lastrowid
-            self.operators[operator] = oid
-        return oid
-
-
-class Stations:
-    stations = {}
-    db = None
-    cursor = None
-
-    def __init__(self, db, cursor):
-        self.db = db
-        self.cursor = cursor
-        self.cursor.execute('SELECT id, name FROM station;')
-        for row in self.cursor:
-            self.stations[row[1]] = row[0]
-
-    def lookup_station_id(self, station):
-        sid = self.stations.get(station)
-        if sid is None:
-            self.cursor.execute("insert into station (name) values (?);", (station,))
-            self.db.commit()
-            sid = self.cursor.lastrowid
-            self.stations[station] = sid
-        return sid
-
-
-def create_tables(db, cursor):
+        if now is None:
+            now = time.time()
+        if not self.due(now):
+            return 0
+        timestamp, score, qsos, fields = self.latest
+        if self.fields is None:
+            self.fields = n1mm_view_db.score_fields(cursor, self.event_id)
+            row = n1mm_view_db.score_at(cursor, self.event_id, 2 ** 62)
+            self.totals = row[1:] if row is not None else None
+        changes = [(field, value) for field, value in fields.items() if self.fields.get(field) != value]
+        changes.extend((field, None) for field in self.fields if field not in fields)
+        snapshot = changes or (score, qsos) != self.totals
+        if snapshot:
+            n1mm_view_db.insert_score_snapshot(cursor, self.event_id, timestamp, score, qsos, changes)
+        score_trend = 0
+        qso_trend = 0
+        row = n1mm_view_db.score_at(cursor, self.event_id, timestamp - self.trend_seconds)
+        if row is not None:
+            seconds = timestamp - max(row[0], timestamp - self.trend_seconds)
+            if seconds > 0:
+                score_trend = (score - row[1]) * 3600 // seconds
+                qso_trend = (qsos - row[2]) * 3600 // seconds
+        n1mm_view_db.upsert_current_score(cursor, self.event_id, timestamp, score, qsos, score_trend, qso_trend)
+        db.commit()
+        self.fields = fields
+        self.totals = (score, qsos)
+        self.latest = None
+        self.written = now
+        if snapshot:
+            self.snapshots += 1
+            self.deltas += len(changes)
+        return len(changes)
+
+
+def parse_score(dom):
     """
-    set up the database tables
+    the score, total QSOs and breakdown fields of a dynamicresults message.
+    the fields are the contest and call, and each breakdown count, named for its
+    element, band and mode, like "qso 20 CW", and its type when it has one, like
+    mult elements do, "mult total ALL section".
     """
-    cursor.execute('CREATE TABLE IF NOT EXISTS operator\n'
-                   '    (id INTEGER PRIMARY KEY NOT NULL, \n'
-                   '    name char(12) NOT NULL);')
-    cursor.execute('CREATE INDEX IF NOT EXISTS operator_name ON operator(name);')
-
-    cursor.execute('CREATE TABLE IF NOT EXISTS station\n'
-                   '    (id INTEGER PRIMARY KEY NOT NULL, \n'
-                   '    name char(12) NOT NULL);')
-    cursor.execute('CREATE INDEX IF NOT EXISTS station_name ON station(name);')
-
-    cursor.execute('CREATE TABLE IF NOT EXISTS qso_log\n'
-                   #'    (id INTEGER PRIMARY KEY NOT NULL,\n'
-                   '     (timestamp INTEGER NOT NULL,\n'
-                   '     mycall char(12) NOT NULL,\n'
-                   '     band_id INTEGER NOT NULL,\n'
-                   '     mode_id INTEGER NOT NULL,\n'
-                   '     operator_id INTEGER NOT NULL,\n'
-                   '     station_id INTEGER NOT NULL,\n'
-                   '     rx_freq INTEGER NOT NULL,\n'
-                   '     tx_freq INTEGER NOT NULL,\n'
-                   '     callsign char(12) NOT NULL,\n'
-                   '     rst_sent char(3),\n'
-                   '     rst_recv char(3),\n'
-                   '     exchange char(4),\n'
-                   '     section char(4),\n'
-                   '     comment TEXT);')
-    cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_band_id ON qso_log(band_id);')
-    cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_mode_id ON qso_log(mode_id);')
-    cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_operator_id ON qso_log(operator_id);')
-    cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_station_id ON qso_log(station_id);')
-    cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_section ON qso_log(section);')
-    db.commit()
+    fields = {'contest': get_from_dom(dom, 'contest'), 'call': get_from_dom(dom, 'call')}
+    for breakdown in dom.getElementsByTagName('breakdown'):
+        for node in breakdown.childNodes:
+            if node.nodeType == node.ELEMENT_NODE and node.firstChild is not None:
+                name = '%s %s %s' % (node.tagName, node.getAttribute('band'), node.getAttribute('mode'))
+                if node.getAttribute('type'):
+                    name = '%s %s' % (name, node.getAttribute('type'))
+                fields[name] = int(node.firstChild.nodeValue)
+    return int(get_from_dom(dom, 'score') or 0), fields.get('qso total ALL', 0), fields
 
 
 def checksum(data):
@@ -147,7 +242,7 @@ def get_from_dom(dom, name):
         return ''
 
 
-def record_contact(db, cursor, operators, stations,
+def record_contact(db, cursor, operators, stations, event_id,
                    timestamp, mycall, band, mode, operator, station,
                    rx_freq, tx_freq, callsign, rst_sent, rst_recv,
                    exchange, section, comment):
@@ -159,45 +254,52 @@ def record_contact(db, cursor, operators, stations,
     operator_id = operators.lookup_operator_id(operator)
     station_id = stations.lookup_station_id(station)
 
-    logging.info('QSO: %s %6s %4s %-6s %-12s %-12s %10d %10d %-6s %3s %3s %3s %-3s %-3s' % (
-        time.strftime('%Y-%m-%d %H:%M:%S', timestamp),
-        mycall, band,
-        mode, operator,
-        station, rx_freq, tx_freq, callsign, rst_sent,
-        rst_recv, exchange, section, comment))
-
-    cursor.execute(
-        'insert into qso_log \n'
-        '    (timestamp, mycall, band_id, mode_id, operator_id, station_id , rx_freq, tx_freq, \n'
-        '     callsign, rst_sent, rst_recv, exchange, section, comment)\n'
-        '    values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
-        (calendar.timegm(timestamp), mycall, band_id, mode_id, operator_id, station_id, rx_freq, tx_freq,
-         callsign, rst_sent, rst_recv, exchange, section, comment))
+    logging.info('QSO: %s %6s %4s %-6s %-12s %-12s %10d %10d %-6s %3s %3s %3s %-3s %-3s',
+                 time.strftime('%Y-%m-%d %H:%M:%S', timestamp),
+                 mycall, band,
+                 mode, operator,
+                 station, rx_freq, tx_freq, callsign, rst_sent,
+                 rst_recv, exchange, section, comment)
+
+    n1mm_view_db.insert_qso(cursor, (calendar.timegm(timestamp), mycall, band_id, mode_id, operator_id, station_id,
+                                     rx_freq, tx_freq, callsign, rst_sent, rst_recv, exchange, section, comment,
+                                     event_id))
 
     db.commit()
 
-def delete_contact(db, cursor, timestamp, station, callsign):
+def delete_contact(db, cursor, event_id, timestamp, station, callsign):
     """
-    Delete the results of a delete in N1MM
+    Delete the results of a delete in N1MM, from the event event_id
+    returns a list of (band, operator, section) for the deleted QSOs
     """
     
     """ station_id = stations.lookup_station_id(station)
 """
 
-    logging.info('DELETEQSO: %s, timestamp = %s' % (callsign,calendar.timegm(timestamp)))
+    logging.info('DELETEQSO: %s, timestamp = %s', callsign, calendar.timegm(timestamp))
     try:
-       cursor.execute(
-        "delete from qso_log where callsign = ? and timestamp = ?" ,(callsign, calendar.timegm(timestamp),))
+       deleted = [(Bands.BANDS_LIST[row[0]], row[1], row[2])
+                  for row in n1mm_view_db.delete_qso(cursor, event_id, calendar.timegm(timestamp), callsign)]
        db.commit()
+       return deleted
+    except sqlite3.OperationalError:
+       # let write_with_retry retry it
+       raise
     except Exception as e:
        logging.exception('Exception deleting contact from db.')
-       return ''
+       return []
    
 
 
-def process_message(db, cursor, operators, stations, data, seen):
+def process_message(db, cursor, operators, stations, event_id, data, seen, publisher=None, event_stream=None,
+                    received_time=None, radio_status=None, score_snapshots=None):
     """
-    Process a N1MM+ contactinfo message
+    Process a N1MM+ contactinfo message, QSOs are recorded for the event event_id.
+    if radio_status is set, RadioInfo messages update it.
+    if score_snapshots is set, dynamicresults messages update it.
+    if publisher is set, a change notification is published after the database is updated,
+    with received_time and the commit time for latency tracing.
+    if event_stream is set, the decoded message is published to the QSO event stream.
     """
     #logging.debug(data)
     dom = parseString(data)
@@ -226,12 +328,33 @@ def process_message(db, cursor, operators, stations, data, seen):
         # convert qso_timestamp to datetime object
         timestamp = convert_timestamp(qso_timestamp)
 
-        record_contact(db, cursor, operators, stations,
-                       timestamp, mycall, band, mode, operator, station,
-                       rx_freq, tx_freq, callsign, rst_sent, rst_recv,
-                       exchange, section, comment)
+        write_with_retry(db, record_contact, cursor, operators, stations, event_id,
+                         timestamp, mycall, band, mode, operator, station,
+                         rx_freq, tx_freq, callsign, rst_sent, rst_recv,
+                         exchange, section, comment)
+        committed_time = time.time()
+        is_new = dom.getElementsByTagName("contactinfo").length == 1
+        if publisher is not None:
+            change = CHANGE_NEW if is_new else CHANGE_REPLACE
+            publisher.publish(change, calendar.timegm(timestamp), band, operator, section,
+                              received_time, committed_time)
+        if event_stream is not None:
+            event_stream.publish(EVENT_CONTACT if is_new else EVENT_REPLACE,
+                                 {'timestamp': qso_timestamp, 'mycall': mycall, 'band': band, 'mode': mode,
+                                  'operator': operator, 'station': station, 'rx_freq': rx_freq, 'tx_freq': tx_freq,
+                                  'call': callsign, 'rst_sent': rst_sent, 'rst_recv': rst_recv,
+                                  'exchange': exchange, 'section': section, 'comment': comment})
     elif dom.getElementsByTagName("RadioInfo").length == 1:
-       logging.debug("Received radioInfo message")
+       if radio_status is not None:
+           try:
+               radio_status.update(get_from_dom(dom, "StationName"), int(get_from_dom(dom, "RadioNr") or 0),
+                                   int(get_from_dom(dom, "Freq") or 0) * 10,  # convert to Hz
+                                   int(get_from_dom(dom, "TXFreq") or 0) * 10,
+                                   get_from_dom(dom, "Mode"), get_from_dom(dom, "OpCall"),
+                                   get_from_dom(dom, "IsRunning") == 'True', received_time or time.time())
+           except ValueError:
+               logging.warn('bad RadioInfo message, ignoring.')
+               logging.debug(data)
     elif dom.getElementsByTagName("contactdelete").length == 1:
        qso_timestamp = get_from_dom(dom, "timestamp")
        callsign = get_from_dom(dom, "call")
@@ -239,14 +362,48 @@ def process_message(db, cursor, operators, stations, data, seen):
        station = station_name
        # convert qso_timestamp to datetime object
        timestamp = convert_timestamp(qso_timestamp)
-       delete_contact(db, cursor, timestamp, station, callsign)
+       deleted = write_with_retry(db, delete_contact, cursor, event_id, timestamp, station, callsign)
+       committed_time = time.time()
+       if publisher is not None:
+           for band, operator, section in deleted:
+               publisher.publish(CHANGE_DELETE, calendar.timegm(timestamp), band, operator, section,
+                                 received_time, committed_time)
+       if event_stream is not None:
+           event_stream.publish(EVENT_DELETE, {'timestamp': qso_timestamp, 'call': callsign, 'station': station})
     elif dom.getElementsByTagName("dynamicresults").length == 1:
-       logging.debug("Received Score message")   
+       logging.debug("Received Score message")
+       if score_snapshots is not None:
+           try:
+               score, qsos, fields = parse_score(dom)
+               score_snapshots.update(score, qsos, fields, received_time or time.time())
+           except ValueError:
+               logging.warn('bad dynamicresults message, ignoring.')
+               logging.debug(data)
     else:
         logging.warn('unknown message received, ignoring.')
         logging.debug(data)
 
 
+def write_radio_status(db, cursor, radio_status):
+    """
+    write the radio status that is due, a failed write is tried again next time
+    """
+    try:
+        write_with_retry(db, radio_status.write, cursor)
+    except sqlite3.OperationalError as e:
+        logging.warn('could not write radio status: %s', e)
+
+
+def write_score_snapshots(db, cursor, score_snapshots):
+    """
+    write the score snapshot if it is due, a failed write is tried again next time
+    """
+    try:
+        write_with_retry(db, score_snapshots.write, cursor)
+    except sqlite3.OperationalError as e:
+        logging.warn('could not write score snapshot: %s', e)
+
+
 def listener(db, cursor):
     """
     this is the UDP listener, the main loop.
@@ -262,27 +419,73 @@ def listener(db, cursor):
 
     operators = Operators(db, cursor)
     stations = Stations(db, cursor)
+    event_id = n1mm_view_db.active_event_id(db, cursor)
+    score_snapshots = ScoreSnapshots(event_id, SCORE_SNAPSHOT_INTERVAL, SCORE_TREND_MINUTES * 60)
+
+    publisher = None
+    if CHANGE_NOTIFY_PORT is not None:
+        publisher = ChangePublisher(CHANGE_NOTIFY_PORT)
+    radio_status = RadioStatus(RADIO_STATUS_WRITE_INTERVAL, RADIO_STATUS_REFRESH_INTERVAL, publisher)
+
+    event_stream = None
+    if QSO_EVENT_PORT is not None:
+        try:
+            event_stream = start_event_server(QSO_EVENT_PORT, QSO_EVENT_REPLAY_SIZE, QSO_EVENT_CLIENT_QUEUE_SIZE)
+        except Exception as e:
+            logging.exception('Could not start the QSO event stream.', exc_info=e)
+
+    # wake up when idle to checkpoint and to write radio status and score snapshots
+    s.settimeout(min(CHECKPOINT_IDLE_TIME, RADIO_STATUS_WRITE_INTERVAL))
+    last_checkpoint_time = time.time()
 
     seen = set()
     run = True
     while run:
         try:
-            udp_data = s.recv(BROADCAST_BUF_SIZE)
-            process_message(db, cursor, operators, stations, udp_data, seen)
+            try:
+                udp_data = s.recv(BROADCAST_BUF_SIZE)
+            except socket_timeout:
+                write_radio_status(db, cursor, radio_status)
+                write_score_snapshots(db, cursor, score_snapshots)
+                # idle, a good time to checkpoint
+                if DATABASE_WAL and time.time() - last_checkpoint_time >= WAL_CHECKPOINT_INTERVAL:
+                    checkpoint(db)
+                    last_checkpoint_time = time.time()
+                continue
+            received_time = time.time()
+            try:
+                process_message(db, cursor, operators, stations, event_id, udp_data, seen, publisher,
+                                event_stream, received_time, radio_status, score_snapshots)
+            except sqlite3.OperationalError as e:
+                logging.exception('could not write to the database, message lost.', exc_info=e)
+            write_radio_status(db, cursor, radio_status)
+            write_score_snapshots(db, cursor, score_snapshots)
+            if DATABASE_WAL and \
+                    time.time() - last_checkpoint_time >= WAL_CHECKPOINT_INTERVAL * CHECKPOINT_OVERDUE_INTERVALS:
+                checkpoint(db)
+                last_checkpoint_time = time.time()
 
         except KeyboardInterrupt:
             logging.info('Keyboard interrupt, shutting down...')
             s.close()
+            if publisher is not None:
+                publisher.close()
             run = False
+    logging.info('%d RadioInfo messages, %d radio status writes', radio_status.messages, radio_status.writes)
+    logging.info('%d dynamicresults messages, %d score snapshots, %d changed fields',
+                 score_snapshots.messages, score_snapshots.snapshots, score_snapshots.deltas)
 
 
 def main():
     logging.info('Collector started...')
-    db = sqlite3.connect(DATABASE_FILENAME)
+    db = n1mm_view_db.connect(DATABASE_FILENAME, n1mm_view_db.INGEST)
     cursor = db.cursor()
     create_tables(db, cursor)
     listener(db, cursor)
     db.close()
+    n1mm_view_db.log_timings()
+    if n1mm_view_log.dropped():
+        logging.warn('%d log messages were dropped.', n1mm_view_log.dropped())
 
     logging.info('Collector done...')
 
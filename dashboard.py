@@ -5,28 +5,27 @@ This program displays QSO statistics collected by the collector.
 """
 
 import logging
-import calendar
 import os
 import gc
 import multiprocessing
+import pickle
 import pygame
+import Queue
 import sqlite3
 import sys
+import threading
 import time
-import matplotlib
 import re
+import zlib
 
-#  This makes the code analyzer angry, as python standards say to put imports ahead of all executable code.
-#  But... it MUST be RIGHT HERE so matplotlib does not try to use the wrong backend.
-matplotlib.use('Agg')
-import matplotlib.backends.backend_agg as agg
-import matplotlib.pyplot as plt
-from matplotlib.dates import HourLocator, DateFormatter
-from mpl_toolkits.basemap import Basemap
-import numpy as np
-
+import n1mm_view_db
+import n1mm_view_log
 from n1mm_view_constants import *
 from n1mm_view_config import *
+from n1mm_view_frames import FrameCache, data_fingerprint
+from n1mm_view_notify import ChangeListener, CHANGE_RADIO
+from n1mm_view_httpd import ChartStore, start_chart_server
+from n1mm_view_profile import StageTimer, CycleProfiler, LatencyTracker, MemoryWatchdog, make_trace
 
 __author__ = 'Jeffrey B. Otterson, N1KDO'
 __copyright__ = 'Copyright 2016 Jeffrey B. Otterson'
@@ -60,17 +59,48 @@ QSO_BANDS_PIE_INDEX = 6
 QSO_MODES_PIE_INDEX = 7
 QSO_RATE_CHART_IMAGE_INDEX = 8
 SECTIONS_WORKED_MAP_INDEX = 9
-IMAGE_COUNT = 10
+STATION_STATUS_TABLE_INDEX = 10
+IMAGE_COUNT = 11
+
+# names of the images, used for the built-in web server
+IMAGE_NAMES = ['logo', 'qso_summary_table', 'qso_rates_table', 'qso_operators_graph', 'qso_operators_table',
+               'qso_stations_graph', 'qso_bands_graph', 'qso_modes_graph', 'qso_rates_chart', 'qsos_by_section',
+               'station_status_table']
 
 IMAGE_MESSAGE = 1
 CRAWL_MESSAGE = 2
+RECYCLE_MESSAGE = 3
 
 IMAGE_FORMAT = 'RGB'
+# zlib level used to compress the pages the display is not showing, fast beats small here
+PAGE_COMPRESSION_LEVEL = 1
+# seconds of each display frame that may be spent taking messages off the queue and storing pages.
+# images are made into pages on the page maker thread, frames over the budget are logged with the page store report.
+FRAME_TIME_BUDGET = 0.010
+# minutes between moves of the night shading on the map, the map is redrawn when it moves
+MAP_SHADE_MINUTES = 10
+# seconds between chart cycles while the whole-log counts are still catching up
+CATCH_UP_DWELL_TIME = 1
+# seconds a recycled chart engine has to exit before it is killed
+RECYCLE_EXIT_TIME = 60
 SAVE_PNG = False
 
+# matplotlib, Basemap and numpy are slow to import and only the chart engine needs them,
+# so the display starts quickly.  import_charting() imports them.
+matplotlib = None
+agg = None
+plt = None
+HourLocator = None
+DateFormatter = None
+Basemap = None
+np = None
+# matplotlib date number of the unix epoch, used to convert epoch seconds to matplotlib dates
+EPOCH_DATE_NUMBER = None
+
 logging.basicConfig(format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s', datefmt='%Y-%m-%d %H:%M:%S',
                     level=LOG_LEVEL)
 logging.Formatter.converter = time.gmtime
+n1mm_view_log.start(LOG_QUEUE_SIZE)
 
 logging.debug("Checking for HTML_DIR")
 if 'HTML_DIR' in globals():
@@ -88,6 +118,53 @@ if POST_FILE_COMMAND is not None and POST_FILE_COMMAND != "":
 else:
     postProcessing = False
 
+# latest charts and stats for the built-in web server, set in the process that renders the charts
+chart_store = None
+# stage timings of the chart engine, only recorded when PROFILE_STAGES is set
+stage_timer = StageTimer()
+# latency trace of the QSOs that caused the current chart update, None if the update was not caused by a notification
+latency_trace = None
+# last published frame of each chart, set in the process that renders the charts
+frame_cache = None
+# the chart engine's database connection, kept open between cycles, and the file it is connected to
+read_db = None
+read_db_filename = None
+# when the latest QSOs were last sampled into the debug log
+last_qso_sample_time = 0
+# the chart engine's per-cycle query time budget, and its whole-log aggregates, kept between cycles
+query_budget = n1mm_view_db.QueryBudget(DATABASE_QUERY_BUDGET)
+operator_counts = n1mm_view_db.ChunkedAggregate('operator_counts', n1mm_view_db.operator_counts_between,
+                                                n1mm_view_db.sum_counts, DATABASE_CHUNK_MINUTES * 60)
+station_counts = n1mm_view_db.ChunkedAggregate('station_counts', n1mm_view_db.station_counts_between,
+                                               n1mm_view_db.sum_counts, DATABASE_CHUNK_MINUTES * 60)
+band_mode_counts = n1mm_view_db.ChunkedAggregate('band_mode_counts', n1mm_view_db.band_mode_counts_between,
+                                                 n1mm_view_db.sum_counts, DATABASE_CHUNK_MINUTES * 60)
+section_counts = n1mm_view_db.ChunkedAggregate('section_counts', n1mm_view_db.section_counts_between,
+                                               n1mm_view_db.sum_counts, DATABASE_CHUNK_MINUTES * 60)
+qso_times_and_bands = n1mm_view_db.ChunkedAggregate('qso_times_and_bands', n1mm_view_db.qso_times_and_bands_between,
+                                                    n1mm_view_db.concatenate, DATABASE_CHUNK_MINUTES * 60)
+aggregates = [operator_counts, station_counts, band_mode_counts, section_counts, qso_times_and_bands]
+
+
+def import_charting():
+    """
+    import matplotlib, Basemap and numpy, in the process that draws the charts.
+    """
+    global matplotlib, agg, plt, HourLocator, DateFormatter, Basemap, np, EPOCH_DATE_NUMBER
+    if matplotlib is not None:
+        return
+    t0 = time.time()
+    import matplotlib
+    # this MUST be done before pyplot is imported so matplotlib does not try to use the wrong backend.
+    matplotlib.use('Agg')
+    import matplotlib.backends.backend_agg as agg
+    import matplotlib.pyplot as plt
+    from matplotlib.dates import HourLocator, DateFormatter
+    from mpl_toolkits.basemap import Basemap
+    import numpy as np
+    EPOCH_DATE_NUMBER = matplotlib.dates.date2num(datetime.datetime(1970, 1, 1))
+    logging.debug('charting imported in %f seconds', time.time() - t0)
+
 
 def makePNGTitle(title):
     return ''.join([HTML_DIR, '/', re.sub('[^\w\-_]', '_', title), '.png'])
@@ -99,47 +176,97 @@ def save_image(image_data, image_size, filename):
     pass
 
 
+def read_connection():
+    """
+    the chart engine's database connection.  it is kept open between cycles so that sqlite's
+    prepared statements and page cache are reused, and reopened if DATABASE_FILENAME changes.
+    """
+    global read_db, read_db_filename
+    if read_db_filename != DATABASE_FILENAME:
+        close_read_connection()
+        # the cached results are from the other database
+        query_budget.clear()
+        for aggregate in aggregates:
+            aggregate.clear()
+    if read_db is None:
+        logging.debug('connecting to database')
+        read_db = n1mm_view_db.connect(DATABASE_FILENAME, n1mm_view_db.DASHBOARD_READ)
+        read_db_filename = DATABASE_FILENAME
+        logging.debug('database connected')
+    return read_db
+
+
+def close_read_connection():
+    global read_db
+    if read_db is not None:
+        logging.debug('Closing DB')
+        read_db.close()
+        read_db = None
+
+
+def invalidate_aggregates(timestamp):
+    """
+    QSOs with this timestamp were added, replaced or deleted
+    """
+    if timestamp is not None:
+        for aggregate in aggregates:
+            aggregate.invalidate(timestamp)
+
+
 def load_data(size, q, base_map, last_qso_timestamp):
     """
     load data from the database tables
     """
+    global last_qso_sample_time
     logging.debug('load data')
 
     qso_operators = []
     qso_stations = []
     qso_band_modes = []
     operator_qso_rates = []
-    qsos_per_hour = []
+    qsos_per_hour = None
     qsos_by_section = {}
+    radios = []
+    score = None
 
     db = None
+    cursor = None
     data_updated = False
     last_qso_time = last_qso_timestamp
+    complete = True
 
     try:
-        logging.debug('connecting to database')
-        db = sqlite3.connect(DATABASE_FILENAME)
-        cursor = db.cursor()
-        logging.debug('database connected')
-
-        if logging.getLogger().isEnabledFor(logging.DEBUG):
-            cursor.execute('SELECT timestamp, callsign, section FROM qso_log')
-            for row in cursor:
-                logging.debug('QSO: %s\t%s\t%s' % (row[0], row[1], row[2]))
-
-
-                # get timestamp from the last record in the database
-        cursor.execute('SELECT timestamp, callsign, exchange, section, operator.name, band_id \n'
-                       'FROM qso_log JOIN operator WHERE operator.id = operator_id \n'
-                       'ORDER BY timestamp DESC LIMIT 1')
+        db = read_connection()
+        # run every query in one read transaction, so all the charts see the same moment of the log
+        cursor = n1mm_view_db.begin_snapshot(db)
+        # only the configured event's QSOs are shown, None until the collector has logged one
+        event_id = n1mm_view_db.find_event_id(cursor, EVENT_NAME, n1mm_view_db.event_time(EVENT_START_TIME))
+
+        if logging.getLogger().isEnabledFor(logging.DEBUG) and \
+                time.time() - last_qso_sample_time >= QSO_DEBUG_SAMPLE_INTERVAL:
+            last_qso_sample_time = time.time()
+            rows = n1mm_view_db.recent_qsos(cursor, event_id, QSO_DEBUG_SAMPLE_SIZE)
+            logging.debug('the last %d QSOs:', len(rows))
+            for row in rows:
+                logging.debug('QSO: %s\t%s\t%s', row[0], row[1], row[2])
+
+        # a query that runs past the budget is interrupted, and its last result is used.
+        query_budget.start(db)
+
+        # get timestamp from the last record in the database
+        row = query_budget.run('last_qso', n1mm_view_db.last_qso, cursor, event_id)
         last_qso_time = int(time.time()) - 60
         message = ''
-        for row in cursor:
+        log_range = (None, None)
+        if row is not None:
             last_qso_time = row[0]
             message = 'Last QSO: %s %s %s on %s by %s at %s' % (
                 row[1], row[2], row[3], Bands.BANDS_TITLE[row[5]], row[4],
                 datetime.datetime.utcfromtimestamp(row[0]).strftime('%H:%M:%S'))
             logging.debug(message)
+            # get timestamp from the first record in the database
+            log_range = (query_budget.run('first_qso_time', n1mm_view_db.first_qso_time, cursor, event_id),
+                         last_qso_time)
 
         logging.debug('old_timestamp = %d, timestamp = %d', last_qso_timestamp, last_qso_time)
         if last_qso_time != last_qso_timestamp:
@@ -149,26 +276,18 @@ def load_data(size, q, base_map, last_qso_timestamp):
 
             # load qso_operators
             logging.debug('Load QSOs by Operator')
-            qso_operators = []
-            cursor.execute('SELECT name, COUNT(operator_id) AS qso_count \n'
-                           'FROM qso_log JOIN operator ON operator.id = operator_id \n'
-                           'GROUP BY operator_id ORDER BY qso_count DESC;')
-            for row in cursor:
-                qso_operators.append((row[0], row[1]))
+            counts, operators_complete = operator_counts.update(cursor, query_budget, event_id, *log_range)
+            qso_operators = sorted(counts.items(), key=lambda item: item[1], reverse=True)
 
             # load qso_stations
             logging.debug('Load QSOs by Station')
-            qso_stations = []
-            cursor.execute('SELECT name, COUNT(station_id) AS qso_count \n'
-                           'FROM qso_log JOIN station ON station.id = station_id GROUP BY station_id;')
-            for row in cursor:
-                qso_stations.append((row[0], row[1]))
+            counts, stations_complete = station_counts.update(cursor, query_budget, event_id, *log_range)
+            qso_stations = sorted(counts.items())
 
             qso_band_modes = [[0] * 4 for _ in Bands.BANDS_LIST]
-
-            cursor.execute('SELECT COUNT(*), band_id, mode_id FROM qso_log GROUP BY band_id, mode_id;')
-            for row in cursor:
-                qso_band_modes[row[1]][Modes.MODE_TO_SIMPLE_MODE[row[2]]] = row[0]
+            counts, band_modes_complete = band_mode_counts.update(cursor, query_budget, event_id, *log_range)
+            for (band_id, mode_id), count in counts.items():
+                qso_band_modes[band_id][Modes.MODE_TO_SIMPLE_MODE[mode_id]] = count
 
             # calculate QSOs per hour rate for all active operators
             # the higher the slice_minutes number is, the better the
@@ -176,135 +295,276 @@ def load_data(size, q, base_map, last_qso_timestamp):
             slice_minutes = 10
             slices_per_hour = 60 / slice_minutes
 
-            # get timestamp from the first record in the database
-            logging.debug('Loading first and last QSO timestamps')
-            cursor.execute('SELECT timestamp FROM qso_log ORDER BY timestamp LIMIT 1')
-            first_qso_time = int(time.time()) - 60
-            for row in cursor:
-                first_qso_time = row[0]
-
             start_time = last_qso_time - slice_minutes * 60
 
             # load QSOs per Hour by Operator
             logging.debug('Load QSOs per Hour by Operator')
-            cursor.execute('SELECT operator.name, COUNT(operator_id) qso_count FROM qso_log\n'
-                           'JOIN operator ON operator.id = operator_id\n'
-                           'WHERE timestamp >= ? AND timestamp <= ?\n'
-                           'GROUP BY operator_id ORDER BY qso_count DESC LIMIT 10;', (start_time, last_qso_time))
             operator_qso_rates = [['Operator', 'Rate']]
             total = 0
-            for row in cursor:
+            for row in query_budget.run('top_operators_between', n1mm_view_db.top_operators_between, cursor,
+                                        event_id, start_time, last_qso_time) or []:
                 rate = row[1] * slices_per_hour
                 total += rate
                 operator_qso_rates.append([row[0], '%4d' % rate])
             operator_qso_rates.append(['Total', '%4d' % total])
 
-            qsos_per_hour = []
-            qsos_by_band = [0] * Bands.count()
-            slice_minutes = 15
-            slices_per_hour = 60 / slice_minutes
-            window_seconds = slice_minutes * 60
-
             # load QSO rates per Hour by Band
             logging.debug('Load QSOs per Hour by Band')
-            cursor.execute('SELECT timestamp / %d * %d AS ts, band_id, COUNT(*) AS qso_count \n'
-                           'FROM qso_log GROUP BY ts, band_id;' % (window_seconds, window_seconds))
-            for row in cursor:
-                if len(qsos_per_hour) == 0:
-                    qsos_per_hour.append([0] * Bands.count())
-                    qsos_per_hour[-1][0] = row[0]
-                while qsos_per_hour[-1][0] != row[0]:
-                    ts = qsos_per_hour[-1][0] + window_seconds
-                    qsos_per_hour.append([0] * Bands.count())
-                    qsos_per_hour[-1][0] = ts
-                qsos_per_hour[-1][row[1]] = row[2] * slices_per_hour
-                qsos_by_band[row[1]] += row[2]
-
-            for rec in qsos_per_hour:  # FIXME
-                rec[0] = datetime.datetime.utcfromtimestamp(rec[0])
-                t = rec[0].strftime('%H:%M:%S')
+            rows, rates_complete = qso_times_and_bands.update(cursor, query_budget, event_id, *log_range)
+            qsos_per_hour = qso_rates(rows, RATE_BUCKET_MINUTES)
+            complete = operators_complete and stations_complete and band_modes_complete and rates_complete
 
         # load QSOs by Section
         logging.debug('Load QSOs by Section')
-        qsos_by_section = {}
-        cursor.execute('SELECT section, COUNT(section) AS qsos FROM qso_log GROUP BY section;')
-        for row in cursor:
-            qsos_by_section[row[0]] = row[1]
-
-        q.put((CRAWL_MESSAGE, 0, ''))
+        qsos_by_section, sections_complete = section_counts.update(cursor, query_budget, event_id, *log_range)
+        complete = complete and sections_complete
+
+        # load the status of the radios heard from lately
+        logging.debug('Load Radio Status')
+        radios = query_budget.run('radio_status_list', n1mm_view_db.radio_status_list, cursor,
+                                  int(time.time()) - RADIO_STATUS_STALE_TIME) or []
+
+        # load the current score from the N1MM+ score broadcasts
+        logging.debug('Load Score')
+        score = query_budget.run('current_score', n1mm_view_db.current_score, cursor, event_id)
+        if score is not None:
+            q.put((CRAWL_MESSAGE, 6, 'Score: {:,} ({:+,}/hr), {:,} QSOs ({:+,}/hr)'.format(
+                score[1], score[3], score[2], score[4])))
+
+        if data_updated and chart_store is not None:
+            chart_store.put_stats(make_stats(message, last_qso_time, qso_band_modes, qso_operators, qso_stations,
+                                             qsos_by_section, score))
+
+        if query_budget.overruns:
+            logging.warn('query budget of %.1f seconds used up, %d overruns so far, older results used for %s',
+                         query_budget.seconds, query_budget.overrun_count, ', '.join(query_budget.overruns))
+            q.put((CRAWL_MESSAGE, 0, 'database busy, charts are catching up', BLACK, YELLOW))
+        else:
+            q.put((CRAWL_MESSAGE, 0, ''))
 
         logging.debug('load data done')
     except sqlite3.OperationalError as error:
         logging.exception(error)
         q.put((CRAWL_MESSAGE, 0, 'database read error', YELLOW, RED))
+        # start over with a new connection next time
+        cursor = None
+        close_read_connection()
         return
     finally:
-        if db is not None:
-            logging.debug('Closing DB')
-            cursor.close()
-            db.close()
-            db = None
+        if cursor is not None:
+            query_budget.stop(db)
+            n1mm_view_db.end_snapshot(cursor)
 
     if data_updated:
         try:
-            image_data, image_size = qso_summary_table(size, qso_band_modes)
-            enqueue_image(q, QSO_COUNTS_TABLE_INDEX, image_data, image_size)
+            publish_chart(q, QSO_COUNTS_TABLE_INDEX, qso_summary_table, size, qso_band_modes)
         except Exception as e:
             logging.exception(e)
         try:
-            image_data, image_size = qso_rates_table(size, operator_qso_rates)
-            enqueue_image(q, QSO_RATES_TABLE_INDEX, image_data, image_size)
+            publish_chart(q, QSO_RATES_TABLE_INDEX, qso_rates_table, size, operator_qso_rates)
         except Exception as e:
             logging.exception(e)
         try:
-            image_data, image_size = qso_operators_graph(size, qso_operators)
-            enqueue_image(q, QSO_OPERATORS_PIE_INDEX, image_data, image_size)
+            publish_chart(q, QSO_OPERATORS_PIE_INDEX, qso_operators_graph, size, qso_operators)
         except Exception as e:
             logging.exception(e)
         try:
-            image_data, image_size = qso_operators_table(size, qso_operators)
-            enqueue_image(q, QSO_OPERATORS_TABLE_INDEX, image_data, image_size)
+            publish_chart(q, QSO_OPERATORS_TABLE_INDEX, qso_operators_table, size, qso_operators)
         except Exception as e:
             logging.exception(e)
         try:
-            image_data, image_size = qso_stations_graph(size, qso_stations)
-            enqueue_image(q, QSO_STATIONS_PIE_INDEX, image_data, image_size)
+            publish_chart(q, QSO_STATIONS_PIE_INDEX, qso_stations_graph, size, qso_stations)
         except Exception as e:
             logging.exception(e)
         try:
-            image_data, image_size = qso_bands_graph(size, qso_band_modes)
-            enqueue_image(q, QSO_BANDS_PIE_INDEX, image_data, image_size)
+            publish_chart(q, QSO_BANDS_PIE_INDEX, qso_bands_graph, size, qso_band_modes)
         except Exception as e:
             logging.exception(e)
         try:
-            image_data, image_size = qso_modes_graph(size, qso_band_modes)
-            enqueue_image(q, QSO_MODES_PIE_INDEX, image_data, image_size)
+            publish_chart(q, QSO_MODES_PIE_INDEX, qso_modes_graph, size, qso_band_modes)
         except Exception as e:
             logging.exception(e)
         try:
-            image_data, image_size = qso_rates_chart(size, qsos_per_hour)
-            enqueue_image(q, QSO_RATE_CHART_IMAGE_INDEX, image_data, image_size)
+            publish_chart(q, QSO_RATE_CHART_IMAGE_INDEX, qso_rates_chart, size, qsos_per_hour)
         except Exception as e:
             logging.exception(e)
 
         # There is a memory leak in the next code
     try:
-        image_data, image_size = draw_map(size, qsos_by_section, base_map)
-        enqueue_image(q, SECTIONS_WORKED_MAP_INDEX, image_data, image_size)
+        # the shade time is part of the map's data, so the night shading moves even when no new sections are worked
+        publish_chart(q, SECTIONS_WORKED_MAP_INDEX,
+                      lambda map_size, sections, shade_time: draw_map(map_size, sections, base_map, shade_time),
+                      size, qsos_by_section, map_shade_time())
+    except Exception as e:
+        logging.exception(e)
+    try:
+        publish_chart(q, STATION_STATUS_TABLE_INDEX, station_status_table, size, radios)
     except Exception as e:
         logging.exception(e)
 
     if data_updated:
         if postProcessing:
-            os.system(POST_FILE_COMMAND)
+            with stage_timer.span('post_file_command'):
+                os.system(POST_FILE_COMMAND)
 
+    if not complete:
+        # some aggregates are still being computed, load again next cycle
+        return 0
     return last_qso_time
 
 
-def enqueue_image(q, id, image_data, size):
+def load_qso_rates(cursor, event_id, bucket_minutes):
+    """
+    load the QSOs per hour per band rates of an event, see qso_rates.
+    """
+    return qso_rates(n1mm_view_db.qso_times_and_bands(cursor, event_id), bucket_minutes)
+
+
+def qso_rates(qso_times_and_bands, bucket_minutes):
+    """
+    calculate the QSOs per hour per band rates from a list of (timestamp, band id).
+    returns a tuple of (dates, rates), where dates is an array of matplotlib date numbers,
+    one per time bucket, and rates is a (buckets x bands) array of QSOs/hour.
+    returns None if there are no QSOs.
+    """
+    bucket_seconds = bucket_minutes * 60
+    qsos = np.array(qso_times_and_bands, dtype=np.int64)
+    if len(qsos) == 0:
+        return None
+
+    band_count = Bands.count()
+    buckets = qsos[:, 0] // bucket_seconds
+    first_bucket = buckets.min()
+    bucket_count = buckets.max() - first_bucket + 1
+    counts = np.bincount((buckets - first_bucket) * band_count + qsos[:, 1],
+                         minlength=bucket_count * band_count).reshape(bucket_count, band_count)
+    rates = counts * (60.0 / bucket_minutes)
+
+    bucket_times = (first_bucket + np.arange(bucket_count)) * bucket_seconds
+    dates = EPOCH_DATE_NUMBER + bucket_times / 86400.0
+    return dates, rates
+
+
+def make_stats(last_qso_message, last_qso_time, qso_band_modes, qso_operators, qso_stations, qsos_by_section,
+               score=None):
+    """
+    make the statistics served by the built-in web server
+    """
+    qsos_by_band = {}
+    qsos_by_mode = {}
+    for band_num in range(1, Bands.count()):
+        for mode_num in range(1, len(Modes.SIMPLE_MODES_LIST)):
+            count = qso_band_modes[band_num][mode_num]
+            if count > 0:
+                band = Bands.BANDS_TITLE[band_num]
+                mode = Modes.SIMPLE_MODES_LIST[mode_num]
+                qsos_by_band[band] = qsos_by_band.get(band, 0) + count
+                qsos_by_mode[mode] = qsos_by_mode.get(mode, 0) + count
+    return {'event': EVENT_NAME,
+            'last_qso': last_qso_message,
+            'last_qso_time': last_qso_time,
+            'qso_count': sum(qsos_by_band.values()),
+            'qsos_by_band': qsos_by_band,
+            'qsos_by_mode': qsos_by_mode,
+            'qsos_by_operator': dict(qso_operators),
+            'qsos_by_station': dict(qso_stations),
+            'sections_worked': len([section for section in qsos_by_section.keys() if section in CONTEST_SECTIONS]),
+            'score': score[1] if score is not None else None,
+            'score_trend': score[3] if score is not None else None,
+            }
+
+
+def start_http_server():
+    """
+    start the built-in web server, if it is configured.
+    """
+    global chart_store
+    if HTTP_SERVER_PORT is None:
+        return
+    try:
+        chart_store = ChartStore(IMAGE_NAMES)
+        start_chart_server(HTTP_SERVER_PORT, chart_store, EVENT_NAME, HTTP_REFRESH_TIME)
+    except Exception as e:
+        logging.exception('Could not start the chart server.', exc_info=e)
+        chart_store = None
+
+
+def start_profiling():
+    """
+    set up the stage timer from the config, returns the profiler for the chart update cycles.
+    """
+    global stage_timer
+    stage_timer = StageTimer(PROFILE_STAGES, PROFILE_WINDOW_SIZE)
+    if stage_timer.enabled:
+        # the query timings are stages too
+        n1mm_view_db.query_timer = stage_timer
+    return CycleProfiler(PROFILE_SLOWEST_CYCLES, PROFILE_DIR)
+
+
+def run_cycle(profiler, size, q, base_map, last_qso_timestamp):
+    """
+    one chart update cycle, timed and profiled when configured.
+    """
+    with stage_timer.span('cycle'):
+        last_qso_timestamp = profiler.run(load_data, size, q, base_map, last_qso_timestamp)
+    if PROFILE_CRAWL and stage_timer.enabled:
+        q.put((CRAWL_MESSAGE, 5, stage_timer.crawl_text()))
+    return last_qso_timestamp
+
+
+def start_frame_cache():
+    """
+    open the last-frame cache, if it is configured, and serve the cached frames until fresh ones are drawn.
+    """
+    global frame_cache
+    if FRAME_CACHE_DIR is None:
+        return
+    try:
+        frame_cache = FrameCache(FRAME_CACHE_DIR, IMAGE_NAMES)
+    except Exception as e:
+        logging.exception('Could not open the frame cache.', exc_info=e)
+        frame_cache = None
+        return
+    if chart_store is not None:
+        for image_index, filename in frame_cache.frames():
+            png_data = frame_cache.png_data(image_index)
+            if png_data is not None:
+                chart_store.put_png(image_index, png_data)
+
+
+def publish_chart(q, image_index, chart_function, size, *chart_data):
+    """
+    draw a chart and send it out, unless the last published frame was drawn from the same data.
+    """
+    fingerprint = None
+    if frame_cache is not None:
+        fingerprint = data_fingerprint(size, chart_data)
+        if frame_cache.is_current(image_index, fingerprint):
+            logging.debug('%s is unchanged', IMAGE_NAMES[image_index])
+            return
+    with stage_timer.span('render_%s' % IMAGE_NAMES[image_index]):
+        image_data, image_size = chart_function(size, *chart_data)
+    enqueue_image(q, image_index, image_data, image_size, fingerprint)
+
+
+def enqueue_image(q, id, image_data, size, fingerprint=None):
+    png_data = None
+    if frame_cache is not None and image_data is not None and fingerprint is not None:
+        with stage_timer.span('frame_cache'):
+            png_data = frame_cache.save(id, image_data, size, fingerprint)
+    if chart_store is not None and image_data is not None:
+        with stage_timer.span('http_store'):
+            if png_data is None:
+                chart_store.put_image(id, image_data, size)
+            else:
+                chart_store.put_png(id, png_data)
     if not HTML_ONLY:
         if image_data is not None:
-            q.put((IMAGE_MESSAGE, id, image_data, size))
+            with stage_timer.span('queue_put'):
+                if latency_trace is None:
+                    q.put((IMAGE_MESSAGE, id, image_data, size))
+                else:
+                    q.put((IMAGE_MESSAGE, id, image_data, size, dict(latency_trace, published=time.time())))
 
 
 def init_display():
@@ -381,7 +641,46 @@ def create_map():
     return my_map
 
 
-def draw_map(size, qsos_by_section, my_map):
+def load_base_map():
+    """
+    load the base map from BASE_MAP_CACHE_FILE, or create it and save it there,
+    so that a recycled chart engine does not have to create the world again.
+    """
+    if os.path.exists(BASE_MAP_CACHE_FILE):
+        try:
+            with open(BASE_MAP_CACHE_FILE, 'rb') as f:
+                my_map = pickle.load(f)
+            logging.debug('loaded base map from %s', BASE_MAP_CACHE_FILE)
+            return my_map
+        except Exception as e:
+            logging.warn('could not load base map from %s, creating it: %s', BASE_MAP_CACHE_FILE, e)
+    my_map = create_map()
+    try:
+        temp_filename = BASE_MAP_CACHE_FILE + '.tmp'
+        with open(temp_filename, 'wb') as f:
+            pickle.dump(my_map, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_filename, BASE_MAP_CACHE_FILE)
+    except Exception as e:
+        logging.warn('could not save base map to %s: %s', BASE_MAP_CACHE_FILE, e)
+    return my_map
+
+
+def live_figure_count():
+    """
+    count the matplotlib figures that have not been garbage collected, leaked figures show up here.
+    """
+    return len([obj for obj in gc.get_objects() if isinstance(obj, matplotlib.figure.Figure)])
+
+
+def map_shade_time():
+    """
+    the time the map's night shading is drawn for, now rounded down to MAP_SHADE_MINUTES
+    """
+    now = datetime.datetime.utcnow()
+    return now.replace(minute=now.minute // MAP_SHADE_MINUTES * MAP_SHADE_MINUTES, second=0, microsecond=0)
+
+
+def draw_map(size, qsos_by_section, my_map, shade_time=None):
     logging.debug('draw_section map()')
     width_inches = size[0] / 100.0
     height_inches = size[1] / 100.0
@@ -406,7 +705,7 @@ def draw_map(size, qsos_by_section, my_map):
     # mark our QTH
     x, y = my_map(QTH_LONGITUDE, QTH_LATITUDE)
     my_map.plot(x, y, '.', color='r')
-    my_map.nightshade(datetime.datetime.utcnow(), alpha=0.25, zorder=4)
+    my_map.nightshade(shade_time or datetime.datetime.utcnow(), alpha=0.25, zorder=4)
 
     logging.debug('setting shapes')
     ranges = [0, 1, 10, 20, 50, 100, 200]  # , 500]  # , 1000]
@@ -468,7 +767,8 @@ def draw_map(size, qsos_by_section, my_map):
     canvas = agg.FigureCanvasAgg(fig)
     canvas.draw()
     renderer = canvas.get_renderer()
-    raw_data = renderer.tostring_rgb()
+    with stage_timer.span('tostring_rgb'):
+        raw_data = renderer.tostring_rgb()
     if SAVE_PNG:
         logging.debug('Saving PNG file')
         try:
@@ -510,7 +810,8 @@ def make_pie(size, values, labels, title):
     canvas = agg.FigureCanvasAgg(fig)
     canvas.draw()
     renderer = canvas.get_renderer()
-    raw_data = renderer.tostring_rgb()
+    with stage_timer.span('tostring_rgb'):
+        raw_data = renderer.tostring_rgb()
 
     if SAVE_PNG:
         logging.debug('Saving PNG as %s' % makePNGTitle(title))
@@ -525,14 +826,44 @@ def make_pie(size, values, labels, title):
     return raw_data, canvas_size
 
 
-def show_graph(screen, size, surf):
+def make_page(surf, size, graph_size):
     """
-    display a surface on the screen.
+    make a full screen page from an image surface.
+    the image is fitted to graph_size, centered, and converted to the display's pixel format,
+    so that showing the page is a single fast blit.
+    """
+    return fit_image(surf.convert(), size, graph_size)
+
+
+def fit_image(image, size, graph_size):
+    """
+    make a full screen page in the display's pixel format from a 24 or 32 bit image surface.
+    this does not draw on the display, so the page maker thread can run it.
+    """
+    logging.debug('fit_image()')
+    page = pygame.Surface(size, 0, pygame.display.get_surface())
+    page.fill(BLACK)
+    width, height = image.get_size()
+    scale = min(float(graph_size[0]) / width, float(graph_size[1]) / height)
+    if scale != 1.0:
+        scaled_size = (max(int(width * scale), 1), max(int(height * scale), 1))
+        try:
+            image = pygame.transform.smoothscale(image, scaled_size)
+        except ValueError:  # smoothscale only works on 24 and 32 bit displays
+            image = pygame.transform.scale(image, scaled_size)
+    x_offset = (graph_size[0] - image.get_width()) / 2
+    y_offset = (graph_size[1] - image.get_height()) / 2
+    page.blit(image, (x_offset, y_offset))
+    logging.debug('fit_image() done')
+    return page
+
+
+def show_graph(screen, size, page):
+    """
+    display a page on the screen.
     """
     logging.debug('show_graph()')
-    x_offset = (size[0] - surf.get_width()) / 2
-    screen.fill((0, 0, 0))
-    screen.blit(surf, (x_offset, 0))
+    screen.blit(page, (0, 0))
     logging.debug('show_graph() done')
 
 
@@ -572,6 +903,22 @@ def qso_operators_table(size, qso_operators):
         return draw_table(size, cells, "Top 5 Operators", bigger_font)
 
 
+def station_status_table(size, radios):
+    """
+    create the Station Status table, the band and mode each radio is on now
+    """
+    cells = [['Station', 'Operator', 'Band', 'Mode', 'kHz', '']]
+    if len(radios) == 0:
+        # an empty table replaces the last radios shown
+        cells.append(['no radios heard', '', '', '', '', ''])
+    for station_name, radio_nr, freq, band_id, mode_id, operator, running in radios:
+        if radio_nr > 1:
+            station_name = '%s/%d' % (station_name, radio_nr)
+        cells.append(['%s' % station_name, '%s' % operator, Bands.BANDS_TITLE[band_id], Modes.MODES_LIST[mode_id],
+                      '%.1f' % (freq / 1000.0), 'RUN' if running else 'S&P'])
+    return draw_table(size, cells, 'Station Status')
+
+
 def qso_stations_graph(size, qso_stations):
     """
     create the QSOs by Station pie chart
@@ -661,18 +1008,12 @@ def qso_rates_chart(size, qsos_per_hour):
     returns a pygame surface
     """
     title = 'QSOs per Hour by Band'
-    qso_counts = [[], [], [], [], [], [], [], [], [], []]
 
-    if qsos_per_hour is None or len(qsos_per_hour) == 0:
+    if qsos_per_hour is None:
         return None, (0, 0)
 
-    data_valid = len(qsos_per_hour) != 0
-
-    for qpm in qsos_per_hour:
-        for i in range(0, Bands.count()):
-            c = qpm[i]
-            cl = qso_counts[i]
-            cl.append(c)
+    dates, rates = qsos_per_hour
+    data_valid = len(dates) != 0
 
     logging.debug('make_plot(...,...,%s)', title)
     width_inches = size[0] / 100.0
@@ -686,22 +1027,18 @@ def qso_rates_chart(size, qsos_per_hour):
 
     ax.set_title(title, color='white', size=48, weight='bold')
 
-    st = calendar.timegm(EVENT_START_TIME.timetuple())
-    lt = calendar.timegm(qsos_per_hour[-1][0].timetuple())
     if data_valid:
-        dates = matplotlib.dates.date2num(qso_counts[0])
         colors = ['r', 'g', 'b', 'c', 'm', 'y', '#ff9900', '#00ff00', '#663300']
         labels = Bands.BANDS_TITLE[1:]
-        if lt < st:
-            start_date = dates[0]  # matplotlib.dates.date2num(qsos_per_hour[0][0].timetuple())
-            end_date = dates[-1]  # matplotlib.dates.date2num(qsos_per_hour[-1][0].timetuple())
+        if dates[-1] < matplotlib.dates.date2num(EVENT_START_TIME):
+            start_date = dates[0]
+            end_date = dates[-1]
         else:
             start_date = matplotlib.dates.date2num(EVENT_START_TIME)
             end_date = matplotlib.dates.date2num(EVENT_END_TIME)
         ax.set_xlim(start_date, end_date)
 
-        ax.stackplot(dates, qso_counts[1], qso_counts[2], qso_counts[3], qso_counts[4], qso_counts[5], qso_counts[6],
-                     qso_counts[7], qso_counts[8], qso_counts[9], labels=labels, colors=colors, linewidth=0.2)
+        ax.stackplot(dates, rates[:, 1:].T, labels=labels, colors=colors, linewidth=0.2)
         ax.grid(True)
         legend = ax.legend(loc='best', ncol=Bands.count() - 1)
         legend.get_frame().set_color((0, 0, 0, 0))
@@ -723,7 +1060,8 @@ def qso_rates_chart(size, qsos_per_hour):
     canvas = agg.FigureCanvasAgg(fig)
     canvas.draw()
     renderer = canvas.get_renderer()
-    raw_data = renderer.tostring_rgb()
+    with stage_timer.span('tostring_rgb'):
+        raw_data = renderer.tostring_rgb()
 
     if SAVE_PNG:
         logging.debug('Saving PNG as %s' % makePNGTitle(title))
@@ -834,7 +1172,8 @@ def draw_table(size, cell_text, title, font=None):
         y += row_height
     logging.debug('draw_table(...,%s) done', title)
     size = surf.get_size()
-    data = pygame.image.tostring(surf, 'RGB')
+    with stage_timer.span('tostring_rgb'):
+        data = pygame.image.tostring(surf, 'RGB')
 
     if SAVE_PNG:
         logging.debug('Saving table PNG as %s' % makePNGTitle(title))
@@ -994,29 +1333,346 @@ class CrawlMessages:
 
 
 def update_charts(q, event, size):
+    global latency_trace
     try:
         os.nice(10)
     except AttributeError:
         logging.warn("can't be nice to windows")
+    t0 = time.time()
     q.put((CRAWL_MESSAGE, 4, 'Chart engine starting...'))
-    base_map = create_map()
+    import_charting()
+    start_http_server()
+    start_frame_cache()
+    profiler = start_profiling()
+    base_map = load_base_map()
+    logging.info('chart engine ready in %.1f seconds', time.time() - t0)
     last_qso_timestamp = 0
     q.put((CRAWL_MESSAGE, 4, ''))
 
+    change_listener = None
+    dwell_time = DATA_DWELL_TIME
+    if CHANGE_NOTIFY_PORT is not None:
+        try:
+            change_listener = ChangeListener(CHANGE_NOTIFY_PORT, CHANGE_NOTIFY_DEBOUNCE_TIME)
+            # radios that go quiet send no notification, the station status must still drop them soon after
+            dwell_time = min(CHANGE_NOTIFY_HEARTBEAT_TIME, RADIO_STATUS_STALE_TIME / 4)
+        except Exception as e:
+            logging.warn('could not listen for change notifications, polling database instead: %s', e)
+
+    limit_bytes = None if CHART_ENGINE_RSS_LIMIT_MB is None else CHART_ENGINE_RSS_LIMIT_MB * 1048576
+    watchdog = MemoryWatchdog('chart engine', limit_bytes, MEMORY_LOG_INTERVAL)
+
     try:
+        next_trace = None
         while not event.is_set():
             t0 = time.time()
-            last_qso_timestamp = load_data(size, q, base_map, last_qso_timestamp)
+            latency_trace = next_trace
+            last_qso_timestamp = run_cycle(profiler, size, q, base_map, last_qso_timestamp)
+            latency_trace = next_trace = None
+            if watchdog.sample(live_figure_count):
+                # the display keeps showing the current charts while a fresh chart engine starts
+                logging.info('chart engine is recycling')
+                q.put((RECYCLE_MESSAGE,))
+                break
             t1 = time.time()
             delta = t1 - t0
-            update_delay = DATA_DWELL_TIME - delta
+            update_delay = dwell_time - delta
             if update_delay < 0:
-                update_delay = DATA_DWELL_TIME
+                update_delay = dwell_time
+            if last_qso_timestamp == 0:
+                # load_data ran out of query budget, come back soon rather than after the heartbeat
+                update_delay = CATCH_UP_DWELL_TIME
             logging.debug('Next data update in %f seconds', update_delay)
-            event.wait(update_delay)
+            if change_listener is None:
+                event.wait(update_delay)
+            else:
+                changes = change_listener.wait(update_delay, event)
+                for change in changes:
+                    logging.debug('change notification: %s QSO on %s by %s from %s', change.get('change'),
+                                  change.get('band'), change.get('operator'), change.get('section'))
+                for change in changes:
+                    invalidate_aggregates(change.get('timestamp'))
+                if [change for change in changes if change.get('change') != CHANGE_RADIO]:
+                    # replaced, deleted and back-dated QSOs do not move the last QSO time, force the update.
+                    last_qso_timestamp = 0
+                    next_trace = make_trace(changes, time.time())
     except Exception, e:
         logging.exception('Exception in update_charts', exc_info=e)
         q.put((CRAWL_MESSAGE, 4, 'Chart engine failed.', YELLOW, RED))
+    finally:
+        if change_listener is not None:
+            change_listener.close()
+        close_read_connection()
+        stage_timer.dump(PROFILE_STATS_FILE)
+        # the chart engine process exits without running atexit
+        n1mm_view_log.flush()
+
+
+def start_chart_engine(q, event, size):
+    """
+    start the chart engine process
+    """
+    proc = multiprocessing.Process(name='image-updater', target=update_charts, args=(q, event, size))
+    proc.start()
+    return proc
+
+
+def reap_chart_engines(recycled):
+    """
+    reap the recycled chart engines that have exited, without waiting for the others,
+    and kill the ones that are out of time.  recycled is a list of (process, deadline),
+    the deadline is None once the process has been killed.  returns the ones still exiting.
+    """
+    exiting = []
+    for proc, deadline in recycled:
+        proc.join(0)
+        if not proc.is_alive():
+            continue
+        if deadline is not None and time.time() >= deadline:
+            logging.warn('chart engine did not exit when recycled, killing.')
+            proc.terminate()
+            deadline = None
+        exiting.append((proc, deadline))
+    return exiting
+
+
+class PageStore:
+    """
+    the display pages, kept zlib compressed.  only the page being shown and the next page
+    are kept as surfaces, the next page is decoded in the background while the current
+    page is shown.  new pages are compressed in the background too, the surface is kept
+    until its compressed copy is ready.  decoded pages are RGB, they are converted to the
+    display's pixel format on the display thread when they are first shown.
+    """
+
+    def __init__(self, page_count):
+        self.compressed = [None] * page_count  # (data, size) of each page
+        self.versions = [0] * page_count
+        self.decoded = {}
+        self.unconverted = set()  # indexes of the decoded pages not yet in the display's pixel format
+        self.pending = {}  # index -> surface of the pages waiting to be compressed
+        self.current_index = None
+        self.next_index = None
+        self.lock = threading.Lock()
+        self.compress_queue = Queue.Queue()
+        thread = threading.Thread(name='page-compressor', target=self._compressor)
+        thread.daemon = True
+        thread.start()
+
+    def __len__(self):
+        return len(self.compressed)
+
+    def has(self, index):
+        return self.compressed[index] is not None or index in self.pending
+
+    def set(self, index, page):
+        """
+        store a page surface, it is compressed in the background
+        """
+        with self.lock:
+            self.versions[index] += 1
+            self.pending[index] = page
+            if index == self.current_index or index == self.next_index:
+                self.decoded[index] = page
+            else:
+                self.decoded.pop(index, None)
+            self.unconverted.discard(index)
+            self.compress_queue.put((index, self.versions[index], page))
+
+    def _compressor(self):
+        while True:
+            index, version, page = self.compress_queue.get()
+            with self.lock:
+                # a newer page is already waiting, compress that one instead
+                if self.versions[index] != version:
+                    continue
+            data = zlib.compress(pygame.image.tostring(page, IMAGE_FORMAT), PAGE_COMPRESSION_LEVEL)
+            with self.lock:
+                if self.versions[index] == version:
+                    self.compressed[index] = (data, page.get_size())
+                    del self.pending[index]
+
+    def get(self, index):
+        """
+        get the surface of the page to show, and start decoding the page after it.
+        """
+        with self.lock:
+            page = self.decoded.get(index) or self.pending.get(index)
+            compressed = self.compressed[index]
+            convert = page is None or index in self.unconverted
+            page_version = self.versions[index]
+        if page is None and compressed is not None:
+            page = self._decode(compressed)
+        if convert and page is not None:
+            page = page.convert()
+        next_index = self._following(index)
+        with self.lock:
+            self.current_index = index
+            self.next_index = next_index
+            for decoded_index in list(self.decoded.keys()):
+                if decoded_index != index and decoded_index != next_index:
+                    del self.decoded[decoded_index]
+                    self.unconverted.discard(decoded_index)
+            # the page may have been replaced while it was being decoded
+            if page is not None and self.versions[index] == page_version:
+                self.decoded[index] = page
+                self.unconverted.discard(index)
+            if next_index in self.pending:
+                self.decoded[next_index] = self.pending[next_index]
+                self.unconverted.discard(next_index)
+            prefetch = next_index is not None and next_index not in self.decoded
+            if prefetch:
+                version = self.versions[next_index]
+                compressed = self.compressed[next_index]
+        if prefetch:
+            thread = threading.Thread(name='page-decoder', target=self._prefetch,
+                                      args=(next_index, version, compressed))
+            thread.daemon = True
+            thread.start()
+        return page
+
+    def _following(self, index):
+        for delta in range(1, len(self.compressed)):
+            following = (index + delta) % len(self.compressed)
+            if self.has(following):
+                return following
+        return None
+
+    def _decode(self, compressed):
+        data, page_size = compressed
+        return pygame.image.fromstring(zlib.decompress(data), page_size, IMAGE_FORMAT)
+
+    def _prefetch(self, index, version, compressed):
+        page = self._decode(compressed)
+        with self.lock:
+            # the page may have been replaced or passed while it was being decoded
+            if self.versions[index] == version and index == self.next_index:
+                self.decoded[index] = page
+                self.unconverted.add(index)
+
+    def report(self):
+        """
+        log how much memory the compressed store uses, and saves.  the pages are counted
+        at the display's pixel size, which is what they take once they are shown.
+        """
+        bytesize = pygame.display.get_surface().get_bytesize()
+        with self.lock:
+            pages = [compressed for compressed in self.compressed if compressed is not None]
+            decoded_bytes = sum(page.get_width() * page.get_height() * page.get_bytesize()
+                                for page in dict((id(page), page) for page in
+                                                 self.decoded.values() + self.pending.values()).values())
+        compressed_bytes = sum(len(data) for data, page_size in pages)
+        raw_bytes = sum(page_size[0] * page_size[1] * bytesize for data, page_size in pages)
+        logging.info('page store: %d pages, %.1f MB compressed, %.1f MB decoded, %.1f MB saved',
+                     len(pages), compressed_bytes / 1048576.0, decoded_bytes / 1048576.0,
+                     (raw_bytes - compressed_bytes - decoded_bytes) / 1048576.0)
+
+
+class PageMaker:
+    """
+    make the chart engine's images into pages on a background thread, so that a new chart
+    does not hold up the display frame.  one image is made at a time, the others wait in
+    the coalescer where a newer image for the same page replaces them.
+    """
+
+    def __init__(self, size, graph_size):
+        self.size = size
+        self.graph_size = graph_size
+        self.busy = False
+        self.requests = Queue.Queue()
+        self.results = Queue.Queue()
+        thread = threading.Thread(name='page-maker', target=self._maker)
+        thread.daemon = True
+        thread.start()
+
+    def put(self, image_message):
+        """
+        start making an image message from the coalescer into a page
+        """
+        self.busy = True
+        self.requests.put(image_message)
+
+    def _maker(self):
+        while True:
+            payload, traces = self.requests.get()
+            t0 = time.time()
+            try:
+                page = fit_image(pygame.image.frombuffer(payload[2], payload[3], IMAGE_FORMAT),
+                                 self.size, self.graph_size)
+            except Exception as e:
+                logging.exception('Could not make image %d into a page.', payload[1], exc_info=e)
+                page = None
+            self.results.put((payload[1], page, traces, time.time() - t0))
+
+    def get(self):
+        """
+        get the finished page as (index, page, traces, seconds), or None if it is not ready.
+        page is None if the image could not be made into a page.
+        """
+        try:
+            result = self.results.get_nowait()
+        except Queue.Empty:
+            return None
+        self.busy = False
+        return result
+
+
+class MessageCoalescer:
+    """
+    take the chart engine's messages off the queue, keeping only the latest image for each
+    page and the latest text for each crawl slot, so stale frames are never decoded.
+    """
+
+    def __init__(self, q):
+        self.q = q
+        self.images = {}
+        self.traces = {}
+        self.crawl = {}
+        self.other = []
+        self.dropped = 0
+
+    def drain(self, deadline):
+        """
+        take messages off the queue until it is empty or the deadline passes.
+        """
+        while time.time() < deadline:
+            try:
+                payload = self.q.get_nowait()
+            except Queue.Empty:
+                break
+            message_type = payload[0]
+            if message_type == IMAGE_MESSAGE:
+                n = payload[1]
+                if n in self.images:
+                    self.dropped += 1
+                    logging.debug('dropped stale image %d', n)
+                self.images[n] = payload
+                # the newest image carries the data of the dropped ones, so their traces are delivered with it
+                if len(payload) > 4:
+                    self.traces.setdefault(n, []).append(payload[4])
+            elif message_type == CRAWL_MESSAGE:
+                self.crawl[payload[1]] = payload
+            else:
+                self.other.append(payload)
+
+    def pop_image(self):
+        """
+        returns the latest IMAGE_MESSAGE payload of a page and the latency traces for it, or None
+        """
+        if not self.images:
+            return None
+        n, payload = self.images.popitem()
+        return payload, self.traces.pop(n, [])
+
+    def pop_crawl(self):
+        crawl = self.crawl
+        self.crawl = {}
+        return crawl.values()
+
+    def pop_other(self):
+        other = self.other
+        self.other = []
+        return other
 
 
 def change_image(screen, size, images, image_index, delta):
@@ -1026,19 +1682,26 @@ def change_image(screen, size, images, image_index, delta):
             image_index = 0
         elif image_index < 0:
             image_index = len(images) - 1
-        if images[image_index] is not None:
+        if images.has(image_index):
             break
-    show_page(screen, size, images[image_index])
+    show_page(screen, size, images.get(image_index))
     return image_index
 
 
 def main():
+    startup_time = time.time()
     logging.info('dashboard startup')
     last_qso_timestamp = 0
     q = multiprocessing.Queue()
     if 'HTML_ONLY' in globals():
         if HTML_ONLY:
             logging.info('HTML ONLY so no screen will appear')
+            import_charting()
+            start_http_server()
+            start_frame_cache()
+            profiler = start_profiling()
+            # the chart engine cannot be recycled here, just log the memory trend
+            watchdog = MemoryWatchdog('dashboard', None, MEMORY_LOG_INTERVAL)
             # Setup simple loop to call load_data and then wait for the interval
             base_map = create_map()
             last_qso_timestamp = 0
@@ -1049,24 +1712,33 @@ def main():
                 size = (PNG_HEIGHT, PNG_WIDTH)
 
             run = True
-            while run:
-                # t0 = time.time()
-                last_qso_timestamp = load_data(size, q, base_map, last_qso_timestamp)
-                # t1 = time.time()
-
-                while not q.empty():  # Empty queue even through we do not use it to prevent potential memory issues.
-                    q.get_nowait()
-                # delta = t1 - t0
-                # update_delay = DATA_DWELL_TIME - delta
-                # if update_delay < 0:
-                #  update_delay = DATA_DWELL_TIME
-                logging.debug('Next data update in %f seconds', DATA_DWELL_TIME)
-
-                time.sleep(DATA_DWELL_TIME)
+            try:
+                while run:
+                    # t0 = time.time()
+                    last_qso_timestamp = run_cycle(profiler, size, q, base_map, last_qso_timestamp)
+                    watchdog.sample(live_figure_count)
+                    # t1 = time.time()
+
+                    while not q.empty():  # Empty queue even through we do not use it to prevent memory issues.
+                        q.get_nowait()
+                    # delta = t1 - t0
+                    # update_delay = DATA_DWELL_TIME - delta
+                    # if update_delay < 0:
+                    #  update_delay = DATA_DWELL_TIME
+                    update_delay = DATA_DWELL_TIME
+                    if last_qso_timestamp == 0:
+                        # load_data ran out of query budget, come back soon
+                        update_delay = CATCH_UP_DWELL_TIME
+                    logging.debug('Next data update in %f seconds', update_delay)
+
+                    time.sleep(update_delay)
+            finally:
+                close_read_connection()
+                stage_timer.dump(PROFILE_STATS_FILE)
     # If HTML_ONLY, the rest of this code will never execute.        
     process_event = multiprocessing.Event()
 
-    images = [None] * IMAGE_COUNT
+    images = PageStore(IMAGE_COUNT)
     try:
         screen, size = init_display()
     except Exception, e:
@@ -1077,16 +1749,41 @@ def main():
 
     logging.debug('display setup')
 
-    images[LOGO_IMAGE_INDEX] = pygame.image.load('logo.png')
+    images.set(LOGO_IMAGE_INDEX, make_page(pygame.image.load('logo.png'), size, display_size))
+    # put the last charts back on the screen while the chart engine starts and draws fresh ones
+    if FRAME_CACHE_DIR is not None:
+        try:
+            cached_frames = FrameCache(FRAME_CACHE_DIR, IMAGE_NAMES).frames()
+            for image_index, filename in cached_frames:
+                images.set(image_index, make_page(pygame.image.load(filename), size, display_size))
+            logging.info('%d cached charts loaded %.1f seconds after startup', len(cached_frames),
+                         time.time() - startup_time)
+        except Exception as e:
+            logging.exception('Could not load the cached charts.', exc_info=e)
     crawl_messages = CrawlMessages(screen, size)
     update_crawl_message(crawl_messages)
-
-    proc = multiprocessing.Process(name='image-updater', target=update_charts, args=(q, process_event, display_size))
-    proc.start()
+    latency_tracker = LatencyTracker()
+    coalescer = MessageCoalescer(q)
+    page_maker = PageMaker(size, display_size)
+    last_latency_report = time.time()
+    last_memory_report = time.time()
+    page_count = 0
+    page_time = 0.0
+    slowest_page_time = 0.0
+    make_time = 0.0
+    frame_count = 0
+    over_budget_count = 0
+
+    # the base map cache only lives as long as this dashboard run
+    if os.path.exists(BASE_MAP_CACHE_FILE):
+        os.remove(BASE_MAP_CACHE_FILE)
+    proc = start_chart_engine(q, process_event, display_size)
+    recycled = []
 
     try:
         image_index = LOGO_IMAGE_INDEX
-        show_page(screen, size, images[LOGO_IMAGE_INDEX])
+        show_page(screen, size, images.get(LOGO_IMAGE_INDEX))
+        first_chart_received = False
 
         pygame.time.set_timer(pygame.USEREVENT, 1000)
         run = True
@@ -1104,11 +1801,36 @@ def main():
                     display_update_timer -= 1
                     if display_update_timer < 1:
                         if paused:
-                            show_page(screen, size, images[image_index])
+                            show_page(screen, size, images.get(image_index))
                         else:
                             image_index = change_image(screen, size, images, image_index, 1)
+                        latency_tracker.shown(image_index)
                         display_update_timer = DISPLAY_DWELL_TIME
                     update_crawl_message(crawl_messages)
+                    if recycled:
+                        recycled = reap_chart_engines(recycled)
+                    if LATENCY_REPORT_INTERVAL is not None and \
+                            time.time() - last_latency_report >= LATENCY_REPORT_INTERVAL:
+                        latency_tracker.report()
+                        last_latency_report = time.time()
+                    if MEMORY_LOG_INTERVAL is not None and \
+                            time.time() - last_memory_report >= MEMORY_LOG_INTERVAL:
+                        images.report()
+                        logging.info('%d stale images dropped', coalescer.dropped)
+                        if page_count:
+                            logging.info('%d pages made, %.3f seconds average in the page maker, '
+                                         '%.4f seconds average and %.4f seconds slowest to store',
+                                         page_count, make_time / page_count, page_time / page_count,
+                                         slowest_page_time)
+                            page_count = 0
+                            page_time = 0.0
+                            slowest_page_time = 0.0
+                            make_time = 0.0
+                        logging.info('%d of %d frames over the %.3f second budget',
+                                     over_budget_count, frame_count, FRAME_TIME_BUDGET)
+                        frame_count = 0
+                        over_budget_count = 0
+                        last_memory_report = time.time()
                 elif event.type == pygame.KEYDOWN:
                     if event.key == ord('q'):
                         logging.debug('Q key pressed')
@@ -1116,39 +1838,68 @@ def main():
                     elif event.key == ord('n') or event.key == 275:
                         logging.debug('next key pressed')
                         image_index = change_image(screen, size, images, image_index, 1)
+                        latency_tracker.shown(image_index)
                         display_update_timer = DISPLAY_DWELL_TIME
                     elif event.key == ord('p') or event.key == 276:
                         logging.debug('prev key pressed')
                         image_index = change_image(screen, size, images, image_index, -1)
+                        latency_tracker.shown(image_index)
                         display_update_timer = DISPLAY_DWELL_TIME
                     elif event.key == 302:
                         logging.debug('scroll lock key pressed')
                         if paused:
                             image_index = change_image(screen, size, images, image_index, 1)
+                            latency_tracker.shown(image_index)
                             display_update_timer = DISPLAY_DWELL_TIME
                         paused = not paused
                     else:
                         logging.debug('event key=%d', event.key)
-                while not q.empty():
-                    payload = q.get()
-                    message_type = payload[0]
-                    if message_type == IMAGE_MESSAGE:
-                        n = payload[1]
-                        image = payload[2]
-                        image_size = payload[3]
-                        images[n] = pygame.image.frombuffer(image, image_size, IMAGE_FORMAT)
-                        logging.debug('received image %d', n)
-                    elif message_type == CRAWL_MESSAGE:
-                        n = payload[1]
-                        message = payload[2]
-                        fg = CYAN
-                        bg = BLACK
-                        if len(payload) > 3:
-                            fg = payload[3]
-                        if len(payload) > 4:
-                            bg = payload[4]
-                        crawl_messages.set_message(n, message)
-                        crawl_messages.set_message_colors(n, fg, bg)
+
+            frame_start = time.time()
+            deadline = frame_start + FRAME_TIME_BUDGET
+            coalescer.drain(deadline)
+            for payload in coalescer.pop_crawl():
+                n = payload[1]
+                message = payload[2]
+                fg = CYAN
+                bg = BLACK
+                if len(payload) > 3:
+                    fg = payload[3]
+                if len(payload) > 4:
+                    bg = payload[4]
+                crawl_messages.set_message(n, message)
+                crawl_messages.set_message_colors(n, fg, bg)
+            for payload in coalescer.pop_other():
+                if payload[0] == RECYCLE_MESSAGE:
+                    # the old engine is reaped on later ticks, the display must not wait for it
+                    logging.info('restarting the chart engine')
+                    recycled.append((proc, time.time() + RECYCLE_EXIT_TIME))
+                    proc = start_chart_engine(q, process_event, display_size)
+            # the page maker has the image work, the frame only stores the finished page
+            t0 = time.time()
+            result = page_maker.get()
+            if result is not None:
+                n, page, traces, seconds = result
+                if page is not None:
+                    images.set(n, page)
+                    elapsed = time.time() - t0
+                    page_count += 1
+                    page_time += elapsed
+                    slowest_page_time = max(slowest_page_time, elapsed)
+                    make_time += seconds
+                    for trace in traces:
+                        latency_tracker.delivered(n, trace)
+                    logging.debug('received image %d', n)
+                    if not first_chart_received:
+                        first_chart_received = True
+                        logging.info('first chart received %.1f seconds after startup', time.time() - startup_time)
+            if not page_maker.busy:
+                image_message = coalescer.pop_image()
+                if image_message is not None:
+                    page_maker.put(image_message)
+            frame_count += 1
+            if time.time() - frame_start > FRAME_TIME_BUDGET:
+                over_budget_count += 1
 
             crawl_messages.crawl_message()
             pygame.display.flip()
@@ -1159,10 +1910,17 @@ def main():
     except Exception, e:
         logging.exception("Exception in main:", exc_info=e)
 
+    latency_tracker.report()
+    latency_tracker.dump(LATENCY_STATS_FILE)
+
     pygame.display.quit()
     logging.debug('stopping update process')
     process_event.set()
     logging.debug('waiting for update process to stop...')
+    for old_proc, deadline in recycled:
+        old_proc.join(RECYCLE_EXIT_TIME)
+        if old_proc.is_alive():
+            old_proc.terminate()
     proc.join(60)
     if proc.is_alive():
         logging.warn('chart engine did not exit upon request, killing.')
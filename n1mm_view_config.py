@@ -7,6 +7,11 @@ import logging
 
 """ name of database file """
 DATABASE_FILENAME = 'n1mm_view.db'
+""" directory archive_events.py writes the database files of closed events to """
+ARCHIVE_DIRECTORY = 'archive'
+# the collector, rebuild_db.py and reconcile.py record every QSO they receive for this event, whatever
+# its time.  only the one-time upgrade of a database from before events uses the start and end times,
+# the QSOs between them go to this event and the others to an event for each year.
 """ Name of the event/contest """
 EVENT_NAME = 'N4N Field Day'
 """ start time of the event/contest in YYYY-MM-DD hh:mm:ss format """
@@ -24,6 +29,12 @@ N1MM_BROADCAST_ADDRESS = '192.168.1.255'
 """ n1mm+ log file name used by replayer """
 # N1MM_LOG_FILE_NAME = '2015N4N.s3db'
 N1MM_LOG_FILE_NAME = 'n4n-2016-final.s3db'
+""" number of seconds between polls of the N1MM+ log by rebuild_db.py --sync """
+SYNC_INTERVAL = 10
+""" number of seconds between full comparisons of the N1MM+ log and the n1mm_view database by rebuild_db.py --sync """
+SYNC_RECONCILE_INTERVAL = 300
+""" number of minutes in each time bucket compared by rebuild_db.py --sync """
+SYNC_BUCKET_MINUTES = 60
 """ QTH Latitude """
 QTH_LATITUDE = 34.0109629
 """ QTH Longitude """
@@ -32,8 +43,78 @@ QTH_LONGITUDE = -84.4616047
 DISPLAY_DWELL_TIME = 6
 """ number of seconds before automatic graph update from database """
 DATA_DWELL_TIME = 60
+""" if True, the database uses write-ahead logging, so the dashboard can read while the collector writes """
+DATABASE_WAL = True
+""" seconds a database connection waits for a lock before giving up """
+DATABASE_BUSY_TIMEOUT = 5
+""" number of times the collector retries a write when the database is locked """
+DATABASE_WRITE_RETRIES = 5
+""" seconds between WAL checkpoints, run by the collector when no broadcasts are arriving """
+WAL_CHECKPOINT_INTERVAL = 60
+""" kilobytes of page cache for the dashboard's database connection, the collector uses a quarter of this """
+DATABASE_CACHE_KB = 8192
+""" megabytes of the database file the dashboard reads through memory mapping, 0 to disable """
+DATABASE_MMAP_MB = 64
+""" database calls taking more seconds than this are logged """
+DATABASE_SLOW_QUERY_TIME = 1.0
+""" seconds of database queries the dashboard may run per chart cycle, slower queries are interrupted and their last result used, None for no limit """
+DATABASE_QUERY_BUDGET = 2.0
+""" minutes of the log in each piece of the dashboard's whole-log counts, which are computed a few pieces at a time """
+DATABASE_CHUNK_MINUTES = 60
+""" seconds between writes of a radio's RadioInfo status to the database, the collector keeps the latest in memory """
+RADIO_STATUS_WRITE_INTERVAL = 5
+""" seconds without RadioInfo after which the dashboard no longer shows a radio """
+RADIO_STATUS_STALE_TIME = 300
+""" seconds between score snapshots written from N1MM+ dynamicresults broadcasts, the collector keeps the latest in memory """
+SCORE_SNAPSHOT_INTERVAL = 60
+""" minutes of score snapshots the score and QSO trends per hour are computed over """
+SCORE_TREND_MINUTES = 60
+""" loopback UDP port the collector uses to notify the dashboard of new QSOs, None to disable notifications """
+CHANGE_NOTIFY_PORT = 12061
+""" number of seconds without further notifications to wait before updating the charts """
+CHANGE_NOTIFY_DEBOUNCE_TIME = 2
+""" number of seconds before graph update from database when no notifications are received """
+CHANGE_NOTIFY_HEARTBEAT_TIME = 300
+""" TCP port of the collector's live QSO event stream (Server-Sent Events at /events), None to disable """
+QSO_EVENT_PORT = None
+""" number of recent QSO events replayed to a newly connected event stream client """
+QSO_EVENT_REPLAY_SIZE = 500
+""" number of QSO events queued for a slow event stream client before it is disconnected """
+QSO_EVENT_CLIENT_QUEUE_SIZE = 100
+""" number of minutes in each time bucket of the QSOs per Hour by Band chart """
+RATE_BUCKET_MINUTES = 15
+""" if True, time every query and chart render of the chart engine, see n1mm_view_profile.py """
+PROFILE_STAGES = False
+""" number of recent timings per stage used for the p50/p95 stage times """
+PROFILE_WINDOW_SIZE = 100
+""" if True, show the cycle time and the slowest stages on the crawl """
+PROFILE_CRAWL = False
+""" file the stage times are written to as JSON when the chart engine exits """
+PROFILE_STATS_FILE = 'dashboard_timings.json'
+""" number of slowest chart update cycles to capture with cProfile, 0 to disable """
+PROFILE_SLOWEST_CYCLES = 0
+""" directory the cProfile captures are written to """
+PROFILE_DIR = 'profiles'
+""" number of seconds between QSO-to-screen latency reports in the dashboard log, None to disable """
+LATENCY_REPORT_INTERVAL = 600
+""" file the QSO-to-screen latency histograms are written to as JSON when the dashboard exits """
+LATENCY_STATS_FILE = 'dashboard_latency.json'
+""" RSS in megabytes past which the dashboard chart engine is restarted, None to never restart it """
+CHART_ENGINE_RSS_LIMIT_MB = 300
+""" number of seconds between memory use reports in the dashboard log, None to disable """
+MEMORY_LOG_INTERVAL = 3600
+""" file the dashboard keeps the section map in, so a restarted chart engine can load it quickly """
+BASE_MAP_CACHE_FILE = 'base_map.pickle'
+""" directory the dashboard keeps the last frame of each chart in, to show at startup, None to disable """
+FRAME_CACHE_DIR = 'frame_cache'
 """ log level for apps -- one of logging.WARN, logging.INFO, logging.DEBUG """
 LOG_LEVEL = logging.INFO
+""" number of log messages the collector and dashboard queue for the log writer thread, more are dropped, None to log synchronously """
+LOG_QUEUE_SIZE = 1000
+""" seconds between samples of the latest QSOs in the dashboard's debug log """
+QSO_DEBUG_SAMPLE_INTERVAL = 60
+""" number of QSOs in each sample of the dashboard's debug log """
+QSO_DEBUG_SAMPLE_SIZE = 10
 """ Directory to which the PNG files are written - Will be created but ensure Apache has rights """
 HTML_DIR = '/home/pi/n1mm_view/html'
 """ If True, then this is headless and only creates the PNG files """
@@ -41,6 +122,10 @@ HTML_ONLY = False
 """ Height and Width of image files written to disk """
 PNG_HEIGHT = 1824
 PNG_WIDTH = 984
+""" TCP port of the built-in web server that serves the charts and stats, None to disable """
+HTTP_SERVER_PORT = None
+""" number of seconds between automatic refreshes of the built-in web server's page """
+HTTP_REFRESH_TIME = 60
 """ If set, this command is run after creating the files (used to rsync PNG files to remote web server) """
 POST_FILE_COMMAND = None  # 'rsync -avz <HTML_DIR from above/*> <user@server>/<remote dir>'
 
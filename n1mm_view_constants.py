@@ -15,11 +15,25 @@ class Bands:
     BANDS_LIST = ['N/A', '1.8', '3.5', '7', '14', '21', '28', '50', '144', '420']
     BANDS_TITLE = ['No Band', '160M', '80M', '40M', '20M', '15M', '10M', '6M', '2M', '70cm']
     BANDS = {elem: index for index, elem in enumerate(BANDS_LIST)}
+    # lower and upper edge of each band in kHz
+    BAND_EDGES = [(0, 0), (1800, 2000), (3500, 4000), (7000, 7300), (14000, 14350), (21000, 21450), (28000, 29700),
+                  (50000, 54000), (144000, 148000), (420000, 450000)]
 
     @classmethod
     def get_band_number(cls, bandName):
         return Bands.BANDS.get(bandName)
 
+    @classmethod
+    def get_band_number_for_frequency(cls, frequency):
+        """
+        the band of a frequency in Hz, 0 if it is not in a band
+        """
+        khz = frequency / 1000.0
+        for band_number in range(1, len(Bands.BAND_EDGES)):
+            if Bands.BAND_EDGES[band_number][0] <= khz <= Bands.BAND_EDGES[band_number][1]:
+                return band_number
+        return 0
+
     @classmethod
     def count(cls):
         return len(Bands.BANDS_LIST)
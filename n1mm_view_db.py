@@ -0,0 +1,931 @@
+"""
+data access for the n1mm_view database.
+every connection is made here, with the pragmas of a named profile:
+  ingest          -- the collector and the tools that write the live log: WAL, small cache.
+  dashboard_read  -- the dashboard: read only, bigger cache and memory mapped reads.
+  bulk_rebuild    -- rebuild_db.py loading a whole log: no journal syncs, biggest cache.
+all the SQL lives here as constant strings.  sqlite3 keeps the prepared statement for
+each distinct SQL string on each connection, so statements are never built with string
+formatting, and long running processes keep their connection open.
+each query function records its time in query_timer, and slow queries are logged.
+every QSO belongs to an event, and the dashboard's queries are scoped to one event by
+the (event_id, timestamp) index, so old events in the database do not slow them down.
+the dashboard's queries run under a per-cycle time budget, and its whole-log aggregates
+are computed in time-range chunks that are kept between cycles, see QueryBudget and
+ChunkedAggregate.
+"""
+
+import calendar
+import logging
+import sqlite3
+import time
+
+from n1mm_view_config import *
+from n1mm_view_profile import StageTimer
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+INGEST = 'ingest'
+DASHBOARD_READ = 'dashboard_read'
+BULK_REBUILD = 'bulk_rebuild'
+
+""" page size of new databases, the page size of an existing database is not changed """
+PAGE_SIZE = 4096
+""" number of prepared statements sqlite3 keeps per connection """
+STATEMENT_CACHE_SIZE = 100
+""" number of sqlite virtual machine instructions between checks of the query budget """
+PROGRESS_INSTRUCTIONS = 1000
+
+""" recent timings of each query function """
+query_timer = StageTimer(True, PROFILE_WINDOW_SIZE)
+
+QSO_LOG_INDEXES = [('qso_log_band_id', 'band_id'),
+                   ('qso_log_mode_id', 'mode_id'),
+                   ('qso_log_operator_id', 'operator_id'),
+                   ('qso_log_station_id', 'station_id'),
+                   ('qso_log_section', 'section'),
+                   ('qso_log_timestamp_callsign', 'timestamp, callsign'),
+                   ('qso_log_event_timestamp', 'event_id, timestamp'),
+                   ]
+
+QSO_LOG_COLUMNS = ('timestamp, mycall, band_id, mode_id, operator_id, station_id, rx_freq, tx_freq, \n'
+                   'callsign, rst_sent, rst_recv, exchange, section, comment, event_id')
+QSO_LOG_INSERT = 'INSERT INTO qso_log (' + QSO_LOG_COLUMNS + ') \nVALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);'
+COMPARE_COLUMNS = ('timestamp, callsign, band_id, mode_id, operator.name, station.name, section, exchange \n'
+                   'FROM qso_log JOIN operator ON operator.id = operator_id JOIN station ON station.id = station_id \n'
+                   'WHERE event_id = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp;')
+COMPARE_QUERY = 'SELECT ' + COMPARE_COLUMNS
+COMPARE_ROWID_QUERY = 'SELECT qso_log.rowid, ' + COMPARE_COLUMNS
+
+
+def profile_pragmas(profile):
+    """
+    the pragmas of a profile, in the order they are applied
+    """
+    if profile == INGEST:
+        return [('page_size', PAGE_SIZE),
+                ('journal_mode', 'WAL' if DATABASE_WAL else 'DELETE'),
+                # in WAL mode NORMAL can lose the last commits on power loss, but never corrupts the database
+                ('synchronous', 'NORMAL' if DATABASE_WAL else 'FULL'),
+                # the collector checkpoints when it is idle
+                ('wal_autocheckpoint', 0 if DATABASE_WAL else 1000),
+                ('cache_size', -DATABASE_CACHE_KB // 4),
+                ('temp_store', 'MEMORY'),
+                ]
+    if profile == DASHBOARD_READ:
+        return [('cache_size', -DATABASE_CACHE_KB),
+                ('mmap_size', DATABASE_MMAP_MB * 1048576),
+                ('temp_store', 'MEMORY'),
+                ('query_only', 'ON'),
+                ]
+    if profile == BULK_REBUILD:
+        # a crash during the rebuild means starting over anyway, so skip the syncs.
+        return [('page_size', PAGE_SIZE),
+                ('journal_mode', 'MEMORY'),
+                ('synchronous', 'OFF'),
+                ('cache_size', -DATABASE_CACHE_KB * 4),
+                ('temp_store', 'MEMORY'),
+                ]
+    raise ValueError('unknown database profile %s' % profile)
+
+
+def apply_profile(db, profile):
+    """
+    set the pragmas of a profile on a connection
+    """
+    cursor = db.cursor()
+    for pragma, value in profile_pragmas(profile):
+        cursor.execute('PRAGMA %s = %s;' % (pragma, value))
+        if pragma == 'journal_mode':
+            journal_mode = cursor.fetchone()[0]
+            if journal_mode.lower() != value.lower():
+                logging.warn('could not set %s journal mode, journal mode is %s', value, journal_mode)
+    cursor.close()
+
+
+def connect(filename, profile):
+    """
+    connect to the n1mm_view database with the pragmas of profile
+    """
+    db = sqlite3.connect(filename, timeout=DATABASE_BUSY_TIMEOUT, cached_statements=STATEMENT_CACHE_SIZE)
+    apply_profile(db, profile)
+    if profile == DASHBOARD_READ:
+        # read transactions are begun by begin_snapshot
+        db.isolation_level = None
+    return db
+
+
+def begin_snapshot(db):
+    """
+    begin a read transaction, so every query sees the same moment of the log.
+    returns the cursor to query with, pass it to end_snapshot when done.
+    """
+    cursor = db.cursor()
+    cursor.execute('BEGIN;')
+    return cursor
+
+
+def end_snapshot(cursor):
+    """
+    end the read transaction, so the WAL can be checkpointed past it
+    """
+    try:
+        cursor.execute('COMMIT;')
+    except sqlite3.Error as e:
+        logging.debug('could not end read transaction: %s', e)
+    cursor.close()
+
+
+def checkpoint(db):
+    """
+    copy the WAL back into the database without waiting on readers
+    """
+    try:
+        t0 = time.time()
+        busy, log_pages, checkpointed_pages = db.execute('PRAGMA wal_checkpoint(PASSIVE);').fetchone()
+        logging.debug('WAL checkpoint: %d of %d pages in %f seconds', checkpointed_pages, log_pages, time.time() - t0)
+    except sqlite3.OperationalError as e:
+        logging.warn('WAL checkpoint failed: %s', e)
+
+
+def timed(function):
+    """
+    record the time of each call in query_timer, and log the slow ones
+    """
+    stage = 'query_' + function.__name__
+
+    def timed_function(*args, **kwargs):
+        t0 = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = time.time() - t0
+            query_timer.record(stage, elapsed)
+            if elapsed > DATABASE_SLOW_QUERY_TIME:
+                logging.warn('slow query: %s took %.3f seconds', function.__name__, elapsed)
+
+    timed_function.__name__ = function.__name__
+    timed_function.__doc__ = function.__doc__
+    return timed_function
+
+
+def log_timings():
+    """
+    log the p50/p95 time of each query function
+    """
+    summary = query_timer.summary()
+    if summary:
+        logging.info('query times (p50/p95 seconds): %s',
+                     ', '.join('%s %.4f/%.4f' % (stage[len('query_'):], stats['p50'], stats['p95'])
+                               for stage, stats in sorted(summary.items())))
+
+
+def create_tables(db, cursor, indexes=True):
+    """
+    set up the database tables
+    if indexes is False, the secondary indexes on qso_log are not created.
+    """
+    cursor.execute('CREATE TABLE IF NOT EXISTS operator\n'
+                   '    (id INTEGER PRIMARY KEY NOT NULL, \n'
+                   '    name char(12) NOT NULL);')
+    cursor.execute('CREATE INDEX IF NOT EXISTS operator_name ON operator(name);')
+
+    cursor.execute('CREATE TABLE IF NOT EXISTS station\n'
+                   '    (id INTEGER PRIMARY KEY NOT NULL, \n'
+                   '    name char(12) NOT NULL);')
+    cursor.execute('CREATE INDEX IF NOT EXISTS station_name ON station(name);')
+
+    cursor.execute('CREATE TABLE IF NOT EXISTS event\n'
+                   '    (id INTEGER PRIMARY KEY NOT NULL, \n'
+                   '    name TEXT NOT NULL, \n'
+                   '    start_time INTEGER NOT NULL, \n'
+                   '    end_time INTEGER NOT NULL, \n'
+                   '    archive TEXT);')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS event_name_start_time ON event(name, start_time);')
+
+    cursor.execute('CREATE TABLE IF NOT EXISTS qso_log\n'
+                   #'    (id INTEGER PRIMARY KEY NOT NULL,\n'
+                   '     (timestamp INTEGER NOT NULL,\n'
+                   '     mycall char(12) NOT NULL,\n'
+                   '     band_id INTEGER NOT NULL,\n'
+                   '     mode_id INTEGER NOT NULL,\n'
+                   '     operator_id INTEGER NOT NULL,\n'
+                   '     station_id INTEGER NOT NULL,\n'
+                   '     rx_freq INTEGER NOT NULL,\n'
+                   '     tx_freq INTEGER NOT NULL,\n'
+                   '     callsign char(12) NOT NULL,\n'
+                   '     rst_sent char(3),\n'
+                   '     rst_recv char(3),\n'
+                   '     exchange char(4),\n'
+                   '     section char(4),\n'
+                   '     comment TEXT,\n'
+                   '     event_id INTEGER NOT NULL DEFAULT 0);')
+    cursor.execute('CREATE TABLE IF NOT EXISTS radio_status\n'
+                   '    (station_name TEXT NOT NULL, \n'
+                   '    radio_nr INTEGER NOT NULL, \n'
+                   '    freq INTEGER NOT NULL, \n'
+                   '    tx_freq INTEGER NOT NULL, \n'
+                   '    band_id INTEGER NOT NULL, \n'
+                   '    mode_id INTEGER NOT NULL, \n'
+                   '    operator TEXT, \n'
+                   '    running INTEGER NOT NULL, \n'
+                   '    updated INTEGER NOT NULL, \n'
+                   '    PRIMARY KEY (station_name, radio_nr));')
+    cursor.execute('CREATE TABLE IF NOT EXISTS score_snapshot\n'
+                   '    (id INTEGER PRIMARY KEY NOT NULL, \n'
+                   '    event_id INTEGER NOT NULL, \n'
+                   '    timestamp INTEGER NOT NULL, \n'
+                   '    score INTEGER NOT NULL, \n'
+                   '    qsos INTEGER NOT NULL);')
+    cursor.execute('CREATE INDEX IF NOT EXISTS score_snapshot_event_timestamp ON score_snapshot(event_id, timestamp);')
+    cursor.execute('CREATE TABLE IF NOT EXISTS score_delta\n'
+                   '    (snapshot_id INTEGER NOT NULL, \n'
+                   '    field TEXT NOT NULL, \n'
+                   '    value);')
+    cursor.execute('CREATE INDEX IF NOT EXISTS score_delta_snapshot_id ON score_delta(snapshot_id);')
+    cursor.execute('CREATE TABLE IF NOT EXISTS score_current\n'
+                   '    (event_id INTEGER PRIMARY KEY NOT NULL, \n'
+                   '    timestamp INTEGER NOT NULL, \n'
+                   '    score INTEGER NOT NULL, \n'
+                   '    qsos INTEGER NOT NULL, \n'
+                   '    score_trend INTEGER NOT NULL, \n'
+                   '    qso_trend INTEGER NOT NULL);')
+
+    cursor.execute('PRAGMA table_info(qso_log);')
+    if 'event_id' not in [row[1] for row in cursor.fetchall()]:
+        add_qso_log_events(db, cursor)
+    if indexes:
+        create_qso_log_indexes(cursor)
+    db.commit()
+
+
+def add_qso_log_events(db, cursor):
+    """
+    add the event_id column to a qso_log from before events.
+    the QSOs in the configured event's time window belong to that event, the others
+    to an event for each year, named for the year, which can then be archived.
+    this is the only place the window picks QSOs, from now on every QSO received is
+    recorded for the configured event, whatever its time.
+    """
+    logging.info('adding events to the qso_log table...')
+    cursor.execute('ALTER TABLE qso_log ADD COLUMN event_id INTEGER NOT NULL DEFAULT 0;')
+    cursor.execute('UPDATE qso_log SET event_id = ? WHERE timestamp >= ? AND timestamp <= ?;',
+                   (active_event_id(db, cursor), event_time(EVENT_START_TIME), event_time(EVENT_END_TIME)))
+    cursor.execute("SELECT strftime('%Y', timestamp, 'unixepoch') AS year, MIN(timestamp), MAX(timestamp) \n"
+                   'FROM qso_log WHERE event_id = 0 GROUP BY year;')
+    for year, start_time, end_time in cursor.fetchall():
+        cursor.execute('INSERT INTO event (name, start_time, end_time) VALUES (?, ?, ?);',
+                       ('%s QSOs' % year, start_time, end_time))
+        cursor.execute('UPDATE qso_log SET event_id = ? WHERE event_id = 0 AND timestamp >= ? AND timestamp <= ?;',
+                       (cursor.lastrowid, start_time, end_time))
+    db.commit()
+
+
+def event_time(event_datetime):
+    """
+    convert an event time from the configuration into a timestamp
+    """
+    return calendar.timegm(event_datetime.timetuple())
+
+
+def find_event_id(cursor, name, start_time):
+    """
+    the id of the event with this name and start time, or None
+    """
+    cursor.execute('SELECT id FROM event WHERE name = ? AND start_time = ?;', (name, start_time))
+    row = cursor.fetchone()
+    return None if row is None else row[0]
+
+
+def active_event_id(db, cursor):
+    """
+    the id of the configured event, EVENT_NAME from EVENT_START_TIME to EVENT_END_TIME.
+    if the event is not found, create it.
+    """
+    start_time = event_time(EVENT_START_TIME)
+    event_id = find_event_id(cursor, EVENT_NAME, start_time)
+    if event_id is None:
+        cursor.execute('INSERT INTO event (name, start_time, end_time) VALUES (?, ?, ?);',
+                       (EVENT_NAME, start_time, event_time(EVENT_END_TIME)))
+        db.commit()
+        event_id = cursor.lastrowid
+        logging.info('new event %s, id %d', EVENT_NAME, event_id)
+    return event_id
+
+
+def event_list(cursor):
+    """
+    every event as (id, name, start time, end time, archive file name or None, QSO count), oldest first
+    """
+    cursor.execute('SELECT id, name, start_time, end_time, archive, \n'
+                   '    (SELECT COUNT(*) FROM qso_log WHERE event_id = event.id) \n'
+                   'FROM event ORDER BY start_time;')
+    return cursor.fetchall()
+
+
+@timed
+def copy_event(db, cursor, filename, event_id):
+    """
+    copy an event, its QSOs and its score snapshots from the database file filename into db,
+    which must have the tables and no QSOs of the event.  operators and stations are copied
+    whole, so their ids stay the same.  returns the number of QSOs copied.
+    """
+    cursor.execute('ATTACH DATABASE ? AS source;', (filename,))
+    try:
+        cursor.execute('INSERT INTO operator SELECT * FROM source.operator;')
+        cursor.execute('INSERT INTO station SELECT * FROM source.station;')
+        cursor.execute('INSERT INTO event (id, name, start_time, end_time) \n'
+                       'SELECT id, name, start_time, end_time FROM source.event WHERE id = ?;', (event_id,))
+        cursor.execute('INSERT INTO qso_log (' + QSO_LOG_COLUMNS + ') \n'
+                       'SELECT ' + QSO_LOG_COLUMNS + ' FROM source.qso_log WHERE event_id = ? ORDER BY timestamp;',
+                       (event_id,))
+        copied = cursor.rowcount
+        cursor.execute('INSERT INTO score_snapshot SELECT * FROM source.score_snapshot WHERE event_id = ?;',
+                       (event_id,))
+        cursor.execute('INSERT INTO score_delta SELECT score_delta.* FROM source.score_delta \n'
+                       'JOIN source.score_snapshot ON source.score_snapshot.id = snapshot_id WHERE event_id = ?;',
+                       (event_id,))
+        cursor.execute('INSERT INTO score_current SELECT * FROM source.score_current WHERE event_id = ?;',
+                       (event_id,))
+        db.commit()
+    except sqlite3.Error:
+        db.rollback()
+        raise
+    finally:
+        cursor.execute('DETACH DATABASE source;')
+    return copied
+
+
+@timed
+def event_qso_count(cursor, event_id):
+    cursor.execute('SELECT COUNT(*) FROM qso_log WHERE event_id = ?;', (event_id,))
+    return cursor.fetchone()[0]
+
+
+@timed
+def delete_event_qsos(cursor, event_id, archive):
+    """
+    delete the QSOs and score snapshots of an archived event, and record the archive file name on the event
+    """
+    cursor.execute('DELETE FROM qso_log WHERE event_id = ?;', (event_id,))
+    cursor.execute('DELETE FROM score_delta WHERE snapshot_id IN (SELECT id FROM score_snapshot WHERE event_id = ?);',
+                   (event_id,))
+    cursor.execute('DELETE FROM score_snapshot WHERE event_id = ?;', (event_id,))
+    cursor.execute('DELETE FROM score_current WHERE event_id = ?;', (event_id,))
+    cursor.execute('UPDATE event SET archive = ? WHERE id = ?;', (archive, event_id))
+
+
+def create_qso_log_indexes(cursor):
+    """
+    create the secondary indexes on the qso_log table
+    """
+    for name, column in QSO_LOG_INDEXES:
+        cursor.execute('CREATE INDEX IF NOT EXISTS %s ON qso_log(%s);' % (name, column))
+
+
+def drop_qso_log_indexes(cursor):
+    """
+    drop the secondary indexes on the qso_log table, so a bulk load does not maintain them row by row
+    """
+    for name, column in QSO_LOG_INDEXES:
+        cursor.execute('DROP INDEX IF EXISTS %s;' % name)
+
+
+class Operators:
+    operators = {}
+    db = None
+    cursor = None
+    auto_commit = True
+
+    def __init__(self, db, cursor, auto_commit=True):
+        self.db = db
+        self.cursor = cursor
+        self.auto_commit = auto_commit
+        self.operators = {}
+        # load operators
+        self.cursor.execute('SELECT id, name FROM operator;')
+        for row in self.cursor:
+            self.operators[row[1]] = row[0]
+
+    def lookup_operator_id(self, operator):
+        """
+        lookup the operator id for the supplied operator text.
+        if the operator is not found, create it.
+        """
+        oid = self.operators.get(operator)
+        if oid is None:
+            self.cursor.execute('INSERT INTO operator (name) VALUES (?);', (operator,))
+            if self.auto_commit:
+                self.db.commit()
+            oid = self.cursor.lastrowid
+            self.operators[operator] = oid
+        return oid
+
+
+class Stations:
+    stations = {}
+    db = None
+    cursor = None
+    auto_commit = True
+
+    def __init__(self, db, cursor, auto_commit=True):
+        self.db = db
+        self.cursor = cursor
+        self.auto_commit = auto_commit
+        self.stations = {}
+        self.cursor.execute('SELECT id, name FROM station;')
+        for row in self.cursor:
+            self.stations[row[1]] = row[0]
+
+    def lookup_station_id(self, station):
+        sid = self.stations.get(station)
+        if sid is None:
+            self.cursor.execute('INSERT INTO station (name) VALUES (?);', (station,))
+            if self.auto_commit:
+                self.db.commit()
+            sid = self.cursor.lastrowid
+            self.stations[station] = sid
+        return sid
+
+
+@timed
+def insert_qso(cursor, values):
+    """
+    insert one QSO, values are in QSO_LOG_COLUMNS order
+    """
+    cursor.execute(QSO_LOG_INSERT, values)
+
+
+@timed
+def insert_qsos(cursor, rows):
+    """
+    insert many QSOs, rows is an iterable of values in QSO_LOG_COLUMNS order
+    """
+    cursor.executemany(QSO_LOG_INSERT, rows)
+
+
+@timed
+def upsert_qso(cursor, values):
+    """
+    insert a QSO, replacing any QSO of its event with the same timestamp and call
+    """
+    cursor.execute('DELETE FROM qso_log WHERE event_id = ? AND timestamp = ? AND callsign = ?;',
+                   (values[14], values[0], values[8]))
+    cursor.execute(QSO_LOG_INSERT, values)
+
+
+@timed
+def delete_qso(cursor, event_id, timestamp, callsign):
+    """
+    delete the QSOs of an event with this timestamp and call.
+    returns a list of (band id, operator name, section) for the deleted QSOs
+    """
+    cursor.execute('SELECT band_id, operator.name, section FROM qso_log JOIN operator ON operator.id = operator_id \n'
+                   'WHERE event_id = ? AND callsign = ? AND timestamp = ?;', (event_id, callsign, timestamp))
+    deleted = cursor.fetchall()
+    cursor.execute('DELETE FROM qso_log WHERE event_id = ? AND callsign = ? AND timestamp = ?;',
+                   (event_id, callsign, timestamp))
+    return deleted
+
+
+@timed
+def delete_qso_by_rowid(cursor, rowid):
+    cursor.execute('DELETE FROM qso_log WHERE rowid = ?;', (rowid,))
+
+
+@timed
+def delete_qsos_between(cursor, event_id, start_time, end_time):
+    """
+    delete the QSOs of an event from start_time up to, not including, end_time
+    """
+    cursor.execute('DELETE FROM qso_log WHERE event_id = ? AND timestamp >= ? AND timestamp < ?;',
+                   (event_id, start_time, end_time))
+
+
+@timed
+def qso_count(cursor):
+    cursor.execute('SELECT COUNT(*) FROM qso_log;')
+    return cursor.fetchone()[0]
+
+
+@timed
+def recent_qsos(cursor, event_id, count):
+    """
+    the last count QSOs of an event as (timestamp, callsign, section), newest first
+    """
+    cursor.execute('SELECT timestamp, callsign, section FROM qso_log WHERE event_id = ? \n'
+                   'ORDER BY timestamp DESC LIMIT ?;', (event_id, count))
+    return cursor.fetchall()
+
+
+@timed
+def last_qso(cursor, event_id):
+    """
+    the last QSO of an event as (timestamp, callsign, exchange, section, operator name, band id), or None
+    """
+    cursor.execute('SELECT timestamp, callsign, exchange, section, operator.name, band_id \n'
+                   'FROM qso_log JOIN operator WHERE operator.id = operator_id AND event_id = ? \n'
+                   'ORDER BY timestamp DESC LIMIT 1;', (event_id,))
+    return cursor.fetchone()
+
+
+@timed
+def first_qso_time(cursor, event_id):
+    """
+    the timestamp of the first QSO of an event, or None
+    """
+    cursor.execute('SELECT timestamp FROM qso_log WHERE event_id = ? ORDER BY timestamp LIMIT 1;', (event_id,))
+    row = cursor.fetchone()
+    return None if row is None else row[0]
+
+
+@timed
+def qsos_by_operator(cursor, event_id):
+    """
+    a list of (operator name, QSO count) for an event, most QSOs first
+    """
+    cursor.execute('SELECT name, COUNT(operator_id) AS qso_count \n'
+                   'FROM qso_log JOIN operator ON operator.id = operator_id WHERE event_id = ? \n'
+                   'GROUP BY operator_id ORDER BY qso_count DESC;', (event_id,))
+    return cursor.fetchall()
+
+
+@timed
+def qsos_by_station(cursor, event_id):
+    """
+    a list of (station name, QSO count) for an event
+    """
+    cursor.execute('SELECT name, COUNT(station_id) AS qso_count \n'
+                   'FROM qso_log JOIN station ON station.id = station_id WHERE event_id = ? \n'
+                   'GROUP BY station_id;', (event_id,))
+    return cursor.fetchall()
+
+
+@timed
+def qsos_by_band_mode(cursor, event_id):
+    """
+    a list of (QSO count, band id, mode id) for an event
+    """
+    cursor.execute('SELECT COUNT(*), band_id, mode_id FROM qso_log WHERE event_id = ? GROUP BY band_id, mode_id;',
+                   (event_id,))
+    return cursor.fetchall()
+
+
+@timed
+def top_operators_between(cursor, event_id, start_time, end_time):
+    """
+    the ten operators with the most QSOs of an event from start_time to end_time,
+    as a list of (operator name, QSO count)
+    """
+    cursor.execute('SELECT operator.name, COUNT(operator_id) qso_count FROM qso_log\n'
+                   'JOIN operator ON operator.id = operator_id\n'
+                   'WHERE event_id = ? AND timestamp >= ? AND timestamp <= ?\n'
+                   'GROUP BY operator_id ORDER BY qso_count DESC LIMIT 10;', (event_id, start_time, end_time))
+    return cursor.fetchall()
+
+
+@timed
+def qsos_by_section(cursor, event_id):
+    """
+    a dict of section -> QSO count for an event
+    """
+    cursor.execute('SELECT section, COUNT(section) AS qsos FROM qso_log WHERE event_id = ? GROUP BY section;',
+                   (event_id,))
+    return dict(cursor.fetchall())
+
+
+@timed
+def qso_times_and_bands(cursor, event_id):
+    """
+    every QSO of an event as (timestamp, band id)
+    """
+    cursor.execute('SELECT timestamp, band_id FROM qso_log WHERE event_id = ?;', (event_id,))
+    return cursor.fetchall()
+
+
+@timed
+def upsert_radio_status(cursor, rows):
+    """
+    replace the status of radios, rows are
+    (station name, radio number, freq, tx freq, band id, mode id, operator, running, updated)
+    """
+    cursor.executemany('INSERT OR REPLACE INTO radio_status \n'
+                       '(station_name, radio_nr, freq, tx_freq, band_id, mode_id, operator, running, updated) \n'
+                       'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);', rows)
+
+
+@timed
+def radio_status_list(cursor, since):
+    """
+    the status of the radios heard from since the timestamp since, as
+    (station name, radio number, freq, band id, mode id, operator, running), by station and radio
+    """
+    cursor.execute('SELECT station_name, radio_nr, freq, band_id, mode_id, operator, running FROM radio_status \n'
+                   'WHERE updated >= ? ORDER BY station_name, radio_nr;', (since,))
+    return cursor.fetchall()
+
+
+def insert_score_snapshot(cursor, event_id, timestamp, score, qsos, changes):
+    """
+    record a score snapshot of an event, changes are the (field, value) pairs of the score
+    breakdown that changed since the event's previous snapshot, a value of None for a field
+    that is gone.  returns the snapshot id.
+    """
+    cursor.execute('INSERT INTO score_snapshot (event_id, timestamp, score, qsos) VALUES (?, ?, ?, ?);',
+                   (event_id, timestamp, score, qsos))
+    snapshot_id = cursor.lastrowid
+    cursor.executemany('INSERT INTO score_delta (snapshot_id, field, value) VALUES (?, ?, ?);',
+                       [(snapshot_id, field, value) for field, value in changes])
+    return snapshot_id
+
+
+def upsert_current_score(cursor, event_id, timestamp, score, qsos, score_trend, qso_trend):
+    """
+    replace the current score of an event
+    """
+    cursor.execute('INSERT OR REPLACE INTO score_current \n'
+                   '(event_id, timestamp, score, qsos, score_trend, qso_trend) \n'
+                   'VALUES (?, ?, ?, ?, ?, ?);', (event_id, timestamp, score, qsos, score_trend, qso_trend))
+
+
+@timed
+def score_fields(cursor, event_id, until=None):
+    """
+    the score breakdown of an event as of its last snapshot, or its last snapshot at or before
+    the timestamp until, as a dict of field -> value, put back together from the deltas
+    """
+    cursor.execute('SELECT field, value FROM score_delta JOIN score_snapshot ON score_snapshot.id = snapshot_id \n'
+                   'WHERE event_id = ? AND timestamp <= ? ORDER BY snapshot_id;',
+                   (event_id, 2 ** 62 if until is None else until))
+    fields = {}
+    for field, value in cursor.fetchall():
+        if value is None:
+            fields.pop(field, None)
+        else:
+            fields[field] = value
+    return fields
+
+
+@timed
+def score_at(cursor, event_id, timestamp):
+    """
+    (timestamp, score, QSOs) of the event's last snapshot at or before timestamp,
+    or of its first snapshot if there is none that early, None if there are no snapshots
+    """
+    cursor.execute('SELECT timestamp, score, qsos FROM score_snapshot WHERE event_id = ? AND timestamp <= ? \n'
+                   'ORDER BY timestamp DESC LIMIT 1;', (event_id, timestamp))
+    row = cursor.fetchone()
+    if row is None:
+        cursor.execute('SELECT timestamp, score, qsos FROM score_snapshot WHERE event_id = ? \n'
+                       'ORDER BY timestamp LIMIT 1;', (event_id,))
+        row = cursor.fetchone()
+    return row
+
+
+@timed
+def current_score(cursor, event_id):
+    """
+    (timestamp, score, QSOs, score trend, QSO trend) of the event's current score, the trends per hour,
+    None if no score has been received
+    """
+    cursor.execute('SELECT timestamp, score, qsos, score_trend, qso_trend FROM score_current WHERE event_id = ?;',
+                   (event_id,))
+    return cursor.fetchone()
+
+
+@timed
+def compare_rows(cursor, event_id, start_time, end_time):
+    """
+    the QSO fields of an event compared with the N1MM+ log, from start_time up to, not including, end_time:
+    (timestamp, callsign, band id, mode id, operator name, station name, section, exchange)
+    """
+    cursor.execute(COMPARE_QUERY, (event_id, start_time, end_time))
+    return [tuple(row) for row in cursor.fetchall()]
+
+
+@timed
+def compare_rows_with_rowid(cursor, event_id, start_time, end_time):
+    """
+    the compare_rows fields, each row led by the rowid to repair it by
+    """
+    cursor.execute(COMPARE_ROWID_QUERY, (event_id, start_time, end_time))
+    return cursor.fetchall()
+
+
+@timed
+def operator_counts_between(cursor, event_id, start_time, end_time):
+    """
+    a list of (operator name, QSO count) of an event from start_time up to, not including, end_time
+    """
+    cursor.execute('SELECT name, COUNT(operator_id) FROM qso_log JOIN operator ON operator.id = operator_id \n'
+                   'WHERE event_id = ? AND timestamp >= ? AND timestamp < ? GROUP BY operator_id;',
+                   (event_id, start_time, end_time))
+    return cursor.fetchall()
+
+
+@timed
+def station_counts_between(cursor, event_id, start_time, end_time):
+    """
+    a list of (station name, QSO count) of an event from start_time up to, not including, end_time
+    """
+    cursor.execute('SELECT name, COUNT(station_id) FROM qso_log JOIN station ON station.id = station_id \n'
+                   'WHERE event_id = ? AND timestamp >= ? AND timestamp < ? GROUP BY station_id;',
+                   (event_id, start_time, end_time))
+    return cursor.fetchall()
+
+
+@timed
+def band_mode_counts_between(cursor, event_id, start_time, end_time):
+    """
+    a list of (band id, mode id, QSO count) of an event from start_time up to, not including, end_time
+    """
+    cursor.execute('SELECT band_id, mode_id, COUNT(*) FROM qso_log \n'
+                   'WHERE event_id = ? AND timestamp >= ? AND timestamp < ? GROUP BY band_id, mode_id;',
+                   (event_id, start_time, end_time))
+    return cursor.fetchall()
+
+
+@timed
+def section_counts_between(cursor, event_id, start_time, end_time):
+    """
+    a list of (section, QSO count) of an event from start_time up to, not including, end_time
+    """
+    cursor.execute('SELECT section, COUNT(section) FROM qso_log \n'
+                   'WHERE event_id = ? AND timestamp >= ? AND timestamp < ? GROUP BY section;',
+                   (event_id, start_time, end_time))
+    return cursor.fetchall()
+
+
+@timed
+def qso_times_and_bands_between(cursor, event_id, start_time, end_time):
+    """
+    (timestamp, band id) of the QSOs of an event from start_time up to, not including, end_time
+    """
+    cursor.execute('SELECT timestamp, band_id FROM qso_log WHERE event_id = ? AND timestamp >= ? AND timestamp < ?;',
+                   (event_id, start_time, end_time))
+    return cursor.fetchall()
+
+
+def sum_counts(chunks):
+    """
+    merge chunks of (key, ..., count) rows into a dict of key -> count.
+    the key is the first column, or a tuple of the columns before the count.
+    """
+    counts = {}
+    for rows in chunks:
+        for row in rows:
+            key = row[0] if len(row) == 2 else tuple(row[:-1])
+            counts[key] = counts.get(key, 0) + row[-1]
+    return counts
+
+
+def concatenate(chunks):
+    """
+    merge chunks of rows into one list
+    """
+    rows = []
+    for chunk in chunks:
+        rows.extend(chunk)
+    return rows
+
+
+class QueryBudget:
+    """
+    a time budget for the queries of one cycle, enforced with a progress handler on the connection.
+    a query still running when the budget is used up is interrupted.  run() then returns the
+    last result of that query, and the names of the queries that were cut short are in overruns.
+    a budget of None seconds never runs out.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.deadline = 0
+        self.cached = {}
+        self.overruns = []
+        self.overrun_count = 0
+        # python 2's sqlite3 only keeps the first of several equal handlers alive, so always pass the same one
+        self.progress_handler = self._progress
+
+    def start(self, db):
+        self.overruns = []
+        if self.seconds is None:
+            self.deadline = float('inf')
+            return
+        self.deadline = time.time() + self.seconds
+        db.set_progress_handler(self.progress_handler, PROGRESS_INSTRUCTIONS)
+
+    def stop(self, db):
+        db.set_progress_handler(None, PROGRESS_INSTRUCTIONS)
+
+    def _progress(self):
+        # a non-zero return interrupts the query
+        return 1 if time.time() > self.deadline else 0
+
+    def call(self, name, function, *args):
+        """
+        call a query function, returns (True, result), or (False, None) if the budget ran out
+        before or during the query.
+        """
+        if time.time() <= self.deadline:
+            try:
+                return True, function(*args)
+            except sqlite3.OperationalError as e:
+                if 'interrupt' not in str(e):
+                    raise
+        if name not in self.overruns:
+            self.overruns.append(name)
+            self.overrun_count += 1
+        return False, None
+
+    def run(self, name, function, *args):
+        """
+        call a query function, returns its result, or its last result if the budget ran out
+        """
+        completed, result = self.call(name, function, *args)
+        if completed:
+            self.cached[name] = result
+            return result
+        return self.cached.get(name)
+
+    def clear(self):
+        """
+        forget the cached results, for a different database
+        """
+        self.cached = {}
+
+
+class ChunkedAggregate:
+    """
+    a whole-event aggregate computed from time-range chunks.  each chunk is a short range query
+    that uses the (event_id, timestamp) index; chunks are kept between cycles, so a cycle only queries
+    the newest chunk, the chunks invalidated since the last cycle, the chunks not done yet,
+    and the oldest kept chunk again, to pick up changes nobody was told about.
+    if the budget runs out first, the chunks done so far are kept for the next cycle, and the
+    last complete result is returned.
+    """
+
+    def __init__(self, name, query_function, merge_function, chunk_seconds):
+        self.name = name
+        self.query_function = query_function
+        self.merge_function = merge_function
+        self.chunk_seconds = chunk_seconds
+        self.chunks = {}  # chunk start time -> rows
+        self.computed = {}  # chunk start time -> when it was queried
+        self.result = None
+        self.event_id = None
+
+    def invalidate(self, timestamp):
+        """
+        forget the chunk holding timestamp, the QSOs in it changed
+        """
+        start = timestamp // self.chunk_seconds * self.chunk_seconds
+        self.chunks.pop(start, None)
+        self.computed.pop(start, None)
+
+    def clear(self):
+        self.chunks = {}
+        self.computed = {}
+        self.result = None
+
+    def update(self, cursor, budget, event_id, first_time, last_time):
+        """
+        bring the aggregate up to date for an event with QSOs from first_time to last_time, None if it has none.
+        returns (result, complete), complete is False if the result is not up to date.
+        """
+        if event_id != self.event_id:
+            self.clear()
+            self.event_id = event_id
+        if last_time is None:
+            self.clear()
+            self.result = self.merge_function([])
+            return self.result, True
+        if first_time is None:
+            # the start of the log could not be read this cycle
+            if self.result is None:
+                return self.merge_function([]), False
+            return self.result, False
+        first_chunk = first_time // self.chunk_seconds * self.chunk_seconds
+        last_chunk = last_time // self.chunk_seconds * self.chunk_seconds
+        for start in self.chunks.keys():
+            if start < first_chunk or start > last_chunk:
+                self.invalidate(start)
+        # new QSOs land in the newest chunk
+        self.invalidate(last_chunk)
+        todo = [start for start in range(last_chunk, first_chunk - 1, -self.chunk_seconds)
+                if start not in self.chunks]
+        if len(todo) == 1 and self.chunks:
+            todo.append(min(self.chunks.keys(), key=lambda start: self.computed[start]))
+        for start in todo:
+            completed, rows = budget.call(self.name, self.query_function, cursor, event_id, start,
+                                          start + self.chunk_seconds)
+            if not completed:
+                break
+            self.chunks[start] = rows
+            self.computed[start] = time.time()
+        complete = len(self.chunks) == (last_chunk - first_chunk) // self.chunk_seconds + 1
+        if complete or self.result is None:
+            # until the first complete result, a partial one is better than nothing
+            self.result = self.merge_function([self.chunks[start] for start in sorted(self.chunks.keys())])
+        return self.result, complete
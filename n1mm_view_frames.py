@@ -0,0 +1,100 @@
+"""
+last-frame cache for the n1mm_view dashboard.
+every chart the chart engine publishes is saved as a PNG with a fingerprint of the data
+it was drawn from, so that a restarted dashboard can put the last charts back on the
+screen right away, and the chart engine can skip redrawing charts whose data has not changed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+from n1mm_view_httpd import encode_png
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+
+def _json_default(obj):
+    # numpy arrays and scalars
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    return repr(obj)
+
+
+def data_fingerprint(*data):
+    """
+    a fingerprint of the data a chart is drawn from
+    """
+    return hashlib.md5(json.dumps(data, sort_keys=True, default=_json_default)).hexdigest()
+
+
+class FrameCache:
+    """
+    the last published frame of each chart, as <directory>/<name>.png and <name>.json
+    """
+
+    def __init__(self, directory, image_names):
+        self.directory = directory
+        self.image_names = image_names
+        self.metadata = {}
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        for image_index, name in enumerate(image_names):
+            try:
+                with open(self._filename(image_index, 'json')) as f:
+                    metadata = json.load(f)
+                if os.path.exists(self._filename(image_index, 'png')):
+                    self.metadata[image_index] = metadata
+            except (IOError, ValueError):
+                pass
+
+    def _filename(self, image_index, extension):
+        return os.path.join(self.directory, '%s.%s' % (self.image_names[image_index], extension))
+
+    def _write(self, filename, data):
+        # write then rename, so a crash never leaves a half written frame
+        temp_filename = filename + '.tmp'
+        with open(temp_filename, 'wb') as f:
+            f.write(data)
+        os.rename(temp_filename, filename)
+
+    def is_current(self, image_index, fingerprint):
+        """
+        True if the cached frame was drawn from data with this fingerprint
+        """
+        metadata = self.metadata.get(image_index)
+        return metadata is not None and metadata.get('fingerprint') == fingerprint
+
+    def save(self, image_index, image_data, image_size, fingerprint):
+        """
+        save a published frame, returns the PNG data
+        """
+        png_data = encode_png(image_data, image_size)
+        metadata = {'fingerprint': fingerprint, 'size': list(image_size), 'saved': time.time()}
+        try:
+            self._write(self._filename(image_index, 'png'), png_data)
+            self._write(self._filename(image_index, 'json'), json.dumps(metadata))
+            self.metadata[image_index] = metadata
+        except (IOError, OSError) as e:
+            logging.warn('could not save frame %s: %s', self.image_names[image_index], e)
+        return png_data
+
+    def frames(self):
+        """
+        the cached frames, a list of (image index, PNG filename)
+        """
+        return [(image_index, self._filename(image_index, 'png')) for image_index in sorted(self.metadata.keys())]
+
+    def png_data(self, image_index):
+        """
+        the PNG data of a cached frame, or None
+        """
+        try:
+            with open(self._filename(image_index, 'png'), 'rb') as f:
+                return f.read()
+        except IOError:
+            return None
@@ -0,0 +1,189 @@
+"""
+a small built-in web server for n1mm_view.
+serves the most recently rendered charts straight from memory, so that browsers on the
+LAN can follow the dashboard without Apache or PNG files written to HTML_DIR.
+"""
+
+import json
+import logging
+import struct
+import threading
+import time
+import zlib
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from email.utils import formatdate, parsedate_tz, mktime_tz
+from hashlib import md5
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+PNG_COMPRESSION_LEVEL = 6
+
+INDEX_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta http-equiv="refresh" content="%d">
+<title>%s</title>
+<style>body { background-color: black; color: white; text-align: center; } img { max-width: 100%%; }</style>
+</head>
+<body>
+<h1>%s</h1>
+%s
+</body>
+</html>
+'''
+
+
+def encode_png(raw_data, size):
+    """
+    encode raw RGB image data as PNG bytes.
+    """
+    width, height = size
+    row_bytes = width * 3
+    # each scanline is prefixed with filter type 0 (none)
+    scanlines = b''.join(b'\x00' + raw_data[y * row_bytes:(y + 1) * row_bytes] for y in range(0, height))
+
+    def chunk(chunk_type, data):
+        return (struct.pack('>I', len(data)) + chunk_type + data +
+                struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(scanlines, PNG_COMPRESSION_LEVEL)) +
+            chunk(b'IEND', b''))
+
+
+class Resource:
+    """
+    a ready-to-send response body with its validators.
+    """
+
+    def __init__(self, body, content_type):
+        self.body = body
+        self.content_type = content_type
+        self.etag = '"%s"' % md5(body).hexdigest()
+        self.last_modified = int(time.time())
+
+
+class ChartStore:
+    """
+    thread-safe holder for the latest chart images and statistics.
+    """
+
+    def __init__(self, image_names):
+        self.image_names = image_names
+        self.resources = {}
+        self.image_hashes = {}
+        self.lock = threading.Lock()
+
+    def put_image(self, image_index, image_data, image_size):
+        # encoding the PNG is the expensive part, skip it when the image has not changed
+        image_hash = (md5(image_data).digest(), image_size)
+        with self.lock:
+            if self.image_hashes.get(image_index) == image_hash:
+                return
+        self.put_png(image_index, encode_png(image_data, image_size), image_hash)
+
+    def put_png(self, image_index, png_data, image_hash=None):
+        name = '%s.png' % self.image_names[image_index]
+        resource = Resource(png_data, 'image/png')
+        with self.lock:
+            self.image_hashes[image_index] = image_hash
+            old = self.resources.get(name)
+            if old is None or old.etag != resource.etag:
+                self.resources[name] = resource
+
+    def put_stats(self, stats):
+        resource = Resource(json.dumps(stats, sort_keys=True), 'application/json')
+        with self.lock:
+            old = self.resources.get('stats.json')
+            if old is None or old.etag != resource.etag:
+                self.resources['stats.json'] = resource
+
+    def get(self, name):
+        with self.lock:
+            return self.resources.get(name)
+
+    def chart_names(self):
+        with self.lock:
+            return ['%s.png' % name for name in self.image_names if '%s.png' % name in self.resources]
+
+
+class ChartRequestHandler(BaseHTTPRequestHandler):
+    """
+    serve the index page, the chart images and the stats.
+    """
+    server_version = 'n1mm_view'
+
+    def do_HEAD(self):
+        self.send_resource(self.find_resource(), False)
+
+    def do_GET(self):
+        self.send_resource(self.find_resource(), True)
+
+    def find_resource(self):
+        path = self.path.split('?', 1)[0].lstrip('/')
+        if path == '' or path == 'index.html':
+            images = '\n'.join('<p><img src="%s" alt="%s"></p>' % (name, name)
+                               for name in self.server.chart_store.chart_names())
+            return Resource(INDEX_TEMPLATE % (self.server.refresh_time, self.server.title, self.server.title, images),
+                            'text/html')
+        return self.server.chart_store.get(path)
+
+    def not_modified(self, resource):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return resource.etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            parsed = parsedate_tz(if_modified_since)
+            if parsed is not None:
+                return resource.last_modified <= mktime_tz(parsed)
+        return False
+
+    def send_resource(self, resource, send_body):
+        if resource is None:
+            self.send_error(404, 'Not Found')
+            return
+        if self.not_modified(resource):
+            self.send_response(304)
+            self.send_header('ETag', resource.etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', resource.content_type)
+        self.send_header('Content-Length', str(len(resource.body)))
+        self.send_header('ETag', resource.etag)
+        self.send_header('Last-Modified', formatdate(resource.last_modified, usegmt=True))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if send_body:
+            self.wfile.write(resource.body)
+
+    def log_message(self, format, *args):
+        logging.debug('http: %s %s' % (self.address_string(), format % args))
+
+
+class ChartServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port, chart_store, title, refresh_time):
+        HTTPServer.__init__(self, ('', port), ChartRequestHandler)
+        self.chart_store = chart_store
+        self.title = title
+        self.refresh_time = refresh_time
+
+
+def start_chart_server(port, chart_store, title, refresh_time):
+    """
+    start the web server on a background thread.
+    """
+    server = ChartServer(port, chart_store, title, refresh_time)
+    thread = threading.Thread(name='chart-server', target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    logging.info('chart server listening on port %d', port)
+    return server
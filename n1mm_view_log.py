@@ -0,0 +1,144 @@
+"""
+asynchronous logging for the n1mm_view collector and dashboard.
+log records are put on a bounded queue and written by a background thread, so a slow
+serial or framebuffer console never holds up the collector's QSO path or the dashboard's
+chart cycle.  when the queue is full, records are dropped and counted, and the number
+dropped is logged by the writer once it catches up.
+"""
+
+import logging
+import os
+import Queue
+import threading
+import time
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+# seconds flush() waits for the writer to empty the queue
+FLUSH_TIMEOUT = 5
+
+_exception_formatter = logging.Formatter()
+_handler = None
+
+
+class AsyncHandler(logging.Handler):
+    """
+    a handler that queues records for a writer thread, which passes them on to the target handlers
+    """
+
+    def __init__(self, targets, queue_size):
+        logging.Handler.__init__(self)
+        self.targets = targets
+        self.queue_size = queue_size
+        self.drop_lock = threading.Lock()
+        self.dropped = 0
+        self.total_dropped = 0
+        self.pid = None
+        self.queue = None
+        self.thread = None
+        self._start()
+
+    def _start(self):
+        self.pid = os.getpid()
+        self.queue = Queue.Queue(self.queue_size)
+        self.thread = threading.Thread(name='log-writer', target=self._writer, args=(self.queue,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _check_fork(self):
+        if os.getpid() != self.pid:
+            # a forked process, the writer thread did not come along, and may have held the locks
+            self.drop_lock = threading.Lock()
+            self.dropped = 0
+            for target in self.targets:
+                target.createLock()
+            self._start()
+
+    def emit(self, record):
+        self._check_fork()
+        try:
+            # the arguments may change once the caller moves on, and the traceback will not wait
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = _exception_formatter.formatException(record.exc_info)
+                record.exc_info = None
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            with self.drop_lock:
+                self.dropped += 1
+                self.total_dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def _write(self, record):
+        for target in self.targets:
+            if record.levelno >= target.level:
+                target.handle(record)
+
+    def _writer(self, queue):
+        while True:
+            record = queue.get()
+            if record is None:
+                break
+            self._write(record)
+            if self.dropped:
+                with self.drop_lock:
+                    dropped, self.dropped = self.dropped, 0
+                self._write(logging.makeLogRecord({'name': __name__, 'levelno': logging.WARN,
+                                                   'levelname': logging.getLevelName(logging.WARN),
+                                                   'msg': '%d log messages dropped, the log is too slow' % dropped}))
+
+    def flush(self):
+        """
+        wait a little while for the writer to catch up, then flush the targets
+        """
+        self._check_fork()
+        deadline = time.time() + FLUSH_TIMEOUT
+        while not self.queue.empty() and self.thread.is_alive() and time.time() < deadline:
+            time.sleep(0.01)
+        for target in self.targets:
+            target.flush()
+
+    def close(self):
+        if os.getpid() == self.pid and self.thread.is_alive():
+            self.flush()
+            try:
+                self.queue.put(None, timeout=FLUSH_TIMEOUT)
+                self.thread.join(FLUSH_TIMEOUT)
+            except Queue.Full:
+                pass
+        logging.Handler.close(self)
+
+
+def start(queue_size):
+    """
+    route the root logger's handlers through an AsyncHandler with a queue of queue_size records.
+    does nothing if queue_size is None, then logging stays synchronous.
+    """
+    global _handler
+    if queue_size is None or _handler is not None:
+        return
+    root = logging.getLogger()
+    targets = root.handlers[:]
+    for target in targets:
+        root.removeHandler(target)
+    _handler = AsyncHandler(targets, queue_size)
+    root.addHandler(_handler)
+
+
+def flush():
+    """
+    wait for the queued records to be written, before a process exits without running atexit
+    """
+    if _handler is not None:
+        _handler.flush()
+
+
+def dropped():
+    """
+    the number of records dropped since logging started
+    """
+    return 0 if _handler is None else _handler.total_dropped
@@ -0,0 +1,72 @@
+"""
+the N1MM+ UDP broadcasts, as the replayer and the synthetic log generator send them.
+"""
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+""" this is what the N1MM+ broadcast looks like. """
+TEMPLATE = '''<?xml version="1.0"?>
+    <contactinfo>
+            <contestname>FD</contestname>
+            <contestnr>1</contestnr>
+            <timestamp>%s</timestamp>
+            <mycall>N4N</mycall>
+            <band>%s</band>
+            <rxfreq>%d</rxfreq>
+            <txfreq>%d</txfreq>
+            <operator>%s</operator>
+            <mode>%s</mode>
+            <call>%s</call>
+            <countryprefix>%s</countryprefix>
+            <wpxprefix>%s</wpxprefix>
+            <stationprefix>%s</stationprefix>
+            <continent>%s</continent>
+            <snt>%s</snt>
+            <sntnr>%s</sntnr>
+            <rcv>%s</rcv>
+            <rcvnr>%s</rcvnr>
+            <gridsquare>%s</gridsquare>
+            <exchange1>%s</exchange1>
+            <section>%s</section>
+            <comment></comment>
+            <qth></qth>
+            <name></name>
+            <power></power>
+            <misctext></misctext>
+            <zone>%d</zone>
+            <prec></prec>
+            <ck>0</ck>
+            <ismultiplier1>0</ismultiplier1>
+            <ismultiplier2>0</ismultiplier2>
+            <ismultiplier3>0</ismultiplier3>
+            <points>%d</points>
+            <radionr>1</radionr>
+            <RoverLocation></RoverLocation>
+            <RadioInterfaced>0</RadioInterfaced>
+            <NetworkedCompNr>0</NetworkedCompNr>
+            <IsOriginal>True</IsOriginal>
+            <StationName>%s</StationName>
+            <NetBiosName>%s</NetBiosName>
+            <IsRunQSO>0</IsRunQSO>
+    </contactinfo>'''
+
+""" this is what the N1MM+ radio status broadcast looks like. """
+RADIO_INFO_TEMPLATE = '''<?xml version="1.0" encoding="utf-8"?>
+    <RadioInfo>
+            <StationName>%s</StationName>
+            <RadioNr>1</RadioNr>
+            <Freq>%d</Freq>
+            <TXFreq>%d</TXFreq>
+            <Mode>%s</Mode>
+            <OpCall>%s</OpCall>
+            <IsRunning>%s</IsRunning>
+            <FocusEntry>0</FocusEntry>
+            <Antenna>0</Antenna>
+            <Rotors></Rotors>
+            <FocusRadioNr>1</FocusRadioNr>
+            <IsStereo>False</IsStereo>
+            <ActiveRadioNr>1</ActiveRadioNr>
+            <IsTransmitting>%s</IsTransmitting>
+    </RadioInfo>'''
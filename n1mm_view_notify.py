@@ -0,0 +1,125 @@
+"""
+change notifications from the collector to the dashboard.
+the collector publishes a small JSON datagram on a loopback UDP port after each
+database commit, the dashboard's chart engine waits on that port instead of polling.
+"""
+
+import json
+import logging
+import select
+import time
+from socket import socket, error as socket_error, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_REUSEADDR
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+NOTIFY_ADDRESS = '127.0.0.1'
+NOTIFY_BUF_SIZE = 1024
+
+CHANGE_NEW = 'new'
+CHANGE_REPLACE = 'replace'
+CHANGE_DELETE = 'delete'
+CHANGE_RADIO = 'radio'
+
+
+class ChangePublisher:
+    """
+    send change events to the dashboard.  never blocks, never fails:
+    if nobody is listening the datagrams are simply lost.
+    """
+
+    def __init__(self, port):
+        self.address = (NOTIFY_ADDRESS, port)
+        self.socket = socket(AF_INET, SOCK_DGRAM)
+        self.socket.setblocking(0)
+
+    def publish(self, change, timestamp, band, operator, section, received=None, committed=None):
+        """
+        received and committed are the times the collector received the broadcast and committed
+        it to the database, carried along for latency tracing.
+        """
+        change_data = {'change': change, 'timestamp': timestamp,
+                       'band': band, 'operator': operator, 'section': section}
+        if received is not None:
+            change_data['received'] = received
+        if committed is not None:
+            change_data['committed'] = committed
+        message = json.dumps(change_data)
+        try:
+            self.socket.sendto(message, self.address)
+        except socket_error as e:
+            logging.debug('could not publish change notification: %s', e)
+
+    def publish_timestamps(self, change, timestamps, chunk_seconds):
+        """
+        publish a change for QSOs written in bulk, with the given timestamps.  only the latest
+        timestamp in each chunk_seconds piece of the log is published, so that a large sync
+        does not overrun the socket, which is enough for the dashboard to recount each piece.
+        """
+        latest = {}
+        for timestamp in timestamps:
+            chunk = timestamp // chunk_seconds
+            latest[chunk] = max(latest.get(chunk, timestamp), timestamp)
+        for timestamp in sorted(latest.values()):
+            self.publish(change, timestamp, None, None, None)
+
+    def close(self):
+        self.socket.close()
+
+
+class ChangeListener:
+    """
+    receive change events from the collector.
+    """
+
+    def __init__(self, port, debounce_time):
+        self.debounce_time = debounce_time
+        self.socket = socket(AF_INET, SOCK_DGRAM)
+        self.socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        self.socket.bind((NOTIFY_ADDRESS, port))
+
+    def _receive(self, timeout):
+        """
+        wait up to timeout seconds for one change event, return it or None.
+        """
+        readable, _, _ = select.select([self.socket], [], [], max(timeout, 0))
+        if not readable:
+            return None
+        data = self.socket.recv(NOTIFY_BUF_SIZE)
+        try:
+            return json.loads(data)
+        except ValueError:
+            logging.warn('bad change notification received, ignoring.')
+            return None
+
+    def wait(self, timeout, stop_event):
+        """
+        wait up to timeout seconds for change events.
+        once a change arrives, keep collecting changes until none have arrived for
+        debounce_time seconds, so that a burst of QSOs causes only one chart update.
+        returns the list of changes received, empty if timed out or stop_event was set.
+        """
+        changes = []
+        deadline = time.time() + timeout
+        while not stop_event.is_set():
+            now = time.time()
+            if now >= deadline:
+                break
+            change = self._receive(min(deadline - now, 1.0))
+            if change is not None:
+                changes.append(change)
+                # a busy pileup must not hold off updates forever
+                if len(changes) == 1:
+                    deadline = min(deadline, now + self.debounce_time * 4)
+                quiet_deadline = time.time() + self.debounce_time
+                while not stop_event.is_set() and time.time() < min(quiet_deadline, deadline):
+                    change = self._receive(min(quiet_deadline, deadline) - time.time())
+                    if change is not None:
+                        changes.append(change)
+                        quiet_deadline = time.time() + self.debounce_time
+                break
+        return changes
+
+    def close(self):
+        self.socket.close()
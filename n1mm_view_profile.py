@@ -0,0 +1,355 @@
+"""
+profiling for the n1mm_view chart engine and display.
+stage timings show where each chart update cycle spends its time: the SQL queries,
+the matplotlib and pygame rendering, the image transfer and the post file command.
+the slowest cycles can also be captured with cProfile for a closer look, and the
+QSO-to-screen latency of each update is traced from the collector to the display.
+the memory watchdog keeps the long running chart engine from growing without bound.
+"""
+
+import cProfile
+import heapq
+import json
+import logging
+import os
+import time
+from collections import deque
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+
+class _NullSpan:
+    """
+    the span used when timing is off, does nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """
+    time one stage, recording the elapsed time when the block exits.
+    """
+
+    def __init__(self, timer, stage):
+        self.timer = timer
+        self.stage = stage
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timer.record(self.stage, time.time() - self.start)
+        return False
+
+
+def percentile(sorted_values, fraction):
+    """
+    nearest-rank percentile of an already sorted list
+    """
+    if not sorted_values:
+        return 0.0
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+class StageTimer:
+    """
+    keep the most recent window_size timings of each stage.
+    when not enabled, span() costs next to nothing.
+    """
+
+    def __init__(self, enabled=False, window_size=100):
+        self.enabled = enabled
+        self.window_size = window_size
+        self.timings = {}
+
+    def span(self, stage):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, stage)
+
+    def record(self, stage, elapsed):
+        timings = self.timings.get(stage)
+        if timings is None:
+            timings = deque(maxlen=self.window_size)
+            self.timings[stage] = timings
+        timings.append(elapsed)
+
+    def summary(self):
+        """
+        returns a dict of stage -> {'count', 'last', 'p50', 'p95'}, times in seconds
+        """
+        summary = {}
+        for stage, timings in self.timings.items():
+            sorted_timings = sorted(timings)
+            summary[stage] = {'count': len(sorted_timings),
+                              'last': timings[-1],
+                              'p50': percentile(sorted_timings, 0.50),
+                              'p95': percentile(sorted_timings, 0.95),
+                              }
+        return summary
+
+    def crawl_text(self, stage_count=3):
+        """
+        a one line summary of the cycle time and the slowest stages for the crawl
+        """
+        summary = self.summary()
+        cycle = summary.pop('cycle', None)
+        slowest = sorted(summary.items(), key=lambda item: item[1]['p95'], reverse=True)[:stage_count]
+        text = ', '.join('%s %.2f/%.2f' % (stage, stats['p50'], stats['p95']) for stage, stats in slowest)
+        if cycle is not None:
+            text = 'cycle %.2f/%.2f s p50/p95: %s' % (cycle['p50'], cycle['p95'], text)
+        return text
+
+    def dump(self, filename):
+        """
+        write the summary to filename as JSON
+        """
+        if not self.enabled or not self.timings:
+            return
+        try:
+            with open(filename, 'w') as f:
+                json.dump(self.summary(), f, indent=2, sort_keys=True)
+            logging.info('stage timings written to %s', filename)
+        except IOError as e:
+            logging.warn('could not write stage timings to %s: %s', filename, e)
+
+
+class CycleProfiler:
+    """
+    run each cycle under cProfile and keep the profiles of the slowest keep_count cycles
+    in directory, as <timestamp>-<milliseconds>ms.prof files for pstats or snakeviz.
+    a keep_count of 0 turns profiling off.
+    """
+
+    def __init__(self, keep_count=0, directory='profiles'):
+        self.keep_count = keep_count
+        self.directory = directory
+        self.kept = []  # heap of (elapsed, filename), fastest kept cycle first
+        if keep_count > 0 and not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def run(self, function, *args):
+        """
+        call function(*args), returns its result
+        """
+        if self.keep_count <= 0:
+            return function(*args)
+        profile = cProfile.Profile()
+        t0 = time.time()
+        try:
+            return profile.runcall(function, *args)
+        finally:
+            self.keep(profile, time.time() - t0)
+
+    def keep(self, profile, elapsed):
+        if len(self.kept) >= self.keep_count and elapsed <= self.kept[0][0]:
+            return
+        filename = os.path.join(self.directory, '%s-%dms.prof' % (time.strftime('%Y%m%d-%H%M%S', time.gmtime()),
+                                                                  int(elapsed * 1000)))
+        try:
+            profile.dump_stats(filename)
+        except IOError as e:
+            logging.warn('could not write profile %s: %s', filename, e)
+            return
+        if len(self.kept) >= self.keep_count:
+            evicted = heapq.heappushpop(self.kept, (elapsed, filename))[1]
+            try:
+                os.remove(evicted)
+            except OSError:
+                pass
+        else:
+            heapq.heappush(self.kept, (elapsed, filename))
+        logging.debug('kept profile of %.3f second cycle in %s', elapsed, filename)
+
+
+""" upper bounds in seconds of the latency histogram buckets, the last bucket is everything slower """
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600]
+
+""" the traced latency stages: name, start time key, end time key """
+LATENCY_STAGES = [('commit', 'received', 'committed'),
+                  ('notify', 'committed', 'picked_up'),
+                  ('render', 'picked_up', 'published'),
+                  ('transfer', 'published', 'delivered'),
+                  ('display', 'delivered', 'shown'),
+                  ('total', 'received', 'shown'),
+                  ]
+
+
+class LatencyHistogram:
+    """
+    count latencies into LATENCY_BUCKETS, keeping recent samples for percentiles.
+    """
+
+    def __init__(self, sample_size=1000):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.samples = deque(maxlen=sample_size)
+        self.maximum = 0.0
+
+    def add(self, latency):
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS) and latency > LATENCY_BUCKETS[bucket]:
+            bucket += 1
+        self.counts[bucket] += 1
+        self.samples.append(latency)
+        self.maximum = max(self.maximum, latency)
+
+    def summary(self):
+        sorted_samples = sorted(self.samples)
+        labels = ['<=%g' % bound for bound in LATENCY_BUCKETS] + ['>%g' % LATENCY_BUCKETS[-1]]
+        return {'count': sum(self.counts),
+                'p50': percentile(sorted_samples, 0.50),
+                'p95': percentile(sorted_samples, 0.95),
+                'max': self.maximum,
+                'buckets': dict(zip(labels, self.counts)),
+                }
+
+
+class LatencyTracker:
+    """
+    QSO-to-screen latency, measured in the display process.
+    a trace is a dict of times: 'received' and 'committed' by the collector, 'picked_up' when
+    the chart engine starts the update and 'published' when it sends each image.  the display
+    adds 'delivered' when it takes the image off the queue and 'shown' the first time any
+    page carrying the trace (or a newer version of that page) is put on the screen.
+    """
+
+    def __init__(self, pending_limit=20):
+        self.pending_limit = pending_limit
+        self.pending = {}
+        self.recent_ids = deque(maxlen=200)
+        self.histograms = {}
+        for stage, start, end in LATENCY_STAGES:
+            self.histograms[stage] = LatencyHistogram()
+
+    def delivered(self, image_index, trace):
+        trace['delivered'] = time.time()
+        traces = self.pending.setdefault(image_index, [])
+        # keep the oldest traces, they are the worst case
+        if len(traces) < self.pending_limit:
+            traces.append(trace)
+
+    def shown(self, image_index):
+        traces = self.pending.pop(image_index, None)
+        if not traces:
+            return
+        now = time.time()
+        for trace in traces:
+            if trace['id'] in self.recent_ids:
+                continue
+            self.recent_ids.append(trace['id'])
+            trace['shown'] = now
+            for stage, start, end in LATENCY_STAGES:
+                if trace.get(start) is not None and trace.get(end) is not None:
+                    self.histograms[stage].add(max(trace[end] - trace[start], 0.0))
+
+    def summary(self):
+        summary = {}
+        for stage, start, end in LATENCY_STAGES:
+            summary[stage] = self.histograms[stage].summary()
+        return summary
+
+    def report(self):
+        """
+        log the p50/p95/max of each stage
+        """
+        summary = self.summary()
+        if summary['total']['count'] == 0:
+            return
+        logging.info('QSO latency (p50/p95/max seconds): %s',
+                     ', '.join('%s %.2f/%.2f/%.2f' % (stage, summary[stage]['p50'], summary[stage]['p95'],
+                                                      summary[stage]['max'])
+                               for stage, start, end in LATENCY_STAGES))
+
+    def dump(self, filename):
+        """
+        write the histograms to filename as JSON
+        """
+        summary = self.summary()
+        if summary['total']['count'] == 0:
+            return
+        try:
+            with open(filename, 'w') as f:
+                json.dump(summary, f, indent=2, sort_keys=True)
+            logging.info('QSO latency histograms written to %s', filename)
+        except IOError as e:
+            logging.warn('could not write QSO latency histograms to %s: %s', filename, e)
+
+
+def make_trace(changes, picked_up):
+    """
+    make the latency trace for a chart update caused by change notifications,
+    using the oldest change so the worst case is measured.  returns None if the
+    changes carry no times.
+    """
+    received = [change['received'] for change in changes if change.get('received') is not None]
+    if not received:
+        return None
+    committed = [change['committed'] for change in changes if change.get('committed') is not None]
+    return {'id': picked_up,
+            'qsos': len(changes),
+            'received': min(received),
+            'committed': min(committed) if committed else None,
+            'picked_up': picked_up,
+            }
+
+
+def rss_bytes():
+    """
+    the resident set size of this process in bytes, from /proc.  None where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+class MemoryWatchdog:
+    """
+    watch the memory of a long running process.  sample() is called once per cycle;
+    the RSS and live figure count are logged every log_interval seconds along with the RSS
+    growth rate since the first sample, and sample() returns True once the RSS is over
+    limit_bytes.  a limit_bytes of None never trips.  the figure count is a function,
+    counting figures walks every Python object, so it is only called when it is logged.
+    """
+
+    def __init__(self, name, limit_bytes=None, log_interval=600):
+        self.name = name
+        self.limit_bytes = limit_bytes
+        self.log_interval = log_interval
+        self.first_sample = None
+        self.last_log_time = 0
+        self.cycles = 0
+
+    def sample(self, figure_count):
+        rss = rss_bytes()
+        if rss is None:
+            return False
+        now = time.time()
+        self.cycles += 1
+        if self.first_sample is None:
+            self.first_sample = (now, rss)
+        if self.log_interval is not None and now - self.last_log_time >= self.log_interval:
+            self.last_log_time = now
+            hours = (now - self.first_sample[0]) / 3600.0
+            growth = (rss - self.first_sample[1]) / hours if hours > 0 else 0
+            logging.info('%s memory: RSS %.1f MB (%+.1f MB/hour), %d live figures after %d cycles',
+                         self.name, rss / 1048576.0, growth / 1048576.0, figure_count(), self.cycles)
+        if self.limit_bytes is not None and rss > self.limit_bytes:
+            logging.warn('%s RSS %.1f MB is over the %.1f MB limit, %d live figures', self.name, rss / 1048576.0,
+                         self.limit_bytes / 1048576.0, figure_count())
+            return True
+        return False
@@ -0,0 +1,159 @@
+"""
+live QSO event stream for n1mm_view.
+the collector publishes every decoded contact, replace and delete as a Server-Sent Event,
+so that browsers and other programs can follow the log without polling the database.
+"""
+
+import json
+import logging
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from Queue import Queue, Empty, Full
+from SocketServer import ThreadingMixIn
+from collections import deque
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+KEEPALIVE_TIME = 15
+# seconds a write to a client may block before the client is dropped
+WRITE_TIMEOUT = 30
+
+EVENT_CONTACT = 'contact'
+EVENT_REPLACE = 'replace'
+EVENT_DELETE = 'delete'
+
+
+class Subscriber:
+    """
+    one connected client.  events are queued for it, if it falls too far behind it is dropped.
+    """
+
+    def __init__(self, queue_size):
+        self.queue = Queue(queue_size)
+        self.dropped = False
+
+
+class QsoEventStream:
+    """
+    fan out QSO events to subscribers, keeping the most recent events for late subscribers.
+    publish() never blocks the caller.
+    event ids are "run-sequence", the run is the time the stream started, so that an id
+    from an earlier run of the collector is not mistaken for one of this run.
+    """
+
+    def __init__(self, replay_size, client_queue_size):
+        self.replay_buffer = deque(maxlen=replay_size)
+        self.client_queue_size = client_queue_size
+        self.subscribers = []
+        self.run_id = int(time.time())
+        self.last_id = 0
+        self.lock = threading.Lock()
+
+    def publish(self, event_type, data):
+        with self.lock:
+            self.last_id += 1
+            event = (self.run_id, self.last_id, event_type, json.dumps(data, sort_keys=True))
+            self.replay_buffer.append(event)
+            for subscriber in self.subscribers[:]:
+                try:
+                    subscriber.queue.put_nowait(event)
+                except Full:
+                    logging.warn('QSO event subscriber is not keeping up, dropping it.')
+                    subscriber.dropped = True
+                    self.subscribers.remove(subscriber)
+
+    def sequence(self, last_event_id):
+        """
+        the sequence number of an event id of this run, 0 for anything else
+        """
+        try:
+            run_id, sequence = [int(part) for part in last_event_id.split('-')]
+        except ValueError:
+            return 0
+        return sequence if run_id == self.run_id else 0
+
+    def subscribe(self, last_event_id):
+        """
+        add a subscriber, return it with the buffered events newer than the event id last_event_id.
+        """
+        subscriber = Subscriber(self.client_queue_size)
+        sequence = self.sequence(last_event_id)
+        with self.lock:
+            backlog = [event for event in self.replay_buffer if event[1] > sequence]
+            self.subscribers.append(subscriber)
+        return subscriber, backlog
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+
+class QsoEventRequestHandler(BaseHTTPRequestHandler):
+    """
+    serve /events as a text/event-stream.
+    """
+    server_version = 'n1mm_view'
+    # a stalled client times out a write rather than holding its thread forever
+    timeout = WRITE_TIMEOUT
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/events':
+            self.send_error(404, 'Not Found')
+            return
+        last_event_id = self.headers.get('Last-Event-ID', '')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+
+        stream = self.server.event_stream
+        subscriber, backlog = stream.subscribe(last_event_id)
+        try:
+            for event in backlog:
+                self.write_event(event)
+            self.wfile.flush()
+            while not subscriber.dropped:
+                try:
+                    event = subscriber.queue.get(timeout=KEEPALIVE_TIME)
+                    self.write_event(event)
+                except Empty:
+                    self.wfile.write(': keepalive\n\n')
+                self.wfile.flush()
+        except IOError:
+            logging.debug('QSO event subscriber %s disconnected', self.address_string())
+        finally:
+            stream.unsubscribe(subscriber)
+
+    def write_event(self, event):
+        self.wfile.write('id: %d-%d\nevent: %s\ndata: %s\n\n' % event)
+
+    def log_message(self, format, *args):
+        logging.debug('sse: %s %s' % (self.address_string(), format % args))
+
+
+class QsoEventServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port, event_stream):
+        HTTPServer.__init__(self, ('', port), QsoEventRequestHandler)
+        self.event_stream = event_stream
+
+
+def start_event_server(port, replay_size, client_queue_size):
+    """
+    start the event stream server on a background thread, return the stream to publish to.
+    """
+    event_stream = QsoEventStream(replay_size, client_queue_size)
+    server = QsoEventServer(port, event_stream)
+    thread = threading.Thread(name='qso-event-server', target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    logging.info('QSO event stream listening on port %d', port)
+    return event_stream
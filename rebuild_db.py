@@ -18,10 +18,22 @@ USAGE:
 2. Rename your existing DATABASE_FILENAME file.  This file is usually called
    n1mm_view.db  
 
-3. Run the rebuild_db.py program.
+3. Run the rebuild_db.py program.  By default the rebuild is done in bulk, in one
+   transaction.  Use --per-row for the original one commit per QSO rebuild.
 
 4. Restart the collector.py program.
 
+SYNC MODE:
+
+   rebuild_db.py --sync keeps the live n1mm_view database in step with the N1MM+
+   database, as a backup for lost UDP broadcasts.  There is no need to rename the
+   database or restart the collector.  Every SYNC_INTERVAL seconds the DXLOG rows added
+   since the last poll are upserted into qso_log.  Every SYNC_RECONCILE_INTERVAL seconds
+   both logs are split into SYNC_BUCKET_MINUTES time buckets, the buckets are compared
+   by row count and content hash, and the buckets that differ are copied from N1MM+,
+   which picks up edits and deletes.  The dashboard is notified of the changes, and
+   the WAL is checkpointed, just as the collector does.
+
 NOTE: the sqlite3 dll that ships with windows python won't read the N1MM+ log file.
 You must get the latest sqlite3 dll from https://www.sqlite.org/download.html and
 replace the version in your python dlls folder.  I've not tried this on Linux.
@@ -31,13 +43,18 @@ installation (32- or. 64-bit.)
 Based on replayer.py and collector.py programs written by Jeffrey B. Otterson, N1KDO.
 """
 
+import argparse
 import calendar
 import logging
 import sqlite3
 import time
+from hashlib import md5
 
+import n1mm_view_db
 from n1mm_view_constants import *
 from n1mm_view_config import *
+from n1mm_view_db import Operators, Stations, create_tables, create_qso_log_indexes, drop_qso_log_indexes
+from n1mm_view_notify import ChangePublisher, CHANGE_NEW, CHANGE_REPLACE, CHANGE_DELETE
 
 __author__ = 'Sheldon Hartling, VE1GPY'
 __copyright__ = 'Copyright 2016 Sheldon Hartling'
@@ -48,92 +65,16 @@ logging.basicConfig(format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s'
                     level=LOG_LEVEL)
 logging.Formatter.converter = time.gmtime
 
+""" number of rows read from the N1MM+ database at a time by the bulk rebuild """
+BULK_FETCH_SIZE = 1000
+""" log progress of the bulk rebuild every this many rows """
+BULK_PROGRESS_INTERVAL = 10000
 
-class Operators:
-    operators = {}
-    db = None
-    cursor = None
-
-    def __init__(self, db, cursor):
-        self.db = db
-        self.cursor = cursor
-        # load operators
-        self.cursor.execute('SELECT id, name FROM operator;')
-        for row in self.cursor:
-            self.operators[row[1]] = row[0]
-
-    def lookup_operator_id(self, operator):
-        """
-        lookup the operator id for the supplied operator text.
-        if the operator is not found, create it.
-        """
-        oid = self.operators.get(operator)
-        if oid is None:
-            self.cursor.execute("insert into operator (name) values (?);", (operator,))
-            self.db.commit()
-            oid = self.cursor.lastrowid
-            self.operators[operator] = oid
-        return oid
-
-
-class Stations:
-    stations = {}
-    db = None
-    cursor = None
-
-    def __init__(self, db, cursor):
-        self.db = db
-        self.cursor = cursor
-        self.cursor.execute('SELECT id, name FROM station;')
-        for row in self.cursor:
-            self.stations[row[1]] = row[0]
-
-    def lookup_station_id(self, station):
-        sid = self.stations.get(station)
-        if sid is None:
-            self.cursor.execute("insert into station (name) values (?);", (station,))
-            self.db.commit()
-            sid = self.cursor.lastrowid
-            self.stations[station] = sid
-        return sid
-
-
-def create_tables(db, cursor):
-    """
-    set up the n1mm_view database tables
-    """
-    cursor.execute('CREATE TABLE IF NOT EXISTS operator\n'
-                   '    (id INTEGER PRIMARY KEY NOT NULL, \n'
-                   '    name char(12) NOT NULL);')
-    cursor.execute('CREATE INDEX IF NOT EXISTS operator_name ON operator(name);')
-
-    cursor.execute('CREATE TABLE IF NOT EXISTS station\n'
-                   '    (id INTEGER PRIMARY KEY NOT NULL, \n'
-                   '    name char(12) NOT NULL);')
-    cursor.execute('CREATE INDEX IF NOT EXISTS station_name ON station(name);')
-
-    cursor.execute('CREATE TABLE IF NOT EXISTS qso_log\n'
-                   #'    (id INTEGER PRIMARY KEY NOT NULL,\n'
-                   '     (timestamp INTEGER NOT NULL,\n'
-                   '     mycall char(12) NOT NULL,\n'
-                   '     band_id INTEGER NOT NULL,\n'
-                   '     mode_id INTEGER NOT NULL,\n'
-                   '     operator_id INTEGER NOT NULL,\n'
-                   '     station_id INTEGER NOT NULL,\n'
-                   '     rx_freq INTEGER NOT NULL,\n'
-                   '     tx_freq INTEGER NOT NULL,\n'
-                   '     callsign char(12) NOT NULL,\n'
-                   '     rst_sent char(3),\n'
-                   '     rst_recv char(3),\n'
-                   '     exchange char(4),\n'
-                   '     section char(4),\n'
-                   '     comment TEXT);')
-    cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_band_id ON qso_log(band_id);')
-    cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_mode_id ON qso_log(mode_id);')
-    cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_operator_id ON qso_log(operator_id);')
-    cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_station_id ON qso_log(station_id);')
-    cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_section ON qso_log(section);')
-    db.commit()
+N1MM_COLUMNS = 'TS, StationPrefix, band, Mode, Operator, NetBiosName, Freq, QSXFreq, Call, \n' \
+               'SNT, RCV, Exchange1, Sect, Comment \n'
+N1MM_QUERY = 'SELECT ' + N1MM_COLUMNS + 'FROM DXLOG WHERE ContestName=\'FD\' order by TS;'
+N1MM_NEW_ROWS_QUERY = 'SELECT rowid, ' + N1MM_COLUMNS + 'FROM DXLOG WHERE ContestName=\'FD\' AND rowid > ? order by rowid;'
+N1MM_RANGE_QUERY = 'SELECT ' + N1MM_COLUMNS + 'FROM DXLOG WHERE ContestName=\'FD\' AND TS >= ? AND TS < ? order by TS;'
 
 
 def convert_timestamp(s):
@@ -152,7 +93,7 @@ def convert_band(band):
         return '%d' % band
 
 
-def record_contact(db, cursor, operators, stations,
+def record_contact(db, cursor, operators, stations, event_id,
                    timestamp, mycall, band, mode, operator, station,
                    rx_freq, tx_freq, callsign, rst_sent, rst_recv,
                    exchange, section, comment):
@@ -171,41 +112,41 @@ def record_contact(db, cursor, operators, stations,
         station, rx_freq, tx_freq, callsign, rst_sent,
         rst_recv, exchange, section, comment))
 
-    cursor.execute(
-        'insert into qso_log \n'
-        '    (timestamp, mycall, band_id, mode_id, operator_id, station_id , rx_freq, tx_freq, \n'
-        '     callsign, rst_sent, rst_recv, exchange, section, comment)\n'
-        '    values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
-        (calendar.timegm(timestamp), mycall, band_id, mode_id, operator_id, station_id, rx_freq, tx_freq,
-         callsign, rst_sent, rst_recv, exchange, section, comment))
+    n1mm_view_db.insert_qso(cursor, (calendar.timegm(timestamp), mycall, band_id, mode_id, operator_id, station_id,
+                                     rx_freq, tx_freq, callsign, rst_sent, rst_recv, exchange, section, comment,
+                                     event_id))
 
     db.commit()
 
 
-def main():
-    logging.info('Database rebuild started...')
-    
-    # Open the actual N1MM+ contest database, (we're just looking).
+def qso_log_values(row, operators, stations, event_id):
+    """
+    convert a DXLOG row, with the N1MM_COLUMNS columns, into qso_log values for the event event_id
+    """
+    return (calendar.timegm(convert_timestamp(row[0])), row[1], Bands.get_band_number(convert_band(row[2])),
+            Modes.get_mode_number(row[3]), operators.lookup_operator_id(row[4]),
+            stations.lookup_station_id(row[5]), row[6] * 100, row[7] * 100,
+            row[8], row[9], row[10], row[11], row[12], row[13], event_id)
 
-    n1mm_db = sqlite3.connect(N1MM_LOG_FILE_NAME)
-    n1mm_cursor = n1mm_db.cursor()
-    
-    # Create n1mm_view database.
 
-    view_db = sqlite3.connect(DATABASE_FILENAME)
+def rebuild(n1mm_db, view_db):
+    """
+    rebuild the n1mm_view database one QSO at a time, committing each QSO.
+    returns the number of QSOs added.
+    """
+    n1mm_cursor = n1mm_db.cursor()
     view_cursor = view_db.cursor()
     create_tables(view_db, view_cursor)
-    
+
     # Instantiate 'operators' and 'stations' objects
     operators = Operators(view_db, view_cursor)
     stations = Stations(view_db, view_cursor)
+    event_id = n1mm_view_db.active_event_id(view_db, view_cursor)
 
     # Rebuild the n1mm_view database from the N1MM+ database.
 
     # Read all of the "FD" contest entries in the DXLOG table.
-    n1mm_cursor.execute('SELECT TS, StationPrefix, band, Mode, Operator, NetBiosName, Freq, QSXFreq, Call, \n'
-                        'SNT, RCV, Exchange1, Sect, Comment \n'
-                        'FROM DXLOG WHERE ContestName=\'FD\' order by TS;')
+    n1mm_cursor.execute(N1MM_QUERY)
     qso_number = 0
     for row in n1mm_cursor:
         timestamp = convert_timestamp(row[0])
@@ -223,17 +164,266 @@ def main():
         section = row[12]
         comment = row[13]
 
-        record_contact(view_db, view_cursor, operators, stations,
+        record_contact(view_db, view_cursor, operators, stations, event_id,
                        timestamp, mycall, band, mode, operator, station,
                        rx_freq, tx_freq, callsign, rst_sent, rst_recv,
                        exchange, section, comment)
         qso_number += 1
+    return qso_number
+
+
+def bulk_rebuild(n1mm_db, view_db):
+    """
+    rebuild the n1mm_view database in a single transaction.
+    rows are streamed from the N1MM+ database and inserted with executemany, the bulk_rebuild
+    pragma profile is used for the duration of the load, and the qso_log indexes are built after the load.
+    returns the number of QSOs added.
+    """
+    n1mm_cursor = n1mm_db.cursor()
+    n1mm_view_db.apply_profile(view_db, n1mm_view_db.BULK_REBUILD)
+    view_cursor = view_db.cursor()
+    create_tables(view_db, view_cursor, indexes=False)
+    drop_qso_log_indexes(view_cursor)
+
+    # operator and station lookups insert new names while qso_log is being inserted, so they need their own cursor.
+    lookup_cursor = view_db.cursor()
+    operators = Operators(view_db, lookup_cursor, auto_commit=False)
+    stations = Stations(view_db, lookup_cursor, auto_commit=False)
+    event_id = n1mm_view_db.active_event_id(view_db, lookup_cursor)
+    counter = {'rows': 0}
+
+    def qsos():
+        while True:
+            rows = n1mm_cursor.fetchmany(BULK_FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield qso_log_values(row, operators, stations, event_id)
+            counter['rows'] += len(rows)
+            if counter['rows'] % BULK_PROGRESS_INTERVAL < BULK_FETCH_SIZE:
+                logging.info('%d QSOs loaded...', counter['rows'])
+
+    n1mm_cursor.execute(N1MM_QUERY)
+    n1mm_view_db.insert_qsos(view_cursor, qsos())
+    logging.info('building indexes...')
+    create_qso_log_indexes(view_cursor)
+    view_db.commit()
+
+    # ready for the collector
+    n1mm_view_db.apply_profile(view_db, n1mm_view_db.INGEST)
+    return counter['rows']
+
+
+def n1mm_compare_row(row):
+    """
+    the compared fields of a DXLOG row, with the N1MM_COLUMNS columns
+    """
+    return (calendar.timegm(convert_timestamp(row[0])), row[8], Bands.get_band_number(convert_band(row[2])),
+            Modes.get_mode_number(row[3]), row[4], row[5], row[12], row[11])
+
+
+def row_hash(row):
+    """
+    hash a compared row into a 64 bit integer
+    """
+    text = u'|'.join(u'%s' % field for field in row)
+    return int(md5(text.encode('utf-8')).hexdigest()[:16], 16)
+
+
+def bucket_hashes(rows, bucket_seconds):
+    """
+    partition compared rows into time buckets.
+    returns a dict of bucket start time -> (row count, order-independent hash of the rows)
+    """
+    buckets = {}
+    for row in rows:
+        bucket = row[0] // bucket_seconds * bucket_seconds
+        count, hash_sum = buckets.get(bucket, (0, 0))
+        buckets[bucket] = (count + 1, (hash_sum + row_hash(row)) & 0xffffffffffffffff)
+    return buckets
+
+
+def n1mm_compare_rows(n1mm_cursor, start_time=0, end_time=None):
+    """
+    the compared rows of the N1MM+ log between start_time and end_time
+    """
+    if end_time is None:
+        n1mm_cursor.execute(N1MM_QUERY)
+    else:
+        n1mm_cursor.execute(N1MM_RANGE_QUERY, (time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start_time)),
+                                               time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(end_time))))
+    return [n1mm_compare_row(row) for row in n1mm_cursor.fetchall()]
+
+
+def view_compare_rows(view_cursor, event_id, start_time=0, end_time=None):
+    """
+    the compared rows of the event's QSOs in the n1mm_view qso_log between start_time and end_time
+    """
+    if end_time is None:
+        end_time = 2 ** 62
+    return n1mm_view_db.compare_rows(view_cursor, event_id, start_time, end_time)
+
+
+def different_buckets(n1mm_cursor, view_cursor, event_id, bucket_seconds):
+    """
+    compare the N1MM+ log with the event's QSOs bucket by bucket, return the sorted start times
+    of the buckets that differ
+    """
+    n1mm_buckets = bucket_hashes(n1mm_compare_rows(n1mm_cursor), bucket_seconds)
+    view_buckets = bucket_hashes(view_compare_rows(view_cursor, event_id), bucket_seconds)
+    return sorted(bucket for bucket in set(n1mm_buckets.keys()) | set(view_buckets.keys())
+                  if n1mm_buckets.get(bucket) != view_buckets.get(bucket))
+
+
+def sync_new_rows(n1mm_cursor, view_cursor, operators, stations, event_id, high_water_mark):
+    """
+    upsert the DXLOG rows added since high_water_mark.
+    returns the timestamps of the rows upserted and the new high water mark
+    """
+    n1mm_cursor.execute(N1MM_NEW_ROWS_QUERY, (high_water_mark,))
+    timestamps = []
+    for row in n1mm_cursor.fetchall():
+        values = qso_log_values(row[1:], operators, stations, event_id)
+        n1mm_view_db.upsert_qso(view_cursor, values)
+        high_water_mark = max(high_water_mark, row[0])
+        timestamps.append(values[0])
+    return timestamps, high_water_mark
+
+
+def sync_buckets(n1mm_cursor, view_cursor, operators, stations, event_id, buckets, bucket_seconds):
+    """
+    make the event's QSOs match the N1MM+ log in each bucket, which picks up edits and deletes.
+    returns the timestamps of the QSOs inserted and of the QSOs deleted
+    """
+    inserted = []
+    deleted = []
+    for bucket in buckets:
+        n1mm_cursor.execute(N1MM_RANGE_QUERY, (time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(bucket)),
+                                               time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(bucket + bucket_seconds))))
+        rows = [qso_log_values(row, operators, stations, event_id) for row in n1mm_cursor.fetchall()]
+        deleted.extend(row[0] for row in view_compare_rows(view_cursor, event_id, bucket, bucket + bucket_seconds))
+        n1mm_view_db.delete_qsos_between(view_cursor, event_id, bucket, bucket + bucket_seconds)
+        n1mm_view_db.insert_qsos(view_cursor, rows)
+        inserted.extend(row[0] for row in rows)
+        logging.info('sync: replaced %d QSOs in bucket starting %s', len(rows),
+                     time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(bucket)))
+    return inserted, deleted
+
+
+def publish_changes(publisher, change, timestamps):
+    """
+    notify the dashboard of the QSOs changed by a sync, if it is listening
+    """
+    if publisher is not None and timestamps:
+        publisher.publish_timestamps(change, timestamps, DATABASE_CHUNK_MINUTES * 60)
+
+
+def sync(n1mm_db, view_db, interval, reconcile_interval, bucket_seconds, publisher=None):
+    """
+    keep the n1mm_view database in step with a live N1MM+ database.
+    new DXLOG rows are upserted every interval seconds, and every reconcile_interval seconds
+    the two logs are compared bucket by bucket to pick up edits and deletes.
+    if publisher is set, a change notification is published after each commit.
+    a poll that fails on a locked database is rolled back and done again next time.
+    runs until interrupted.
+    """
+    n1mm_cursor = n1mm_db.cursor()
+    # we're just looking.
+    n1mm_cursor.execute('PRAGMA query_only = ON;')
+    view_cursor = view_db.cursor()
+    create_tables(view_db, view_cursor)
+    operators = Operators(view_db, view_cursor)
+    stations = Stations(view_db, view_cursor)
+    event_id = n1mm_view_db.active_event_id(view_db, view_cursor)
+
+    high_water_mark = 0
+    last_reconcile = 0
+    last_checkpoint_time = time.time()
+    try:
+        while True:
+            try:
+                if time.time() - last_reconcile >= reconcile_interval:
+                    # reconciling also brings in every row present now, new rows only need to be read after it.
+                    n1mm_cursor.execute('SELECT MAX(rowid) FROM DXLOG;')
+                    max_rowid = n1mm_cursor.fetchone()[0] or 0
+                    buckets = different_buckets(n1mm_cursor, view_cursor, event_id, bucket_seconds)
+                    inserted, deleted = sync_buckets(n1mm_cursor, view_cursor, operators, stations, event_id,
+                                                     buckets, bucket_seconds)
+                    view_db.commit()
+                    publish_changes(publisher, CHANGE_DELETE, deleted)
+                    publish_changes(publisher, CHANGE_REPLACE, inserted)
+                    high_water_mark = max(high_water_mark, max_rowid)
+                    last_reconcile = time.time()
+                    logging.info('sync: reconciled, %d buckets differed', len(buckets))
+                else:
+                    timestamps, new_high_water_mark = sync_new_rows(n1mm_cursor, view_cursor, operators, stations,
+                                                                    event_id, high_water_mark)
+                    view_db.commit()
+                    high_water_mark = new_high_water_mark
+                    publish_changes(publisher, CHANGE_NEW, timestamps)
+                    if timestamps:
+                        logging.info('sync: %d new QSOs', len(timestamps))
+                # the ingest profile leaves checkpoints to the writer,
+                # which is this program when the collector is down
+                if DATABASE_WAL and time.time() - last_checkpoint_time >= WAL_CHECKPOINT_INTERVAL:
+                    n1mm_view_db.checkpoint(view_db)
+                    last_checkpoint_time = time.time()
+            except sqlite3.OperationalError as e:
+                # the collector or N1MM+ held a lock too long, this poll is done again next time
+                view_db.rollback()
+                logging.warn('sync: %s, trying again in %s seconds', e, interval)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        logging.info('Keyboard interrupt, shutting down...')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rebuild the n1mm_view database from an N1MM+ database.')
+    parser.add_argument('--per-row', action='store_true',
+                        help='use the original, slow, one commit per QSO rebuild instead of the bulk rebuild')
+    parser.add_argument('--sync', action='store_true',
+                        help='keep the live n1mm_view database in step with the N1MM+ database until interrupted')
+    args = parser.parse_args()
+
+    if args.sync:
+        logging.info('Database sync started...')
+        n1mm_db = sqlite3.connect(N1MM_LOG_FILE_NAME)
+        view_db = n1mm_view_db.connect(DATABASE_FILENAME, n1mm_view_db.INGEST)
+        publisher = None
+        if CHANGE_NOTIFY_PORT is not None:
+            publisher = ChangePublisher(CHANGE_NOTIFY_PORT)
+        sync(n1mm_db, view_db, SYNC_INTERVAL, SYNC_RECONCILE_INTERVAL, SYNC_BUCKET_MINUTES * 60, publisher)
+        if publisher is not None:
+            publisher.close()
+        n1mm_db.close()
+        view_db.close()
+        n1mm_view_db.log_timings()
+        logging.info('Database sync finished...')
+        return
+
+    logging.info('Database rebuild started...')
+    
+    # Open the actual N1MM+ contest database, (we're just looking).
+
+    n1mm_db = sqlite3.connect(N1MM_LOG_FILE_NAME)
+    
+    # Create n1mm_view database.
+
+    view_db = n1mm_view_db.connect(DATABASE_FILENAME, n1mm_view_db.INGEST)
+
+    t0 = time.time()
+    if args.per_row:
+        qso_number = rebuild(n1mm_db, view_db)
+    else:
+        qso_number = bulk_rebuild(n1mm_db, view_db)
+    elapsed = time.time() - t0
 
     # Close databases and exit. 
     n1mm_db.close()
     view_db.close()
 
-    logging.info("Database rebuild finished... %d QSOs added." % qso_number)
+    logging.info("Database rebuild finished... %d QSOs added in %.1f seconds, %.0f QSOs/second." % (
+        qso_number, elapsed, qso_number / elapsed if elapsed else 0))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,174 @@
+#!/usr/bin/python
+"""
+n1mm_view reconcile
+This program compares the n1mm_view database with the authoritative N1MM+ contest database,
+and reports the QSOs that are missing from n1mm_view, the extra QSOs n1mm_view has that N1MM+
+does not, and the QSOs that are in both but differ.  It can also repair the n1mm_view database.
+
+Both logs are partitioned into time buckets, and each bucket is summarized by its row count
+and an order-independent hash of its rows.  Only the buckets that differ are read QSO by QSO,
+so this is quick enough to run during the event.
+
+USAGE:
+
+    python reconcile.py [--bucket-minutes 60] [--repair]
+
+The exit status is 0 if the logs match, 1 if they differ.
+
+NOTE: see rebuild_db.py about the sqlite3 dll needed to read the N1MM+ log file on Windows.
+"""
+
+import argparse
+import logging
+import sqlite3
+import sys
+import time
+
+import n1mm_view_db
+import rebuild_db
+from n1mm_view_notify import ChangePublisher, CHANGE_NEW, CHANGE_REPLACE, CHANGE_DELETE
+from n1mm_view_constants import *
+from n1mm_view_config import *
+
+__author__ = 'Sheldon Hartling, VE1GPY'
+__copyright__ = 'Copyright 2016 Sheldon Hartling'
+__license__ = 'Simplified BSD'
+
+
+logging.basicConfig(format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s', datefmt='%Y-%m-%d %H:%M:%S',
+                    level=LOG_LEVEL)
+logging.Formatter.converter = time.gmtime
+
+def format_qso(row):
+    """
+    format a compared row for display
+    """
+    return '%s %-10s %4s %-5s op %-8s stn %-12s %-4s %s' % (
+        time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(row[0])), row[1], Bands.BANDS_TITLE[row[2] or 0],
+        Modes.MODES_LIST[row[3] or 0], row[4], row[5], row[6], row[7])
+
+
+def compare_bucket(n1mm_cursor, view_cursor, event_id, bucket, bucket_seconds):
+    """
+    compare one bucket of the N1MM+ log with the event's QSOs, QSO by QSO.
+    QSOs are matched on timestamp and call.
+    returns lists of missing (n1mm row, compared row), extra (rowid, compared row)
+    and mismatched (n1mm row, compared n1mm row, rowid, compared view row)
+    """
+    n1mm_cursor.execute(rebuild_db.N1MM_RANGE_QUERY,
+                        (time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(bucket)),
+                         time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(bucket + bucket_seconds))))
+    n1mm_rows = {}
+    for row in n1mm_cursor.fetchall():
+        compare_row = rebuild_db.n1mm_compare_row(row)
+        n1mm_rows.setdefault(compare_row[0:2], []).append((row, compare_row))
+
+    view_rows = {}
+    for row in n1mm_view_db.compare_rows_with_rowid(view_cursor, event_id, bucket, bucket + bucket_seconds):
+        compare_row = tuple(row[1:])
+        view_rows.setdefault(compare_row[0:2], []).append((row[0], compare_row))
+
+    missing = []
+    extra = []
+    mismatched = []
+    for key in sorted(set(n1mm_rows.keys()) | set(view_rows.keys())):
+        n1mm_qsos = n1mm_rows.get(key, [])
+        view_qsos = view_rows.get(key, [])
+        # exact matches first, then pair up what is left as mismatches
+        unmatched_view = []
+        for rowid, view_row in view_qsos:
+            for i in range(0, len(n1mm_qsos)):
+                if n1mm_qsos[i][1] == view_row:
+                    del n1mm_qsos[i]
+                    break
+            else:
+                unmatched_view.append((rowid, view_row))
+        while n1mm_qsos and unmatched_view:
+            n1mm_row, n1mm_compare = n1mm_qsos.pop(0)
+            rowid, view_row = unmatched_view.pop(0)
+            mismatched.append((n1mm_row, n1mm_compare, rowid, view_row))
+        missing.extend(n1mm_qsos)
+        extra.extend(unmatched_view)
+    return missing, extra, mismatched
+
+
+def repair(view_db, view_cursor, event_id, missing, extra, mismatched, publisher=None):
+    """
+    make the event's QSOs in the n1mm_view database agree with N1MM+.
+    if publisher is set, the dashboard is notified of the repaired QSOs after the commit.
+    """
+    operators = n1mm_view_db.Operators(view_db, view_cursor)
+    stations = n1mm_view_db.Stations(view_db, view_cursor)
+    for rowid, view_row in extra:
+        n1mm_view_db.delete_qso_by_rowid(view_cursor, rowid)
+    for n1mm_row, n1mm_compare, rowid, view_row in mismatched:
+        n1mm_view_db.delete_qso_by_rowid(view_cursor, rowid)
+        n1mm_view_db.insert_qso(view_cursor, rebuild_db.qso_log_values(n1mm_row, operators, stations, event_id))
+    for n1mm_row, n1mm_compare in missing:
+        n1mm_view_db.insert_qso(view_cursor, rebuild_db.qso_log_values(n1mm_row, operators, stations, event_id))
+    view_db.commit()
+    rebuild_db.publish_changes(publisher, CHANGE_DELETE, [view_row[0] for rowid, view_row in extra])
+    rebuild_db.publish_changes(publisher, CHANGE_REPLACE,
+                               [row[0] for n1mm_row, n1mm_compare, rowid, view_row in mismatched
+                                for row in (n1mm_compare, view_row)])
+    rebuild_db.publish_changes(publisher, CHANGE_NEW, [n1mm_compare[0] for n1mm_row, n1mm_compare in missing])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='compare the n1mm_view database with the N1MM+ database.')
+    parser.add_argument('--bucket-minutes', type=int, default=SYNC_BUCKET_MINUTES,
+                        help='size of the compared time buckets, default %d' % SYNC_BUCKET_MINUTES)
+    parser.add_argument('--repair', action='store_true', help='fix the n1mm_view database to match N1MM+')
+    args = parser.parse_args()
+    bucket_seconds = args.bucket_minutes * 60
+
+    logging.info('Reconcile started...')
+    t0 = time.time()
+    n1mm_db = sqlite3.connect(N1MM_LOG_FILE_NAME)
+    n1mm_cursor = n1mm_db.cursor()
+    # we're just looking.
+    n1mm_cursor.execute('PRAGMA query_only = ON;')
+    view_db = n1mm_view_db.connect(DATABASE_FILENAME, n1mm_view_db.INGEST)
+    view_cursor = view_db.cursor()
+    n1mm_view_db.create_tables(view_db, view_cursor)
+    event_id = n1mm_view_db.active_event_id(view_db, view_cursor)
+
+    buckets = rebuild_db.different_buckets(n1mm_cursor, view_cursor, event_id, bucket_seconds)
+    logging.info('%d buckets differ', len(buckets))
+
+    missing = []
+    extra = []
+    mismatched = []
+    for bucket in buckets:
+        bucket_missing, bucket_extra, bucket_mismatched = compare_bucket(n1mm_cursor, view_cursor,
+                                                                         event_id, bucket, bucket_seconds)
+        missing.extend(bucket_missing)
+        extra.extend(bucket_extra)
+        mismatched.extend(bucket_mismatched)
+
+    for n1mm_row, n1mm_compare in missing:
+        logging.info('MISSING:  %s', format_qso(n1mm_compare))
+    for rowid, view_row in extra:
+        logging.info('EXTRA:    %s', format_qso(view_row))
+    for n1mm_row, n1mm_compare, rowid, view_row in mismatched:
+        logging.info('MISMATCH: %s', format_qso(n1mm_compare))
+        logging.info('    view: %s', format_qso(view_row))
+
+    if args.repair and (missing or extra or mismatched):
+        publisher = None
+        if CHANGE_NOTIFY_PORT is not None:
+            publisher = ChangePublisher(CHANGE_NOTIFY_PORT)
+        repair(view_db, view_cursor, event_id, missing, extra, mismatched, publisher)
+        if publisher is not None:
+            publisher.close()
+        logging.info('Repaired.')
+
+    n1mm_db.close()
+    view_db.close()
+    logging.info('Reconcile finished in %.2f seconds... %d missing, %d extra, %d mismatched.',
+                 time.time() - t0, len(missing), len(extra), len(mismatched))
+    sys.exit(1 if missing or extra or mismatched else 0)
+
+
+if __name__ == '__main__':
+    main()
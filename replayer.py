@@ -3,6 +3,22 @@
 n1mm_view log replayer
 this program replays old N1MM+ log files as udp broadcasts for testing n1mm_view.
 
+USAGE:
+
+    python replayer.py [--mode random|speed|rate|max] [--speed 60] [--rate 100]
+                       [--address 127.0.0.1] [--port 12060] [--seed 1] [--synthetic QSO_COUNT]
+                       [--simulate [--duplicates 0.1] [--edits 0.02] [--radio-info 5]]
+
+random mode is the original behavior, a random delay between QSOs.  speed mode keeps the
+spacing of the QSOs in the log, compressed by the speed factor.  rate mode sends a fixed
+number of messages per second, max mode sends as fast as possible.  When it is done, the
+achieved send rate is reported along with the number of QSOs the collector stored.
+
+With --simulate, the log is split by station (NetBiosName) and each station is replayed
+concurrently from its own thread and socket, as a networked Field Day would.  Each station
+also rebroadcasts some contacts (--duplicates), later replaces or deletes some contacts
+(--edits) and sends RadioInfo messages between contacts (--radio-info).
+
 NOTE: the sqlite3 dll that ships with windows python won't read the N1MM+ log file.
 You must get the latest sqlite3 dll from https://www.sqlite.org/download.html and
 replace the version in your python dlls folder.  I've not tried this on Linux.
@@ -10,69 +26,35 @@ Make sure your download the version for the same architecture as your python
 installation (32- vs. 64-bit.)
 """
 
+import argparse
+import calendar
 import logging
+import os
 import random
 import sqlite3
+import threading
 import time
-from socket import socket, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_BROADCAST, SO_REUSEADDR
+from socket import socket, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_BROADCAST
+from xml.dom.minidom import parseString
 
+import n1mm_view_db
+import synthetic_log
 from n1mm_view_config import *
+from n1mm_view_messages import TEMPLATE, RADIO_INFO_TEMPLATE
 
 __author__ = 'Jeffrey B. Otterson, N1KDO'
 __copyright__ = 'Copyright 2016 Jeffrey B. Otterson'
 __license__ = 'Simplified BSD'
 
 BROADCAST_BUF_SIZE = 2048
+PROGRESS_INTERVAL = 1000
+""" seconds to wait for the collector before counting stored QSOs """
+REPORT_DELAY = 5
 
 logging.basicConfig(format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s', datefmt='%Y-%m-%d %H:%M:%S',
-                    level=logging.DEBUG)
+                    level=LOG_LEVEL)
 logging.Formatter.converter = time.gmtime
 
-""" this is what the N1MM+ broadcast looks like. """
-TEMPLATE = '''<?xml version="1.0"?>
-    <contactinfo>
-            <contestname>FD</contestname>
-            <contestnr>1</contestnr>
-            <timestamp>%s</timestamp>
-            <mycall>N4N</mycall>
-            <band>%s</band>
-            <rxfreq>%d</rxfreq>
-            <txfreq>%d</txfreq>
-            <operator>%s</operator>
-            <mode>%s</mode>
-            <call>%s</call>
-            <countryprefix>%s</countryprefix>
-            <wpxprefix>%s</wpxprefix>
-            <stationprefix>%s</stationprefix>
-            <continent>%s</continent>
-            <snt>%s</snt>
-            <sntnr>%s</sntnr>
-            <rcv>%s</rcv>
-            <rcvnr>%s</rcvnr>
-            <gridsquare>%s</gridsquare>
-            <exchange1>%s</exchange1>
-            <section>%s</section>
-            <comment></comment>
-            <qth></qth>
-            <name></name>
-            <power></power>
-            <misctext></misctext>
-            <zone>%d</zone>
-            <prec></prec>
-            <ck>0</ck>
-            <ismultiplier1>0</ismultiplier1>
-            <ismultiplier2>0</ismultiplier2>
-            <ismultiplier3>0</ismultiplier3>
-            <points>%d</points>
-            <radionr>1</radionr>
-            <RoverLocation></RoverLocation>
-            <RadioInterfaced>0</RadioInterfaced>
-            <NetworkedCompNr>0</NetworkedCompNr>
-            <IsOriginal>True</IsOriginal>
-            <NetBiosName>%s</NetBiosName>
-            <IsRunQSO>0</IsRunQSO>
-    </contactinfo>'''
-
 
 def convert_band(band):
     if band == 1.8:
@@ -83,31 +65,18 @@ def convert_band(band):
         return '%d' % band
 
 
-# mainline
-def main():
+def load_payloads(log_file_name):
     """
-    re-play last years logs as UDP broadcasts to load test the collector process
+    read the N1MM+ log and pre-render every broadcast.
+    returns a list of (timestamp, station, payload) tuples in timestamp order.
     """
-    logging.info('replayer started...')
-
-    db = sqlite3.connect(N1MM_LOG_FILE_NAME)
+    db = sqlite3.connect(log_file_name)
     cursor = db.cursor()
-
-    s = socket(AF_INET, SOCK_DGRAM)
-    s.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
-    s.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-
-    try:
-        s.bind(('', N1MM_BROADCAST_PORT))
-    except:
-        logging.exception('Error connecting to the UDP stream.')
-        return
-
     cursor.execute('SELECT TS, band, Freq, QSXFreq, Operator, Mode, Call, CountryPrefix, WPXPrefix, \n'
                    'StationPrefix, Continent,  SNT, SentNr, RCV, NR, GridSquare, Exchange1, Sect, ZN, Points, \n'
                    'NetBiosName \n'
                    'FROM DXLOG order by TS;')
-    qso_number = 0
+    payloads = []
     for row in cursor:
         ts = row[0]
         band = convert_band(row[1])
@@ -115,18 +84,248 @@ def main():
         tx_freq = row[3] * 100
         values = (ts, band, rx_freq, tx_freq, row[4], row[5], row[6], row[7],
                   row[8], row[9], row[10], row[11], row[12], row[13], row[14], row[15],
-                  row[16], row[17], row[18], row[19], row[20])
-        payload = TEMPLATE % values
+                  row[16], row[17], row[18], row[19], row[20], row[20])
+        payloads.append((convert_timestamp(ts), row[20], TEMPLATE % values))
+    db.close()
+    return payloads
 
-        s.sendto(payload, (N1MM_BROADCAST_ADDRESS, N1MM_BROADCAST_PORT))
-        qso_number += 1
-        logging.info("sent qso # %d timestamp %s" % (qso_number, ts))
-        # there are ~4000 qsos in the database.
-        # 4/sec will take ~1000 sec --> 17 minutes to play back -- the entire contest.
-        # random.random returns a number from 0 to 1, so this will average about 2/sec.
-        time.sleep(random.random()/10.0)
 
-    db.close()
+def load_synthetic_payloads(qso_count, seed):
+    """
+    pre-render broadcasts for a synthetic log.
+    returns a list of (timestamp, station, payload) tuples in timestamp order.
+    """
+    return [(convert_timestamp(qso['timestamp']), qso['station'], synthetic_log.contact_payload(qso))
+            for qso in synthetic_log.SyntheticLog(qso_count, seed=seed).qsos()]
+
+
+def convert_timestamp(s):
+    """
+    convert the N1MM+ timestamp into seconds since the epoch.
+    """
+    return calendar.timegm(time.strptime(s, '%Y-%m-%d %H:%M:%S'))
+
+
+def count_qsos(database_file_name):
+    """
+    return the number of QSOs in the n1mm_view database, or None if it cannot be read.
+    """
+    if not os.path.exists(database_file_name):
+        return None
+    try:
+        db = n1mm_view_db.connect(database_file_name, n1mm_view_db.DASHBOARD_READ)
+        try:
+            return n1mm_view_db.qso_count(db.cursor())
+        finally:
+            db.close()
+    except sqlite3.Error:
+        return None
+
+
+def schedule(timestamps, mode, speed, rate, rng):
+    """
+    calculate when to send each message, in seconds after the start, according to mode:
+      random -- random delay between QSOs, averaging about 20 per second.
+      speed  -- the original spacing of the QSOs from the log, compressed by speed.
+      rate   -- a fixed number of messages per second.
+      max    -- as fast as possible.
+    """
+    first_timestamp = timestamps[0] if len(timestamps) > 0 else 0
+    offsets = []
+    offset = 0.0
+    for i in range(0, len(timestamps)):
+        if mode == 'speed':
+            offset = (timestamps[i] - first_timestamp) / speed
+        elif mode == 'rate':
+            offset = i / rate
+        elif mode == 'random':
+            offset += rng.random() / 10.0
+        offsets.append(offset)
+    return offsets
+
+
+def send_scheduled(s, address, messages, pace, name):
+    """
+    send (offset, kind, payload) messages at their offsets after now, as fast as possible if not pace.
+    returns a dict of the number of messages sent by kind.
+    """
+    start_time = time.time()
+    sent = {}
+    count = 0
+    for offset, kind, payload in messages:
+        delay = start_time + offset - time.time()
+        if pace and delay > 0:
+            time.sleep(delay)
+        s.sendto(payload, address)
+        sent[kind] = sent.get(kind, 0) + 1
+        count += 1
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug('%s sent %s # %d', name, kind, sent[kind])
+        elif count % PROGRESS_INTERVAL == 0:
+            logging.info('%s sent %d of %d messages', name, count, len(messages))
+    return sent
+
+
+def replay(s, address, payloads, mode, speed, rate, rng):
+    """
+    send the payloads as one stream.
+    returns the number of messages sent.
+    """
+    offsets = schedule([payload[0] for payload in payloads], mode, speed, rate, rng)
+    messages = [(offsets[i], 'contactinfo', payloads[i][2]) for i in range(0, len(payloads))]
+    return send_scheduled(s, address, messages, mode != 'max', 'replayer').get('contactinfo', 0)
+
+
+def radio_info_payloads(station, contact_payload, count, rng):
+    """
+    make count RadioInfo broadcasts showing the radio on the frequency and mode of a contact.
+    """
+    dom = parseString(contact_payload)
+
+    def get(name):
+        node = dom.getElementsByTagName(name)[0].firstChild
+        return '' if node is None else node.nodeValue
+
+    values = (station, int(get('rxfreq')), int(get('txfreq')), get('mode'), get('operator'))
+    return [RADIO_INFO_TEMPLATE % (values + (rng.choice(['True', 'False']), rng.choice(['True', 'False'])))
+            for _ in range(0, count)]
+
+
+def simulate_station(station, payloads, options, seed):
+    """
+    build the message stream for one simulated N1MM+ station:
+    its contacts, duplicate rebroadcasts, later replace and delete edits, and RadioInfo chatter.
+    returns a list of (offset, kind, payload) in send order.
+    """
+    rng = random.Random(seed)
+    offsets = schedule([payload[0] for payload in payloads], options.mode, options.speed,
+                       options.rate / options.station_count, rng)
+    messages = []  # (offset, sequence, kind, payload)
+    sequence = 0
+    for i in range(0, len(payloads)):
+        payload = payloads[i][2]
+        messages.append((offsets[i], sequence, 'contactinfo', payload))
+        sequence += 1
+        if rng.random() < options.duplicates:
+            messages.append((offsets[i], sequence, 'duplicate', payload))
+            sequence += 1
+        if rng.random() < options.edits:
+            later = offsets[min(i + rng.randint(1, 10), len(payloads) - 1)]
+            if rng.random() < 0.5:
+                edit = payload.replace('<comment></comment>', '<comment>edited</comment>')
+                messages.append((later, sequence, 'contactreplace',
+                                 edit.replace('contactinfo>', 'contactreplace>')))
+            else:
+                messages.append((later, sequence, 'contactdelete', payload.replace('contactinfo>', 'contactdelete>')))
+            sequence += 1
+        # RadioInfo chatter is spread evenly until the next contact
+        next_offset = offsets[i + 1] if i + 1 < len(offsets) else offsets[i]
+        radio_infos = radio_info_payloads(station, payload, options.radio_info, rng) if options.radio_info else []
+        for n in range(0, len(radio_infos)):
+            offset = offsets[i] + (next_offset - offsets[i]) * (n + 1) / (len(radio_infos) + 1)
+            messages.append((offset, sequence, 'RadioInfo', radio_infos[n]))
+            sequence += 1
+    messages.sort()
+    return [(message[0], message[2], message[3]) for message in messages]
+
+
+def simulate(address, payloads, options):
+    """
+    split the log by station and replay each station's traffic from its own thread and socket.
+    returns a dict of the number of messages sent by kind.
+    """
+    stations = {}
+    for payload in payloads:
+        stations.setdefault(payload[1], []).append(payload)
+    options.station_count = len(stations)
+    logging.info('simulating %d stations: %s', len(stations), ', '.join(sorted(stations.keys())))
+
+    results = {}
+    threads = []
+    for index, station in enumerate(sorted(stations.keys())):
+        messages = simulate_station(station, stations[station], options, options.seed + index)
+
+        def run(station=station, messages=messages):
+            s = socket(AF_INET, SOCK_DGRAM)
+            s.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
+            results[station] = send_scheduled(s, address, messages, options.mode != 'max', station)
+            s.close()
+
+        threads.append(threading.Thread(name=station, target=run))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    totals = {}
+    for station in sorted(results.keys()):
+        logging.info('%-16s %s', station, ', '.join('%s: %d' % item for item in sorted(results[station].items())))
+        for kind, count in results[station].items():
+            totals[kind] = totals.get(kind, 0) + count
+    return totals
+
+
+# mainline
+def main():
+    """
+    re-play last years logs as UDP broadcasts to load test the collector process
+    """
+    parser = argparse.ArgumentParser(description='replay an N1MM+ log as UDP broadcasts.')
+    parser.add_argument('--mode', choices=['random', 'speed', 'rate', 'max'], default='random',
+                        help='how to pace the messages, default random')
+    parser.add_argument('--speed', type=float, default=60.0,
+                        help='speed mode: how many times faster than real time, default 60')
+    parser.add_argument('--rate', type=float, default=100.0,
+                        help='rate mode: contacts per second, default 100')
+    parser.add_argument('--address', default=N1MM_BROADCAST_ADDRESS,
+                        help='address to send to, broadcast, unicast or loopback, default %s' % N1MM_BROADCAST_ADDRESS)
+    parser.add_argument('--port', type=int, default=N1MM_BROADCAST_PORT,
+                        help='port to send to, default %d' % N1MM_BROADCAST_PORT)
+    parser.add_argument('--seed', type=int, default=1, help='random number seed, default 1')
+    parser.add_argument('--synthetic', type=int, metavar='QSO_COUNT',
+                        help='replay a synthetic log of QSO_COUNT QSOs instead of N1MM_LOG_FILE_NAME')
+    parser.add_argument('--database', default=DATABASE_FILENAME,
+                        help='n1mm_view database to count stored QSOs in, default %s' % DATABASE_FILENAME)
+    parser.add_argument('--simulate', action='store_true',
+                        help='simulate each station (NetBiosName) concurrently from its own thread')
+    parser.add_argument('--duplicates', type=float, default=0.1,
+                        help='simulate: fraction of contacts that are rebroadcast, default 0.1')
+    parser.add_argument('--edits', type=float, default=0.02,
+                        help='simulate: fraction of contacts later replaced or deleted, default 0.02')
+    parser.add_argument('--radio-info', type=int, default=5,
+                        help='simulate: RadioInfo messages per contact, default 5')
+    args = parser.parse_args()
+
+    logging.info('replayer started...')
+
+    if args.synthetic is not None:
+        payloads = load_synthetic_payloads(args.synthetic, args.seed)
+    else:
+        payloads = load_payloads(N1MM_LOG_FILE_NAME)
+    logging.info('%d qsos loaded, replaying to %s:%d in %s mode', len(payloads), args.address, args.port, args.mode)
+
+    rows_before = count_qsos(args.database)
+    t0 = time.time()
+    if args.simulate:
+        totals = simulate((args.address, args.port), payloads, args)
+    else:
+        s = socket(AF_INET, SOCK_DGRAM)
+        s.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
+        totals = {'contactinfo': replay(s, (args.address, args.port), payloads, args.mode, args.speed, args.rate,
+                                        random.Random(args.seed))}
+        s.close()
+    elapsed = time.time() - t0
+
+    sent = sum(totals.values())
+    logging.info('sent %d messages in %.3f seconds, %.1f messages/second (%s)', sent, elapsed,
+                 sent / elapsed if elapsed else 0, ', '.join('%s: %d' % item for item in sorted(totals.items())))
+    if rows_before is not None:
+        # give the collector a moment to catch up
+        time.sleep(REPORT_DELAY)
+        rows_after = count_qsos(args.database)
+        if rows_after is not None:
+            logging.info('collector stored %d new qsos for %d contacts sent', rows_after - rows_before,
+                         totals.get('contactinfo', 0))
 
     logging.info('replayer done...')
 
@@ -0,0 +1,212 @@
+#!/usr/bin/python
+"""
+n1mm_view soak test
+This program runs the dashboard's rendering path for thousands of cycles against a
+synthetic QSO log that grows every cycle, to find memory leaks and slowdowns before
+the event does.
+
+It runs headless, no display is needed: matplotlib uses the Agg backend and pygame
+uses the dummy SDL video driver.  Every cycle calls load_data, which runs every query
+and renders every chart including the section map, and records the RSS, the number of
+open and live matplotlib figures, and the render time.  Python object counts by type
+are sampled every --object-interval cycles.
+
+After the warmup cycles, the test fails if
+  * the RSS grows more than --max-rss-growth megabytes
+  * the number of Python objects grows more than --max-object-growth
+  * any matplotlib figure is left alive after a cycle, more than --max-figures
+  * the median render time of the last tenth of the cycles is more than
+    --max-slowdown times the median of the first tenth
+
+USAGE:
+
+    python soak_test.py [--cycles 2000] [--initial-qsos 1000] [--qsos-per-cycle 20] [--output soak_results.json]
+
+The exit status is 0 if the test passed, 1 if it failed.
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import Queue
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+
+# run headless
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import collector
+import dashboard
+import matplotlib.pyplot as plt
+import synthetic_log
+from n1mm_view_profile import percentile, rss_bytes
+from n1mm_view_constants import *
+from n1mm_view_config import *
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+DEFAULT_OUTPUT = 'soak_results.json'
+CHART_SIZE = (1824, 984)
+
+
+def object_counts():
+    """
+    count the live Python objects by type name
+    """
+    gc.collect()
+    return Counter(type(obj).__name__ for obj in gc.get_objects())
+
+
+def drain(q):
+    """
+    throw away the images load_data queued, as the display would have taken them.
+    """
+    try:
+        while True:
+            q.get_nowait()
+    except Queue.Empty:
+        pass
+
+
+def median_window(values, first):
+    """
+    median of the first or last tenth of values
+    """
+    window = max(len(values) // 10, 1)
+    values = values[:window] if first else values[-window:]
+    return percentile(sorted(values), 0.5)
+
+
+def check(args, cycles, first_objects, last_objects):
+    """
+    check the cycles after warmup against the thresholds, return a list of failures
+    """
+    failures = []
+    measured = cycles[args.warmup:]
+    if len(measured) < 2:
+        return ['not enough cycles after warmup to measure']
+
+    rss_growth = (measured[-1]['rss'] - measured[0]['rss']) / 1048576.0
+    if rss_growth > args.max_rss_growth:
+        failures.append('RSS grew %.1f MB, more than %.1f MB' % (rss_growth, args.max_rss_growth))
+
+    object_growth = sum(last_objects.values()) - sum(first_objects.values())
+    if object_growth > args.max_object_growth:
+        growth = last_objects
+        growth.subtract(first_objects)
+        failures.append('%d more Python objects, more than %d, most grown: %s' % (
+            object_growth, args.max_object_growth,
+            ', '.join('%s +%d' % item for item in growth.most_common(5))))
+
+    figures = max(max(cycle['open_figures'], cycle['live_figures']) for cycle in measured)
+    if figures > args.max_figures:
+        failures.append('%d matplotlib figures left alive after a cycle, more than %d' % (figures, args.max_figures))
+
+    render_times = [cycle['render_time'] for cycle in measured]
+    first = median_window(render_times, True)
+    last = median_window(render_times, False)
+    if first > 0 and last / first > args.max_slowdown:
+        failures.append('render time went from %.3f to %.3f seconds, more than %.1fx slower' % (
+            first, last, args.max_slowdown))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='soak test the n1mm_view dashboard rendering path.')
+    parser.add_argument('--cycles', type=int, default=2000, help='number of render cycles, default 2000')
+    parser.add_argument('--initial-qsos', type=int, default=1000, help='QSOs in the log at the start')
+    parser.add_argument('--qsos-per-cycle', type=int, default=20, help='QSOs added to the log every cycle')
+    parser.add_argument('--warmup', type=int, default=20, help='cycles run before measuring growth')
+    parser.add_argument('--object-interval', type=int, default=50, help='cycles between Python object counts')
+    parser.add_argument('--max-rss-growth', type=float, default=20.0, help='megabytes of RSS growth allowed')
+    parser.add_argument('--max-object-growth', type=int, default=5000, help='Python object growth allowed')
+    parser.add_argument('--max-figures', type=int, default=0, help='matplotlib figures allowed alive after a cycle')
+    parser.add_argument('--max-slowdown', type=float, default=3.0, help='render time slowdown allowed')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='file to write the per-cycle JSON results to')
+    args = parser.parse_args()
+    if args.warmup >= args.cycles:
+        parser.error('--warmup must be less than --cycles')
+
+    logging.info('soak test started, %d cycles...', args.cycles)
+    # do not write PNG files or run the post processing command
+    dashboard.SAVE_PNG = False
+    dashboard.postProcessing = False
+    # every cycle does all of its work, render times of cycles cut short by the query budget would mean nothing
+    dashboard.query_budget.seconds = None
+    dashboard.import_charting()
+
+    total_qsos = args.initial_qsos + args.cycles * args.qsos_per_cycle
+    qsos = synthetic_log.SyntheticLog(total_qsos).qsos()
+    work_dir = tempfile.mkdtemp(prefix='n1mm_view_soak')
+    cycles = []
+    first_objects = None
+    last_objects = None
+    try:
+        database_filename = os.path.join(work_dir, 'n1mm_view.db')
+        db = sqlite3.connect(database_filename)
+        cursor = db.cursor()
+        collector.create_tables(db, cursor)
+        synthetic_log.load_qso_log(db, cursor, [next(qsos) for _ in range(0, args.initial_qsos)])
+        qso_count = args.initial_qsos
+        dashboard.DATABASE_FILENAME = database_filename
+
+        base_map = dashboard.create_map()
+        q = Queue.Queue()
+        for cycle in range(0, args.cycles):
+            synthetic_log.load_qso_log(db, cursor, [next(qsos) for _ in range(0, args.qsos_per_cycle)])
+            qso_count += args.qsos_per_cycle
+
+            t0 = time.time()
+            # a last QSO time of 0 makes load_data render every chart
+            dashboard.load_data(CHART_SIZE, q, base_map, 0)
+            render_time = time.time() - t0
+            drain(q)
+
+            record = {'cycle': cycle,
+                      'qsos': qso_count,
+                      'render_time': render_time,
+                      'rss': rss_bytes() or 0,
+                      'open_figures': len(plt.get_fignums()),
+                      'live_figures': dashboard.live_figure_count(),
+                      }
+            if cycle == args.warmup or (cycle > args.warmup and (cycle - args.warmup) % args.object_interval == 0) \
+                    or cycle == args.cycles - 1:
+                counts = object_counts()
+                record['objects'] = sum(counts.values())
+                if first_objects is None:
+                    first_objects = counts
+                last_objects = counts
+            cycles.append(record)
+            if cycle % 100 == 0:
+                logging.info('cycle %d: %d QSOs, RSS %.1f MB, %.3f seconds', cycle, qso_count,
+                             record['rss'] / 1048576.0, render_time)
+        db.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    failures = check(args, cycles, first_objects, last_objects)
+    with open(args.output, 'w') as f:
+        json.dump({'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()),
+                   'arguments': vars(args),
+                   'failures': failures,
+                   'cycles': cycles}, f, indent=2, sort_keys=True)
+    logging.info('per-cycle results written to %s', args.output)
+
+    for failure in failures:
+        logging.error('FAILED: %s', failure)
+    if failures:
+        return 1
+    logging.info('soak test passed.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+"""
+n1mm_view database stress test
+This program runs a collector-like writer and a dashboard-like reader against the same
+database at the same time, to check that the dashboard's reads do not lock out the
+collector's writes, and the other way around.
+
+The writer process records synthetic QSOs with the collector's own functions, retrying
+locked writes just as the collector does.  The reader process runs the dashboard's query
+set over and over, each time in one read transaction, and checks that every snapshot is
+consistent: the QSO count by band and mode must add up to the QSO count by section.
+
+Both report the number of "database is locked" errors and their latency percentiles.
+The writer also reports the number of locked writes it retried, an error is a write
+that was still locked after DATABASE_WRITE_RETRIES retries.
+Use --no-wal to compare with the rollback journal, and --no-snapshot to run the reader's
+queries outside a transaction.
+
+USAGE:
+
+    python stress_test.py [--seconds 30] [--qsos-per-second 50] [--initial-qsos 10000] [--output stress_results.json]
+
+The exit status is 0 if there were no lock errors and no inconsistent snapshots, 1 otherwise.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import collector
+import n1mm_view_db
+import synthetic_log
+from n1mm_view_profile import percentile
+from n1mm_view_constants import *
+from n1mm_view_config import *
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+DEFAULT_OUTPUT = 'stress_results.json'
+
+def latency_summary(latencies):
+    sorted_latencies = sorted(latencies)
+    return {'count': len(sorted_latencies),
+            'p50': percentile(sorted_latencies, 0.50),
+            'p95': percentile(sorted_latencies, 0.95),
+            'p99': percentile(sorted_latencies, 0.99),
+            'max': sorted_latencies[-1] if sorted_latencies else 0.0,
+            }
+
+
+def writer(database_filename, event_id, qsos, seconds, qsos_per_second, results):
+    """
+    record QSOs at qsos_per_second, as the collector would
+    """
+    db = n1mm_view_db.connect(database_filename, n1mm_view_db.INGEST)
+    cursor = db.cursor()
+    operators = collector.Operators(db, cursor)
+    stations = collector.Stations(db, cursor)
+    latencies = []
+    lock_errors = 0
+    interval = 1.0 / qsos_per_second
+    next_time = time.time()
+    end_time = next_time + seconds
+    for qso in qsos:
+        if next_time >= end_time:
+            break
+        delay = next_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        next_time += interval
+        t0 = time.time()
+        try:
+            collector.write_with_retry(db, collector.record_contact, cursor, operators, stations, event_id,
+                                       time.strptime(qso['timestamp'], '%Y-%m-%d %H:%M:%S'), qso['mycall'],
+                                       qso['band'], qso['mode'], qso['operator'], qso['station'],
+                                       qso['rx_freq'], qso['tx_freq'], qso['call'], qso['rst_sent'],
+                                       qso['rst_recv'], qso['exchange'], qso['section'], qso['comment'])
+            latencies.append(time.time() - t0)
+        except sqlite3.OperationalError as e:
+            lock_errors += 1
+            db.rollback()
+            logging.warn('writer: %s', e)
+    if n1mm_view_db.DATABASE_WAL:
+        n1mm_view_db.checkpoint(db)
+    db.close()
+    results.put(('writer', {'lock_errors': lock_errors, 'lock_retries': collector.write_retry_count,
+                            'latency': latency_summary(latencies)}))
+
+
+def read_queries(cursor, event_id):
+    """
+    run the dashboard's load_data queries, returns True if what they read was consistent
+    """
+    n1mm_view_db.last_qso(cursor, event_id)
+    n1mm_view_db.qsos_by_operator(cursor, event_id)
+    n1mm_view_db.qsos_by_station(cursor, event_id)
+    n1mm_view_db.first_qso_time(cursor, event_id)
+    n1mm_view_db.top_operators_between(cursor, event_id, 0, 2 ** 62)
+    n1mm_view_db.qso_times_and_bands(cursor, event_id)
+    band_mode_total = sum(row[0] for row in n1mm_view_db.qsos_by_band_mode(cursor, event_id))
+    section_total = sum(n1mm_view_db.qsos_by_section(cursor, event_id).values())
+    return band_mode_total == section_total
+
+
+def read_snapshot(db, event_id, snapshot):
+    """
+    run the reader's queries, in one read transaction if snapshot is set
+    """
+    if not snapshot:
+        return read_queries(db.cursor(), event_id)
+    cursor = n1mm_view_db.begin_snapshot(db)
+    try:
+        return read_queries(cursor, event_id)
+    finally:
+        n1mm_view_db.end_snapshot(cursor)
+
+
+def reader(database_filename, event_id, seconds, snapshot, results):
+    """
+    run the dashboard's queries as often as they complete
+    """
+    db = n1mm_view_db.connect(database_filename, n1mm_view_db.DASHBOARD_READ)
+    latencies = []
+    lock_errors = 0
+    inconsistent = 0
+    end_time = time.time() + seconds
+    while time.time() < end_time:
+        t0 = time.time()
+        try:
+            if not read_snapshot(db, event_id, snapshot):
+                inconsistent += 1
+            latencies.append(time.time() - t0)
+        except sqlite3.OperationalError as e:
+            lock_errors += 1
+            logging.warn('reader: %s', e)
+    db.close()
+    results.put(('reader', {'lock_errors': lock_errors,
+                            'inconsistent_snapshots': inconsistent,
+                            'latency': latency_summary(latencies)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='stress test concurrent n1mm_view database reads and writes.')
+    parser.add_argument('--seconds', type=int, default=30, help='length of the test, default 30')
+    parser.add_argument('--qsos-per-second', type=float, default=50, help='writer QSO rate, default 50')
+    parser.add_argument('--initial-qsos', type=int, default=10000, help='QSOs in the log at the start')
+    parser.add_argument('--no-wal', action='store_true', help='use the rollback journal instead of WAL')
+    parser.add_argument('--no-snapshot', action='store_true', help='do not run the reader queries in a transaction')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='file to write the JSON results to')
+    args = parser.parse_args()
+
+    # the ingest profile picks the journal mode
+    n1mm_view_db.DATABASE_WAL = not args.no_wal
+    logging.info('stress test started, %d seconds, %s journal...', args.seconds, 'rollback' if args.no_wal else 'WAL')
+    qso_count = args.initial_qsos + int(args.seconds * args.qsos_per_second) + 1
+    qsos = synthetic_log.SyntheticLog(qso_count).qsos()
+    work_dir = tempfile.mkdtemp(prefix='n1mm_view_stress')
+    try:
+        database_filename = os.path.join(work_dir, 'n1mm_view.db')
+        db = n1mm_view_db.connect(database_filename, n1mm_view_db.INGEST)
+        cursor = db.cursor()
+        collector.create_tables(db, cursor)
+        event_id = n1mm_view_db.active_event_id(db, cursor)
+        synthetic_log.load_qso_log(db, cursor, [next(qsos) for _ in range(0, args.initial_qsos)])
+        db.close()
+
+        # the writer's QSO logging would drown out the results
+        logging.getLogger().setLevel(logging.WARN)
+        results = multiprocessing.Queue()
+        writer_qsos = list(qsos)
+        processes = [multiprocessing.Process(target=writer, args=(database_filename, event_id, writer_qsos,
+                                                                  args.seconds, args.qsos_per_second, results)),
+                     multiprocessing.Process(target=reader, args=(database_filename, event_id, args.seconds,
+                                                                  not args.no_snapshot, results))]
+        for process in processes:
+            process.start()
+        report = dict(results.get() for _ in processes)
+        for process in processes:
+            process.join()
+        logging.getLogger().setLevel(LOG_LEVEL)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report['timestamp'] = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+    report['arguments'] = vars(args)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    logging.info('results written to %s', args.output)
+
+    for name in ['writer', 'reader']:
+        latency = report[name]['latency']
+        retries = ''
+        if 'lock_retries' in report[name]:
+            retries = '%d lock retries, ' % report[name]['lock_retries']
+        logging.info('%s: %d operations, %s%d lock errors, latency p50 %.4f p95 %.4f p99 %.4f max %.4f seconds',
+                     name, latency['count'], retries, report[name]['lock_errors'], latency['p50'], latency['p95'],
+                     latency['p99'], latency['max'])
+    if report['reader']['inconsistent_snapshots']:
+        logging.error('%d inconsistent reader snapshots', report['reader']['inconsistent_snapshots'])
+    if report['writer']['lock_errors'] or report['reader']['lock_errors'] or \
+            report['reader']['inconsistent_snapshots']:
+        return 1
+    logging.info('stress test passed.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
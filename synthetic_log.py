@@ -0,0 +1,191 @@
+"""
+n1mm_view synthetic log generator
+this module makes reproducible synthetic QSO logs for benchmarking and testing n1mm_view.
+the same seed and size always give the same log.
+"""
+
+import calendar
+import random
+import time
+
+import n1mm_view_db
+from n1mm_view_constants import *
+from n1mm_view_config import *
+from n1mm_view_messages import TEMPLATE
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+""" relative activity of each band, roughly what a Field Day log looks like """
+BAND_WEIGHTS = {'1.8': 3, '3.5': 15, '7': 25, '14': 30, '21': 10, '28': 5, '50': 7, '144': 4, '420': 1}
+""" frequency in kHz at the bottom of each band """
+BAND_FREQUENCIES = {'1.8': 1800, '3.5': 3500, '7': 7000, '14': 14000, '21': 21000, '28': 28000,
+                    '50': 50000, '144': 144000, '420': 420000}
+""" relative use of each mode, phone is LSB or USB depending on the band """
+MODE_WEIGHTS = {'CW': 35, 'PHONE': 45, 'FM': 5, 'AM': 2, 'RTTY': 5, 'PSK31': 8}
+""" relative activity by hour of the event, busy start, overnight lull, busy finish """
+HOUR_WEIGHTS = [10, 9, 8, 8, 7, 7, 6, 5, 4, 3, 2, 2, 2, 3, 4, 5, 6, 6, 7, 7, 8, 8, 9, 10]
+CLASSES = ['1A', '2A', '3A', '4A', '5A', '1B', '2B', '1D', '2E', '1E', '3F']
+PREFIXES = ['K', 'N', 'W', 'AA', 'AB', 'KA', 'KB', 'KC', 'KD', 'KE', 'KF', 'KG', 'NA', 'WA', 'WB', 'VE', 'VA']
+LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+MYCALL = 'N4N'
+OPERATOR_COUNT = 30
+STATION_COUNT = 6
+
+
+def _zipf_weights(count, exponent=0.8):
+    """
+    weights for count items where a few items get most of the activity
+    """
+    return [1.0 / (rank + 1) ** exponent for rank in range(0, count)]
+
+
+def _weighted_chooser(rng, items, weights):
+    """
+    return a function that picks from items with the given weights.
+    """
+    cumulative = []
+    total = 0.0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+
+    def choose():
+        r = rng.random() * total
+        lo, hi = 0, len(cumulative) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if cumulative[mid] < r:
+                lo = mid + 1
+            else:
+                hi = mid
+        return items[lo]
+
+    return choose
+
+
+class SyntheticLog:
+    """
+    a deterministic synthetic QSO log.
+    each QSO is a dict with the same fields as a decoded N1MM+ contactinfo message.
+    """
+
+    def __init__(self, qso_count, hours=24, seed=1, start_time=None):
+        self.qso_count = qso_count
+        self.hours = hours
+        self.seed = seed
+        if start_time is None:
+            start_time = calendar.timegm(EVENT_START_TIME.timetuple())
+        self.start_time = start_time
+
+        rng = random.Random(seed)
+        self.operators = ['%s%d%s' % (rng.choice(PREFIXES), rng.randint(0, 9),
+                                      ''.join(rng.choice(LETTERS) for _ in range(0, rng.randint(2, 3))))
+                          for _ in range(0, OPERATOR_COUNT)]
+        self.stations = ['STATION-%d' % (i + 1) for i in range(0, STATION_COUNT)]
+        sections = sorted(CONTEST_SECTIONS.keys())
+        rng.shuffle(sections)
+        self.sections = sections
+
+    def qsos(self):
+        """
+        generate the QSOs in timestamp order.
+        """
+        rng = random.Random(self.seed)
+        choose_band = _weighted_chooser(rng, sorted(BAND_WEIGHTS.keys()),
+                                        [BAND_WEIGHTS[band] for band in sorted(BAND_WEIGHTS.keys())])
+        choose_mode = _weighted_chooser(rng, sorted(MODE_WEIGHTS.keys()),
+                                        [MODE_WEIGHTS[mode] for mode in sorted(MODE_WEIGHTS.keys())])
+        choose_operator = _weighted_chooser(rng, self.operators, _zipf_weights(len(self.operators)))
+        choose_station = _weighted_chooser(rng, self.stations, _zipf_weights(len(self.stations), 0.5))
+        choose_section = _weighted_chooser(rng, self.sections, _zipf_weights(len(self.sections)))
+        choose_hour = _weighted_chooser(rng, range(0, self.hours),
+                                        [HOUR_WEIGHTS[hour * len(HOUR_WEIGHTS) // self.hours]
+                                         for hour in range(0, self.hours)])
+
+        timestamps = sorted(self.start_time + choose_hour() * 3600 + rng.randint(0, 3599)
+                            for _ in range(0, self.qso_count))
+
+        for timestamp in timestamps:
+            band = choose_band()
+            mode = choose_mode()
+            if mode == 'PHONE':
+                mode = 'LSB' if band in ('1.8', '3.5', '7') else 'USB'
+            freq = (BAND_FREQUENCIES[band] + rng.randint(0, 300)) * 100  # N1MM+ units of 10 Hz
+            callsign = '%s%d%s' % (rng.choice(PREFIXES), rng.randint(0, 9),
+                                   ''.join(rng.choice(LETTERS) for _ in range(0, rng.randint(1, 3))))
+            rst = '599' if mode in ('CW', 'RTTY', 'PSK31') else '59'
+            yield {'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(timestamp)),
+                   'mycall': MYCALL,
+                   'band': band,
+                   'mode': mode,
+                   'operator': choose_operator(),
+                   'station': choose_station(),
+                   'rx_freq': freq,
+                   'tx_freq': freq,
+                   'call': callsign,
+                   'rst_sent': rst,
+                   'rst_recv': rst,
+                   'exchange': rng.choice(CLASSES),
+                   'section': choose_section(),
+                   'comment': '',
+                   }
+
+
+def contact_payload(qso):
+    """
+    make an N1MM+ contactinfo broadcast for a synthetic QSO.
+    """
+    return TEMPLATE % (qso['timestamp'], qso['band'], qso['rx_freq'], qso['tx_freq'], qso['operator'],
+                       qso['mode'], qso['call'], '', '', MYCALL, 'NA', qso['rst_sent'], '',
+                       qso['rst_recv'], '', '', qso['exchange'], qso['section'], 0, 1, qso['station'], qso['station'])
+
+
+def load_qso_log(db, cursor, qsos):
+    """
+    write synthetic QSOs into an n1mm_view database, the tables must already exist.
+    may be called again to add more QSOs to the same database.
+    the QSOs belong to the configured event.
+    """
+    # new operators and stations are inserted while qso_log is being inserted, so they need their own cursor.
+    lookup_cursor = db.cursor()
+    operators = n1mm_view_db.Operators(db, lookup_cursor, auto_commit=False)
+    stations = n1mm_view_db.Stations(db, lookup_cursor, auto_commit=False)
+    event_id = n1mm_view_db.active_event_id(db, lookup_cursor)
+
+    def rows():
+        for qso in qsos:
+            yield (calendar.timegm(time.strptime(qso['timestamp'], '%Y-%m-%d %H:%M:%S')), qso['mycall'],
+                   Bands.get_band_number(qso['band']), Modes.get_mode_number(qso['mode']),
+                   operators.lookup_operator_id(qso['operator']), stations.lookup_station_id(qso['station']),
+                   qso['rx_freq'] * 10, qso['tx_freq'] * 10, qso['call'], qso['rst_sent'], qso['rst_recv'],
+                   qso['exchange'], qso['section'], qso['comment'], event_id)
+
+    n1mm_view_db.insert_qsos(cursor, rows())
+    db.commit()
+
+
+def write_n1mm_log(db, qsos, contest_name='FD'):
+    """
+    write synthetic QSOs into an N1MM+ style DXLOG table, with the columns n1mm_view reads.
+    """
+    cursor = db.cursor()
+    cursor.execute('CREATE TABLE IF NOT EXISTS DXLOG\n'
+                   '    (ContestName TEXT, TS TEXT, StationPrefix TEXT, band REAL, Mode TEXT, Operator TEXT,\n'
+                   '     NetBiosName TEXT, Freq REAL, QSXFreq REAL, Call TEXT, SNT TEXT, RCV TEXT, Exchange1 TEXT,\n'
+                   '     Sect TEXT, Comment TEXT, CountryPrefix TEXT, WPXPrefix TEXT, Continent TEXT, SentNr INTEGER,\n'
+                   '     NR INTEGER, GridSquare TEXT, ZN INTEGER, Points INTEGER);')
+
+    def rows():
+        for qso in qsos:
+            yield (contest_name, qso['timestamp'], qso['mycall'], float(qso['band']), qso['mode'], qso['operator'],
+                   qso['station'], qso['rx_freq'] / 100.0, qso['tx_freq'] / 100.0, qso['call'], qso['rst_sent'],
+                   qso['rst_recv'], qso['exchange'], qso['section'], qso['comment'], '', '', 'NA', 0, 0, '', 0, 1)
+
+    cursor.executemany('INSERT INTO DXLOG (ContestName, TS, StationPrefix, band, Mode, Operator, NetBiosName, Freq,\n'
+                       '    QSXFreq, Call, SNT, RCV, Exchange1, Sect, Comment, CountryPrefix, WPXPrefix, Continent,\n'
+                       '    SentNr, NR, GridSquare, ZN, Points)\n'
+                       '    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);', rows())
+    db.commit()